@@ -14,6 +14,8 @@ urlpatterns = [
     path("user/token/refresh/", TokenRefreshView.as_view()),
     # Define a path for user registeration using RegisterView
     path("user/register/", userauths_views.RegisterView.as_view()),
+    # Define a path for bulk user imports using UserImportView
+    path("user/import/", userauths_views.UserImportView.as_view()),
     # Define a path for user password reset using PasswordResetAPI
     path("user/password-reset/<email>/", userauths_views.PasswordResetAPI.as_view()),
     path("user/password-change/", userauths_views.PasswordChangeApi.as_view()),
@@ -22,6 +24,15 @@ urlpatterns = [
     # Endpoints for the store
     path("category/", store_views.CategoryListView.as_view()),
     path("products/", store_views.ProductListView.as_view()),
+    path("products/best-sellers/", store_views.ProductRankingView.as_view()),
+    path(
+        "products/best-sellers/brand/<int:scope_id>/",
+        store_views.ProductRankingView.as_view(scope="brand"),
+    ),
+    path(
+        "products/best-sellers/category/<int:scope_id>/",
+        store_views.ProductRankingView.as_view(scope="category"),
+    ),
     path("products/<slug>/", store_views.ProductDetailView.as_view()),
     path("cart-view/", store_views.CartView.as_view()),
     path("cart-list/<str:cart_id>/<int:user_id>/", store_views.CartListView.as_view()),
@@ -40,9 +51,13 @@ urlpatterns = [
     ),
     path("create-order/", store_views.CreateOrderView.as_view()),
     path("checkout/<order_oid>/", store_views.CheckoutView.as_view()),
+    path("coupon/apply/", store_views.CouponApplyView.as_view()),
+    path("payment/webhook/", store_views.PaymentWebhookView.as_view()),
     path("review/get-reviews/<product_id>/", store_views.ReviewListView.as_view()),
     path("review/create-review/", store_views.CreateReviewView.as_view()),
     path("search/<str:query>/", store_views.SearchProductView.as_view()),
+    path("uploads/", store_views.ChunkedUploadCreateView.as_view()),
+    path("uploads/<str:token>/", store_views.ChunkedUploadView.as_view()),
     path(
         "products/creat-faq/<int:product_id>/",
         store_views.ProductFAQCreateView.as_view(),
@@ -67,6 +82,11 @@ urlpatterns = [
     path("customer/favourites/<user_id>/", customer_views.FavouriteView.as_view()),
     # Endpoints for Brands
     path("brand/create-product/", brand_views.ProductCreateView.as_view()),
+    path("brand/import-products/<brand_id>/", brand_views.ProductImport),
+    path(
+        "brand/bulk-update-products/<brand_id>/",
+        brand_views.ProductBulkUpdate,
+    ),
     path(
         "brand/update-product/<brand_id>/<product_pid>/",
         brand_views.ProductUpdateView.as_view(),
@@ -78,4 +98,7 @@ urlpatterns = [
     path("brand/stats/<brand_id>/", brand_views.BrandStatsView.as_view()),
     path("brand/monthly-orders/<brand_id>/", brand_views.MonthlyOrders),
     path("brand/monthly-product/<brand_id>/", brand_views.MonthlyAddedProducts),
+    path("brand/dashboard/<brand_id>/", brand_views.BrandDashboard),
+    path("brand/analytics/<brand_id>/", brand_views.BrandAnalytics),
+    path("brand/export-order-items/<brand_id>/", brand_views.OrderItemsExport),
 ]
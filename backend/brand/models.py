@@ -16,6 +16,8 @@ class Brand(models.Model):
     )
     image = models.FileField(
         upload_to="brand", default="avenue-image.jpg", blank=True)
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
     name = models.CharField(
         max_length=100, help_text="Brand Name", null=True, blank=True
     )
@@ -1,3 +1,462 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from brand.models import Brand
+from brand.views import top_products
+from store.cache import brand_version, bump_brand_version
+from store.archive import archive_batch
+from store.exports import COLUMNS
+from store.models import (
+    BrandDailyStats, BrandOrder, CartOrder, CartOrderProduct, Picture,
+    Product, ProductSales, Size)
+from userauths.models import User
+
+
+class TopProductsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Tops", slug="tops")
+        other = Brand.objects.create(name="Others", slug="others")
+        cls.shoe, cls.hat, cls.refunded = [
+            Product.objects.create(title=title, brand=cls.brand, slug=title)
+            for title in ("shoe", "hat", "refunded")
+        ]
+        elsewhere = Product.objects.create(
+            title="elsewhere", brand=other, slug="elsewhere")
+        ProductSales.objects.bulk_create([
+            ProductSales(product=cls.shoe, day=date(2024, 1, 1), units=2,
+                         revenue=20),
+            ProductSales(product=cls.shoe, day=date(2024, 1, 3), units=2,
+                         revenue=20),
+            ProductSales(product=cls.hat, day=date(2024, 1, 2), units=3,
+                         revenue=45),
+            ProductSales(product=cls.hat, day=date(2024, 2, 1), units=9,
+                         revenue=90),
+            ProductSales(product=cls.refunded, day=date(2024, 1, 2), units=0,
+                         revenue=0),
+            ProductSales(product=elsewhere, day=date(2024, 1, 2), units=50,
+                         revenue=500),
+        ])
+
+    def test_reads_the_brand_sales_of_the_range(self):
+        with self.assertNumQueries(1):
+            rows = top_products(
+                self.brand.id, date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(
+            [(row["id"], row["units"], row["revenue"]) for row in rows],
+            [(self.shoe.id, 4, Decimal("40.00")),
+             (self.hat.id, 3, Decimal("45.00"))])
+
+
+class BrandVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bumped_when_the_transaction_commits(self):
+        version = brand_version(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                bump_brand_version(1)
+                bump_brand_version(2)
+                self.assertEqual(brand_version(1), version)
+        self.assertNotEqual(brand_version(1), version)
+
+    def test_not_bumped_on_rollback(self):
+        version = brand_version(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    bump_brand_version(1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(brand_version(1), version)
+
+
+class BrandOwnerMixin:
+    def setUp(self):
+        self.owner = User.objects.create(
+            email="owner@example.com", username="owner")
+        self.brand = Brand.objects.create(
+            name="Owned", slug="owned", user=self.owner)
+        self.client.force_authenticate(self.owner)
+
+    def assertOwnerOnly(self, request):
+        self.client.force_authenticate(None)
+        self.assertEqual(request().status_code, 401)
+        self.client.force_authenticate(
+            User.objects.create(email="other@example.com", username="other"))
+        self.assertEqual(request().status_code, 403)
+        self.client.force_authenticate(self.owner)
+
+
+class ProductBulkUpdateTests(BrandOwnerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f"/api/v1/brand/bulk-update-products/{self.brand.id}/"
+        self.shoe, self.hat, self.boot, self.cap = [
+            Product.objects.create(
+                title=title, brand=self.brand, slug=title, price=10)
+            for title in ("shoe", "hat", "boot", "cap")
+        ]
+        self.elsewhere = Product.objects.create(
+            title="elsewhere", slug="elsewhere", price=10,
+            brand=Brand.objects.create(name="Other", slug="other"))
+
+    def post(self, updates):
+        return self.client.post(
+            self.url, {"products": updates}, format="json")
+
+    def test_owner_only(self):
+        self.assertOwnerOnly(
+            lambda: self.post([{"pid": self.shoe.pid, "price": "1.00"}]))
+        self.shoe.refresh_from_db()
+        self.assertEqual(self.shoe.price, 10)
+
+    def test_outcome_of_every_update(self):
+        response = self.post([
+            {"pid": self.shoe.pid, "price": "12.50"},
+            {"pid": self.hat.pid, "price": "10.00"},
+            {"pid": "unknown"},
+            {"pid": self.elsewhere.pid, "stock_qty": 0},
+            {"pid": self.shoe.pid, "stock_qty": 3},
+            {"pid": self.boot.pid, "in_stock": "false"},
+            {"pid": self.cap.pid, "stock_qty": -1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(
+            (body["updated"], body["unchanged"], body["failed"]), (2, 1, 4))
+        results = body["results"]
+        self.assertEqual([result["result"] for result in results], [
+            "updated", "unchanged", "error", "error", "error", "updated",
+            "error"])
+        not_found = {"pid": ["Product not found"]}
+        self.assertEqual(results[2]["errors"], not_found)
+        self.assertEqual(results[3]["errors"], not_found)
+        self.assertEqual(results[4]["errors"], {"pid": ["Duplicate pid"]})
+        self.assertIn("stock_qty", results[6]["errors"])
+
+        self.shoe.refresh_from_db()
+        self.assertEqual(
+            (self.shoe.price, self.shoe.stock_qty), (Decimal("12.50"), 1))
+        self.boot.refresh_from_db()
+        self.assertIs(self.boot.in_stock, False)
+        self.elsewhere.refresh_from_db()
+        self.assertEqual(self.elsewhere.stock_qty, 1)
+
+
+class ProductImportTests(BrandOwnerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f"/api/v1/brand/import-products/{self.brand.id}/"
+
+    def post(self, content=b'{"title": "Shoe"}\n'):
+        return self.client.post(self.url, {
+            "file": SimpleUploadedFile("catalog.jsonl", content)})
+
+    def test_owner_only(self):
+        self.assertOwnerOnly(self.post)
+        self.assertFalse(Product.objects.exists())
+
+    def test_imports_the_file(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual(Product.objects.get().brand, self.brand)
+
+    @override_settings(CATALOG_IMPORT_MAX_UPLOAD=10)
+    def test_large_files_are_left_to_the_command(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("import_catalog", response.json()["file"])
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(IMAGE_VARIANTS={})
+class ProductNestedSaveTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.brand = Brand.objects.create(name="Nested", slug="nested")
+        self.product = Product.objects.create(
+            title="Shoe", brand=self.brand, slug="shoe")
+        self.url = (
+            f"/api/v1/brand/update-product/{self.brand.id}/"
+            f"{self.product.pid}/")
+        self.sizes = {
+            name: Size.objects.create(
+                product=self.product, name=name, price=price)
+            for name, price in (("S", 1), ("M", 2), ("L", 3))
+        }
+
+    def put(self, nested):
+        return self.client.put(
+            self.url, {"title": "Shoe", "slug": "shoe", **nested},
+            format="multipart")
+
+    def size_writes(self, nested):
+        """PUT the form; return the statements writing store_size."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put(nested)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            query["sql"].split()[0] for query in queries.captured_queries
+            if '"store_size"' in query["sql"]
+            and not query["sql"].startswith("SELECT")
+        ]
+
+    def stored_sizes(self):
+        return {
+            size.name: (size.id, size.price)
+            for size in Size.objects.filter(product=self.product)
+        }
+
+    def test_editing_one_size_updates_only_that_row(self):
+        nested = {}
+        for index, (name, size) in enumerate(self.sizes.items()):
+            nested[f"sizes[{index}][id]"] = size.id
+            nested[f"sizes[{index}][name]"] = name
+            nested[f"sizes[{index}][price]"] = size.price
+        nested["sizes[1][price]"] = "5.00"
+        self.assertEqual(self.size_writes(nested), ["UPDATE"])
+        self.assertEqual(self.stored_sizes(), {
+            "S": (self.sizes["S"].id, Decimal("1.00")),
+            "M": (self.sizes["M"].id, Decimal("5.00")),
+            "L": (self.sizes["L"].id, Decimal("3.00")),
+        })
+
+    def test_unmatched_rows_are_deleted_and_new_ones_created(self):
+        writes = self.size_writes({
+            "sizes[0][id]": self.sizes["S"].id,
+            "sizes[0][name]": "S",
+            "sizes[0][price]": "1.00",
+            "sizes[1][name]": "XL",
+            "sizes[1][price]": "4.00",
+            "sizes[2][name]": "XXL",
+            "sizes[2][price]": "5.00",
+        })
+        # One bulk insert and one delete, the unchanged row untouched
+        self.assertEqual(sorted(writes), ["DELETE", "INSERT"])
+        stored = self.stored_sizes()
+        self.assertEqual(set(stored), {"S", "XL", "XXL"})
+        self.assertEqual(stored["S"][0], self.sizes["S"].id)
+
+    def test_rows_without_ids_match_by_name(self):
+        writes = self.size_writes({
+            "sizes[0][name]": "L",
+            "sizes[0][price]": "3.00",
+            "sizes[1][name]": "M",
+            "sizes[1][price]": "2.50",
+            "sizes[2][name]": "S",
+            "sizes[2][price]": "1.00",
+        })
+        self.assertEqual(writes, ["UPDATE"])
+        self.assertEqual(
+            {name: row[0] for name, row in self.stored_sizes().items()},
+            {name: size.id for name, size in self.sizes.items()})
+
+    def test_old_picture_files_are_discarded_after_commit(self):
+        storage = Picture._meta.get_field("image").storage
+        kept, replaced, removed = [
+            Picture.objects.create(
+                product=self.product,
+                image=SimpleUploadedFile(f"{name}.jpg", name.encode()))
+            for name in ("kept", "replaced", "removed")
+        ]
+        old_names = (replaced.image.name, removed.image.name)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.put({
+                "sizes[0][name]": "S",
+                "sizes[0][price]": "1.00",
+                "gallery[0][id]": kept.id,
+                "gallery[1][id]": replaced.id,
+                "gallery[1][image]": SimpleUploadedFile(
+                    "new.jpg", b"new"),
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            sorted(Picture.objects.values_list("id", flat=True)),
+            [kept.id, replaced.id])
+        for name in old_names:
+            self.assertTrue(storage.exists(name))
+        for callback in callbacks:
+            callback()
+        for name in old_names:
+            self.assertFalse(storage.exists(name))
+        replaced.refresh_from_db()
+        self.assertTrue(storage.exists(replaced.image.name))
+        self.assertTrue(storage.exists(kept.image.name))
+
+
+class ChartTests(APITestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Charts", slug="charts")
+        self.url = f"/api/v1/brand/monthly-orders/{self.brand.id}/"
+        # Around the end of 2024: ISO week 1 of 2025 starts on Monday
+        # 2024-12-30
+        BrandDailyStats.objects.bulk_create([
+            BrandDailyStats(brand=self.brand, day=day, orders=1, units=2,
+                            revenue=Decimal("10.25"))
+            for day in (date(2024, 11, 30), date(2024, 12, 1),
+                        date(2024, 12, 29), date(2024, 12, 30),
+                        date(2024, 12, 31), date(2025, 1, 1))
+        ])
+
+    def series(self, granularity, start="2024-11-30", end="2025-01-01"):
+        response = self.client.get(self.url, {
+            "granularity": granularity, "start": start, "end": end})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            (row["period"], row["orders"], row["units"],
+             Decimal(str(row["revenue"])))
+            for row in response.json()
+        ]
+
+    def test_days(self):
+        self.assertEqual(
+            self.series("day", start="2024-12-29", end="2024-12-31"), [
+                ("2024-12-29", 1, 2, Decimal("10.25")),
+                ("2024-12-30", 1, 2, Decimal("10.25")),
+                ("2024-12-31", 1, 2, Decimal("10.25")),
+            ])
+
+    def test_iso_weeks_cross_the_year(self):
+        self.assertEqual(self.series("week"), [
+            ("2024-11-25", 2, 4, Decimal("20.50")),
+            ("2024-12-23", 1, 2, Decimal("10.25")),
+            ("2024-12-30", 3, 6, Decimal("30.75")),
+        ])
+
+    def test_months_and_years(self):
+        self.assertEqual(self.series("month"), [
+            ("2024-11-01", 1, 2, Decimal("10.25")),
+            ("2024-12-01", 4, 8, Decimal("41.00")),
+            ("2025-01-01", 1, 2, Decimal("10.25")),
+        ])
+        self.assertEqual(self.series("year"), [
+            ("2024-01-01", 5, 10, Decimal("51.25")),
+            ("2025-01-01", 1, 2, Decimal("10.25")),
+        ])
+
+    def test_bounds_are_inclusive(self):
+        self.assertEqual(
+            self.series("year", start="2024-12-01", end="2024-12-30"),
+            [("2024-01-01", 3, 6, Decimal("30.75"))])
+
+    def test_invalid_parameters(self):
+        for params in ({"granularity": "hour"}, {"start": "2024-13-01"},
+                       {"end": "yesterday"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(TIME_ZONE="America/New_York")
+    def test_adjust_matches_rebuild_across_local_midnight(self):
+        BrandDailyStats.objects.all().delete()
+        # 2025-01-01 03:00 UTC is still 2024-12-31 in New York
+        paid_at = datetime(2025, 1, 1, 3, tzinfo=dt_timezone.utc)
+        Product.objects.create(
+            title="Late", brand=self.brand, slug="late", date=paid_at)
+        BrandOrder.objects.create(
+            brand=self.brand, oid="late", date=paid_at, sub_total=20,
+            shipping_amount=5, units=2, payment_status="paid")
+        BrandDailyStats.adjust(
+            self.brand.id, date(2024, 12, 31), orders=1, units=2, revenue=25)
+        counted = list(
+            BrandDailyStats.objects.order_by("day").values_list(
+                "day", "orders", "units", "revenue", "products"))
+        self.assertEqual(counted, [
+            (date(2024, 12, 31), 1, 2, Decimal("25.00"), 1)])
+        BrandDailyStats.rebuild(self.brand.id)
+        self.assertEqual(counted, list(
+            BrandDailyStats.objects.order_by("day").values_list(
+                "day", "orders", "units", "revenue", "products")))
+
+
+class OrderItemsExportTests(BrandOwnerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f"/api/v1/brand/export-order-items/{self.brand.id}/"
+        self.product = Product.objects.create(
+            title="Shoe", brand=self.brand, slug="shoe")
+        self.lines = {}
+        for name, when, status in (
+            ("before", datetime(2024, 2, 29, 23, 59), "Pending"),
+            ("first", datetime(2024, 3, 1, 0, 0), "Pending"),
+            ("archived", datetime(2024, 3, 12, 9, 30), "Completed"),
+            ("last", datetime(2024, 3, 15, 23, 59), "Pending"),
+            ("after", datetime(2024, 3, 16, 0, 0), "Pending"),
+        ):
+            when = when.replace(tzinfo=dt_timezone.utc)
+            order = CartOrder.objects.create(
+                date=when, order_status=status, payment_status="paid")
+            self.lines[name] = CartOrderProduct.objects.create(
+                order=order, brand=self.brand, product=self.product, qty=2,
+                price=5, sub_total=10, shipping_amount=1, total=11,
+                size="M", date=when)
+        self.assertEqual(archive_batch(datetime.now(dt_timezone.utc), 10), 1)
+
+    def export(self, **params):
+        params = {"start": "2024-03-01", "end": "2024-03-15", **params}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_owner_only(self):
+        self.assertOwnerOnly(lambda: self.client.get(self.url))
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export())))
+        self.assertEqual(rows[0], list(COLUMNS))
+        # Bounds are inclusive days; archived lines come first
+        self.assertEqual(
+            [row[0] for row in rows[1:]],
+            [self.lines[name].oid for name in ("archived", "first", "last")])
+        line = self.lines["first"]
+        self.assertEqual(dict(zip(rows[0], rows[2])), {
+            "oid": line.oid,
+            "order": line.order.oid,
+            "date": "2024-03-01T00:00:00+00:00",
+            "payment_status": "paid",
+            "order_status": "Pending",
+            "product": self.product.pid,
+            "title": "Shoe",
+            "color": "",
+            "size": "M",
+            "qty": "2",
+            "price": "5.00",
+            "sub_total": "10.00",
+            "shipping_amount": "1.00",
+            "tax_fee": "0.00",
+            "service_fee": "0.00",
+            "total": "11.00",
+            "amount_saved": "0.00",
+        })
+
+    def test_ndjson(self):
+        lines = self.export(file_type="ndjson").splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [record["oid"] for record in records],
+            [self.lines[name].oid for name in ("archived", "first", "last")])
+        self.assertEqual(list(records[0]), list(COLUMNS))
+        self.assertEqual(records[0]["order_status"], "Completed")
+        self.assertEqual(records[0]["total"], "11.00")
+
+    def test_invalid_file_type(self):
+        response = self.client.get(self.url, {"file_type": "xlsx"})
+        self.assertEqual(response.status_code, 400)
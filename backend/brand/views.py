@@ -1,24 +1,71 @@
-from store.models import Product, CartOrder, CartOrderProduct, Brand
+from store.models import (
+    Product,
+    BrandDailyStats,
+    BrandStats,
+    Brand,
+    ProductSales,
+)
+from store.cache import brand_version
+from store.catalog import (
+    FORMATS as CATALOG_FORMATS,
+    CatalogImport,
+    bulk_update_products,
+)
+from store.exports import FORMATS, export_chunks
+from store.analytics import brand_analytics
+from store.snapshots import current_source, reporting_view
+from store.nested import parse_nested, save_nested
+from store.uploads import claimed_files
 from store.serializer import (
     ProductSerializer,
-    PictureSerializer,
-    SpecificationSerializer,
-    ColorSerializer,
-    SizeSerializer,
     BrandStatsSerializer,
 )
 from brand.models import Brand
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.db import models, transaction
-from django.db.models.functions import ExtractMonth
+from django.db.models.functions import TruncWeek, TruncMonth, TruncYear
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from collections import Counter
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
 from rest_framework import generics, status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.exceptions import (
+    NotFound, PermissionDenied, ValidationError)
+from rest_framework.decorators import api_view, permission_classes
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
 
+def brand_stats(brand_id):
+    """
+    Return the materialized totals of a brand, building them on first use.
+    """
+    # Single primary key read of the materialized totals
+    stats = (
+        BrandStats.objects.filter(pk=brand_id)
+        .values("products", "orders", "income")
+        .first()
+    )
+    if stats is None:
+        try:
+            brand = Brand.objects.get(id=brand_id)
+        except Brand.DoesNotExist:
+            raise NotFound("Brand does not exist")
+        stats = BrandStats.rebuild(brand.id)
+        stats = {
+            "products": stats.products,
+            "orders": stats.orders,
+            "income": stats.income,
+        }
+    return stats
+
+
 class BrandStatsView(generics.ListAPIView):
     """
     Retrieve statistics for a brand.
@@ -49,35 +96,8 @@ class BrandStatsView(generics.ListAPIView):
         """
         Method to retrieve summary statistics for a brand.
         """
-        brand_id = self.kwargs["brand_id"]
-        brand = Brand.objects.get(id=brand_id)
-
-        # Calculate summary
-        product_count = Product.objects.filter(brand=brand).count()
-        order_count = CartOrder.objects.filter(
-            brand=brand, payment_status="paid"
-        ).count()
-        income = (
-            CartOrderProduct.objects.filter(
-                brand=brand, order__payment_status="paid"
-            ).aggregate(
-                total_income=models.Sum(
-                    models.F("sub_total") + models.F("shipping_amount")
-                )
-            )[
-                "total_income"
-            ]
-            or 0
-        )
-
         # Return list
-        return [
-            {
-                "products": product_count,
-                "orders": order_count,
-                "income": income
-                }
-            ]
+        return [brand_stats(self.kwargs["brand_id"])]
 
     @swagger_auto_schema(
         operation_summary="List Brand Statistics",
@@ -103,17 +123,92 @@ class BrandStatsView(generics.ListAPIView):
         return Response(serializer.data)
 
 
+TRUNCATE = {
+    "day": None,
+    "week": TruncWeek,
+    "month": TruncMonth,
+    "year": TruncYear,
+}
+
+chart_parameters = [
+    openapi.Parameter(
+        "start", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description="First day (default: one year before end)",
+    ),
+    openapi.Parameter(
+        "end", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE, description="Last day (default: today)",
+    ),
+    openapi.Parameter(
+        "granularity", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        enum=list(TRUNCATE), description="Bucket size (default: month)",
+    ),
+]
+
+
+def check_brand_owner(request, brand_id):
+    """
+    Let only the owner of a brand through: 404 for an unknown brand, 403
+    for anyone else. Reads the owner's id, not the requesting user's row.
+    """
+    owners = list(
+        Brand.objects.filter(id=brand_id).values_list("user_id", flat=True))
+    if not owners:
+        raise NotFound("Brand does not exist")
+    if owners[0] is None or owners[0] != request.user.pk:
+        raise PermissionDenied("Only the owner of the brand may do this")
+
+
+def _query_date(request, name, default):
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: "Use the YYYY-MM-DD format"})
+    return day
+
+
+def rollup_series(request, brand_id, fields):
+    """
+    Sum the brand's daily rollup rows for `fields` into periods of the
+    requested granularity within the requested date range.
+    """
+    granularity, start, end = chart_range(request)
+
+    rows = BrandDailyStats.objects.filter(
+        brand_id=brand_id, day__range=(start, end))
+    truncate = TRUNCATE[granularity]
+    period = truncate("day") if truncate else models.F("day")
+    series = list(
+        rows.annotate(period=period)
+        .values("period")
+        .annotate(**{field: models.Sum(field) for field in fields})
+        .order_by("period")
+    )
+    if "revenue" in fields:
+        # SQLite sums decimals as floats, round back to cents
+        for row in series:
+            row["revenue"] = row["revenue"].quantize(Decimal("0.01"))
+    return series
+
+
 @swagger_auto_schema(
     methods=["GET"],
-    operation_summary="Get Monthly Orders for a Brand",
-    operation_description="Retrieve monthly order statistics"
-    "for a specific brand.",
+    operation_summary="Get Orders over time for a Brand",
+    operation_description="Retrieve paid orders, units sold and revenue "
+    "per day, week, month or year for a specific brand.",
+    manual_parameters=chart_parameters,
     responses={
         200: openapi.Response(
-            description="OK - Returns monthly order statistics"
+            description="OK - Returns order statistics per period "
             "for the specified brand."
         ),
-        404: openapi.Response(description="Not Found - Brand not found."),
+        400: openapi.Response(description="Bad Request - Invalid range."),
         500: openapi.Response(description="Server Error - Internal"
                               "server error."),
     },
@@ -121,30 +216,24 @@ class BrandStatsView(generics.ListAPIView):
 @api_view(("GET",))
 def MonthlyOrders(request, brand_id):
     """
-    Get the Monthly Orders from this brand-- Chart(stats)
+    Get the Orders from this brand per period-- Chart(stats)
     """
-    brand = Brand.objects.get(id=brand_id)
-    orders = CartOrder.objects.filter(brand=brand, payment_status="paid")
-    orders_month = (
-        orders.annotate(month=ExtractMonth("date"))
-        .values("month")
-        .annotate(orders=models.Count("id"))
-        .order_by("month")
-    )
-    return Response(orders_month)
+    return Response(
+        rollup_series(request, brand_id, ["orders", "units", "revenue"]))
 
 
 @swagger_auto_schema(
     methods=["GET"],
-    operation_summary="Get Monthly Added Products for a Brand",
-    operation_description="Retrieve monthly added product statistics"
-    "for a specific brand.",
+    operation_summary="Get Added Products over time for a Brand",
+    operation_description="Retrieve added products per day, week, month "
+    "or year for a specific brand.",
+    manual_parameters=chart_parameters,
     responses={
         200: openapi.Response(
-            description="OK - Returns monthly added product statistics"
+            description="OK - Returns added product statistics per period "
             "for the specified brand."
         ),
-        404: openapi.Response(description="Not Found - Brand not found."),
+        400: openapi.Response(description="Bad Request - Invalid range."),
         500: openapi.Response(
             description="Server Error - Internal server error."),
     },
@@ -152,17 +241,196 @@ def MonthlyOrders(request, brand_id):
 @api_view(("GET",))
 def MonthlyAddedProducts(request, brand_id):
     """
-    Get Monthly Added Products for a Brand
+    Get Added Products for a Brand per period
+    """
+    return Response(rollup_series(request, brand_id, ["products"]))
+
+
+def chart_range(request):
+    """
+    Read the granularity, start and end query parameters.
+    """
+    granularity = request.query_params.get("granularity", "month")
+    if granularity not in TRUNCATE:
+        raise ValidationError(
+            {"granularity": f"Choose one of {', '.join(TRUNCATE)}"})
+    end = _query_date(request, "end", timezone.localdate())
+    start = _query_date(request, "start", end - timedelta(days=365))
+    return granularity, start, end
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def top_products(brand_id, start, end, limit=5):
+    """
+    Best selling products of a brand by units sold in paid orders, from
+    the per-day totals of ProductSales (as of the last collect_sales
+    run).
+    """
+    rows = (
+        ProductSales.objects.filter(
+            product__brand_id=brand_id, day__gte=start, day__lte=end)
+        .values("product_id", "product__title", "product__slug")
+        .annotate(units=models.Sum("units"), revenue=models.Sum("revenue"))
+        .filter(units__gt=0)
+        .order_by("-units", "product_id")[:limit]
+    )
+    return [
+        {
+            "id": row["product_id"],
+            "title": row["product__title"],
+            "slug": row["product__slug"],
+            "units": row["units"],
+            "revenue": row["revenue"].quantize(Decimal("0.01")),
+        }
+        for row in rows
+    ]
+
+
+@swagger_auto_schema(
+    methods=["GET"],
+    operation_summary="Get the Dashboard of a Brand",
+    operation_description="Retrieve the summary statistics, orders and "
+    "added products per period and the best selling products of a brand "
+    "in one response. Responses are cached until the brand's orders or "
+    "products change.",
+    manual_parameters=chart_parameters,
+    responses={
+        200: openapi.Response(
+            description="OK - Returns the dashboard of the specified brand."
+        ),
+        400: openapi.Response(description="Bad Request - Invalid range."),
+        404: openapi.Response(description="Not Found - Brand not found."),
+        500: openapi.Response(
+            description="Server Error - Internal server error."),
+    },
+)
+@api_view(("GET",))
+def BrandDashboard(request, brand_id):
+    """
+    Get everything the brand dashboard shows in a single request
+    """
+    granularity, start, end = chart_range(request)
+    key = (
+        f"brand-dashboard:{brand_id}:{brand_version(brand_id)}:"
+        f"{granularity}:{start}:{end}"
+    )
+    dashboard = cache.get(key)
+    if dashboard is None:
+        # One rollup query feeds both charts
+        series = rollup_series(
+            request, brand_id, ["orders", "units", "revenue", "products"])
+        dashboard = {
+            "stats": BrandStatsSerializer(brand_stats(brand_id)).data,
+            "orders": [
+                {field: row[field]
+                 for field in ("period", "orders", "units", "revenue")}
+                for row in series
+            ],
+            "products": [
+                {"period": row["period"], "products": row["products"]}
+                for row in series
+            ],
+            "top_products": top_products(brand_id, start, end),
+        }
+        cache.set(key, dashboard, settings.BRAND_DASHBOARD_CACHE_TIMEOUT)
+    return Response(dashboard)
+
+
+@reporting_view
+@swagger_auto_schema(
+    methods=["GET"],
+    operation_summary="Get Revenue Analytics for a Brand",
+    operation_description="Retrieve daily revenue with 7 and 28 day moving "
+    "averages, the repeat customer rate, the order value distribution and "
+    "monthly cohort retention of a brand between two dates.",
+    manual_parameters=chart_parameters[:2],
+    responses={
+        200: openapi.Response(
+            description="OK - Returns the analytics of the specified brand."
+        ),
+        400: openapi.Response(description="Bad Request - Invalid range."),
+        404: openapi.Response(description="Not Found - Brand not found."),
+    },
+)
+@api_view(("GET",))
+def BrandAnalytics(request, brand_id):
+    """
+    Get revenue analytics for a brand, cached until its orders change.
+    Reads go to the reporting snapshot when it is fresh enough.
     """
-    brand = Brand.objects.get(id=brand_id)
-    products = Product.objects.filter(brand=brand)
-    products_month = (
-        products.annotate(month=ExtractMonth("date"))
-        .values("month")
-        .annotate(products=models.Count("id"))
-        .order_by("month")
+    if not Brand.objects.filter(id=brand_id).exists():
+        raise NotFound("Brand does not exist")
+    end = _query_date(request, "end", timezone.localdate())
+    start = _query_date(request, "start", end - timedelta(days=365))
+    if start > end:
+        raise ValidationError({"start": "Must not be after end"})
+
+    key = (
+        f"brand-analytics:{brand_id}:{brand_version(brand_id)}:"
+        f"{start}:{end}"
     )
-    return Response(products_month)
+    source = current_source()
+    cached = cache.get(key)
+    if cached is None:
+        cached = (source["as_of"], brand_analytics(brand_id, start, end))
+        cache.set(key, cached, settings.BRAND_DASHBOARD_CACHE_TIMEOUT)
+    # Report the age of the data that was cached
+    source["as_of"], analytics = cached
+    return Response(analytics)
+
+
+@reporting_view
+@swagger_auto_schema(
+    methods=["GET"],
+    operation_summary="Export Order Items of a Brand",
+    operation_description="Stream every order line of a brand between "
+    "two dates as CSV or newline delimited JSON.",
+    manual_parameters=chart_parameters[:2] + [
+        openapi.Parameter(
+            "file_type", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+            enum=list(FORMATS), description="Output format (default: csv)",
+        ),
+    ],
+    responses={
+        200: openapi.Response(
+            description="OK - Streams the order lines of the brand."
+        ),
+        400: openapi.Response(description="Bad Request - Invalid range."),
+        403: openapi.Response(description="Forbidden - Not the brand owner."),
+        404: openapi.Response(description="Not Found - Brand not found."),
+    },
+)
+@api_view(("GET",))
+@permission_classes((IsAuthenticated,))
+def OrderItemsExport(request, brand_id):
+    """
+    Stream the order lines of a brand to its owner, a chunk of rows at a
+    time, from the reporting snapshot when it is fresh enough
+    """
+    check_brand_owner(request, brand_id)
+    file_type = request.query_params.get("file_type", "csv")
+    if file_type not in FORMATS:
+        raise ValidationError(
+            {"file_type": f"Choose one of {', '.join(FORMATS)}"})
+    end = _query_date(request, "end", timezone.localdate())
+    start = _query_date(request, "start", end - timedelta(days=365))
+
+    response = StreamingHttpResponse(
+        export_chunks(
+            brand_id,
+            _day_start(start),
+            _day_start(end + timedelta(days=1)),
+            file_type,
+        ),
+        content_type=FORMATS[file_type],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="brand-{brand_id}-{start}-{end}.{file_type}"'
+    )
+    return response
 
 
 class ProductCreateView(generics.CreateAPIView):
@@ -176,64 +444,11 @@ class ProductCreateView(generics.CreateAPIView):
     @transaction.atomic
     def perform_create(self, serializer):
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        product_instance = serializer.instance
-
-        specifications_data = []
-        colors_data = []
-        sizes_data = []
-        picture_data = []
-        # Loop through the keys of self.request.data
-        for key, value in self.request.data.items():
-            # Example key: specifications[0][title]
-            if key.startswith("specifications") and "[title]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                title = value
-                content_key = f"specifications[{index}][content]"
-                content = self.request.data.get(content_key)
-                specifications_data.append(
-                    {"title": title, "content": content})
-
-            # Example key: colors[0][name]
-            elif key.startswith("colors") and "[name]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                name = value
-                color_code_key = f"colors[{index}][color_code]"
-                color_code = self.request.data.get(color_code_key)
-                colors_data.append({"name": name, "color_code": color_code})
-
-            # Example key: sizes[0][name]
-            elif key.startswith("sizes") and "[name]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                name = value
-                price_key = f"sizes[{index}][price]"
-                price = self.request.data.get(price_key)
-                sizes_data.append({"name": name, "price": price})
-
-            # Example key: gallery[0][image]
-            elif key.startswith("gallery") and "[image]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                image = value
-                picture_data.append({"image": image})
-
-        # Log or print the data for debugging
-        print("specifications_data:", specifications_data)
-        print("colors_data:", colors_data)
-        print("sizes_data:", sizes_data)
-        print("picture_data:", picture_data)
-
-        # Save nested serializers with the product instance
-        self.save_nested_data(
-            product_instance, SpecificationSerializer, specifications_data
-        )
-        self.save_nested_data(product_instance, ColorSerializer, colors_data)
-        self.save_nested_data(product_instance, SizeSerializer, sizes_data)
-        self.save_nested_data(
-            product_instance, PictureSerializer, picture_data)
+        nested = parse_nested(self.request.data)
+        serializer.save(**claimed_files(serializer, self.request.data))
+
+        # Save nested rows with the product instance
+        save_nested(serializer.instance, nested)
 
     @swagger_auto_schema(
         operation_summary="Create Product with Required Fields",
@@ -303,6 +518,11 @@ class ProductCreateView(generics.CreateAPIView):
                 "pid": openapi.Schema(
                     type=openapi.TYPE_STRING, description="Product ID"
                 ),
+                "image_upload": openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description="Token of a chunked upload to use as the "
+                    "image",
+                ),
                 "date": openapi.Schema(
                     type=openapi.FORMAT_DATETIME,
                     description="Date of creation",
@@ -324,16 +544,127 @@ class ProductCreateView(generics.CreateAPIView):
     def post(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
 
-    def save_nested_data(self, product_instance, serializer_class, data):
-        """
-        Save product
-        """
-        serializer = serializer_class(
-            data=data, many=True,
-            context={"product_instance": product_instance}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(product=product_instance)
+
+@swagger_auto_schema(
+    methods=["POST"],
+    operation_summary="Import a Catalog of Products",
+    operation_description="Create the products of a CSV or JSON Lines file "
+    "with their specifications, colors, sizes and gallery. Sending the "
+    "same file again resumes an interrupted import. Larger files than "
+    "CATALOG_IMPORT_MAX_UPLOAD are imported with the import_catalog "
+    "command.",
+    manual_parameters=[
+        openapi.Parameter(
+            "file", openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
+            description="Catalog file, one product per record",
+        ),
+        openapi.Parameter(
+            "file_type", openapi.IN_FORM, type=openapi.TYPE_STRING,
+            enum=list(CATALOG_FORMATS),
+            description="File format (default: from the file name)",
+        ),
+    ],
+    responses={
+        200: openapi.Response(
+            description="OK - Products created, with per-row errors."
+        ),
+        400: openapi.Response(
+            description="Bad Request - Missing or too large file."),
+        403: openapi.Response(description="Forbidden - Not the brand owner."),
+        404: openapi.Response(description="Not Found - Brand not found."),
+    },
+)
+@api_view(("POST",))
+@permission_classes((IsAuthenticated,))
+def ProductImport(request, brand_id):
+    """
+    Import a brand's products from an uploaded catalog file in batches,
+    for the brand's owner. The import runs in the request, so files are
+    capped at CATALOG_IMPORT_MAX_UPLOAD bytes
+    """
+    check_brand_owner(request, brand_id)
+    upload = request.FILES.get("file")
+    if upload is None:
+        raise ValidationError({"file": "Upload a CSV or JSON Lines file"})
+    limit = getattr(settings, "CATALOG_IMPORT_MAX_UPLOAD", 2 * 2**20)
+    if upload.size > limit:
+        raise ValidationError({"file": (
+            f"Files over {limit:,} bytes are imported with the "
+            "import_catalog command")})
+    file_type = request.data.get(
+        "file_type", upload.name.rsplit(".", 1)[-1].lower())
+    if file_type not in CATALOG_FORMATS:
+        raise ValidationError(
+            {"file_type": f"Choose one of {', '.join(CATALOG_FORMATS)}"})
+
+    catalog = CatalogImport(int(brand_id), upload.file, file_type)
+    for _ in catalog.run():
+        pass
+    return Response(catalog.summary())
+
+
+@swagger_auto_schema(
+    methods=["POST"],
+    operation_summary="Update Prices and Stock of Many Products",
+    operation_description="Change price, old_price, stock_qty, in_stock "
+    "and status of a brand's products by pid. Returns the outcome of "
+    "every update in the order sent.",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "products": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "pid": openapi.Schema(type=openapi.TYPE_STRING),
+                        "price": openapi.Schema(type=openapi.TYPE_NUMBER),
+                        "old_price": openapi.Schema(
+                            type=openapi.TYPE_NUMBER),
+                        "stock_qty": openapi.Schema(
+                            type=openapi.TYPE_INTEGER),
+                        "in_stock": openapi.Schema(
+                            type=openapi.TYPE_BOOLEAN),
+                        "status": openapi.Schema(type=openapi.TYPE_STRING),
+                    },
+                    required=["pid"],
+                ),
+            ),
+        },
+        required=["products"],
+    ),
+    responses={
+        200: openapi.Response(
+            description="OK - Outcome of every update."
+        ),
+        400: openapi.Response(description="Bad Request - No update list."),
+        403: openapi.Response(description="Forbidden - Not the brand owner."),
+        404: openapi.Response(description="Not Found - Brand not found."),
+    },
+)
+@api_view(("POST",))
+@permission_classes((IsAuthenticated,))
+def ProductBulkUpdate(request, brand_id):
+    """
+    Update prices, stock and status of many products of a brand at once,
+    for the brand's owner
+    """
+    check_brand_owner(request, brand_id)
+    updates = (
+        request.data.get("products") if isinstance(request.data, dict)
+        else None
+    )
+    if not isinstance(updates, list):
+        raise ValidationError({"products": "Send a list of updates"})
+
+    results = bulk_update_products(int(brand_id), updates)
+    counts = Counter(result["result"] for result in results)
+    return Response({
+        "updated": counts["updated"],
+        "unchanged": counts["unchanged"],
+        "failed": counts["error"],
+        "results": results,
+    })
 
 
 class ProductUpdateView(generics.RetrieveUpdateAPIView):
@@ -361,79 +692,15 @@ class ProductUpdateView(generics.RetrieveUpdateAPIView):
         # Deserialize product data
         serializer = self.get_serializer(product, data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-
-        # Delete all existing nested data
-        product.specification().delete()
-        product.color().delete()
-        product.size().delete()
-        product.picture().delete()
-
-        specifications_data = []
-        colors_data = []
-        sizes_data = []
-        picture_data = []
-        # Loop through the keys of self.request.data
-        for key, value in self.request.data.items():
-            # Example key: specifications[0][title]
-            if key.startswith("specifications") and "[title]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                title = value
-                content_key = f"specifications[{index}][content]"
-                content = self.request.data.get(content_key)
-                specifications_data.append(
-                    {"title": title, "content": content})
-
-            # Example key: colors[0][name]
-            elif key.startswith("colors") and "[name]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                name = value
-                color_code_key = f"colors[{index}][color_code]"
-                color_code = self.request.data.get(color_code_key)
-                colors_data.append({"name": name, "color_code": color_code})
-
-            # Example key: sizes[0][name]
-            elif key.startswith("sizes") and "[name]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                name = value
-                price_key = f"sizes[{index}][price]"
-                price = self.request.data.get(price_key)
-                sizes_data.append({"name": name, "price": price})
-
-            # Example key: gallery[0][image]
-            elif key.startswith("gallery") and "[image]" in key:
-                # Extract index from key
-                index = key.split("[")[1].split("]")[0]
-                image = value
-                picture_data.append({"image": image})
-
-        # Log or print the data for debugging
-        print("specifications_data:", specifications_data)
-        print("colors_data:", colors_data)
-        print("sizes_data:", sizes_data)
-        print("picture_data:", picture_data)
-
-        # Save nested serializers with the product instance
-        self.save_nested_data(
-            product, SpecificationSerializer, specifications_data)
-        self.save_nested_data(product, ColorSerializer, colors_data)
-        self.save_nested_data(product, SizeSerializer, sizes_data)
-        self.save_nested_data(product, PictureSerializer, picture_data)
-
-    def save_nested_data(self, product_instance, serializer_class, data):
-        """
-        Save updated product
-        """
-        serializer = serializer_class(
-            data=data,
-            many=True,
-            context={"product_instance": product_instance}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(product=product_instance)
+        nested = parse_nested(request.data)
+        # The product image may be a finished chunked upload
+        serializer.save(**claimed_files(serializer, request.data))
+
+        # Reconcile the nested rows with what was sent, touching only the
+        # rows that changed
+        save_nested(product, nested)
+
+        return Response(self.get_serializer(product).data)
 
 
 class ProductDeleteView(generics.DestroyAPIView):
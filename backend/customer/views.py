@@ -1,5 +1,9 @@
-from store.models import Product, CartOrder, Favorite
-from store.serializer import CartOrderSerializer, FavouriteSerializer
+from store.models import Product, CartOrder, ArchivedCartOrder, Favorite
+from store.serializer import (
+    CartOrderSerializer,
+    ArchivedCartOrderSerializer,
+    FavouriteSerializer,
+)
 from userauths.models import User
 
 from rest_framework import generics, status
@@ -74,9 +78,17 @@ class OrdersDetailView(generics.RetrieveAPIView):
             user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             raise NotFound("User does not exist ")
-        order = CartOrder.objects.get(
-            buyer=user, payment_status="pending", oid=order_oid
-        )
+        try:
+            order = CartOrder.objects.get(
+                buyer=user, payment_status="pending", oid=order_oid
+            )
+        except CartOrder.DoesNotExist:
+            # Archived orders are closed, so they are only matched by oid
+            try:
+                order = ArchivedCartOrder.objects.get(
+                    buyer=user, oid=order_oid)
+            except ArchivedCartOrder.DoesNotExist:
+                raise NotFound("Order does not exist")
         return order
 
     @swagger_auto_schema(
@@ -101,7 +113,10 @@ class OrdersDetailView(generics.RetrieveAPIView):
         Retrieve details of a specific order by a user.
         """
         instance = self.get_object()
-        serializer = self.serializer_class(instance)
+        if isinstance(instance, ArchivedCartOrder):
+            serializer = ArchivedCartOrderSerializer(instance)
+        else:
+            serializer = self.serializer_class(instance)
         return Response(serializer.data)
 
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -89,11 +90,38 @@ WSGI_APPLICATION = 'riz_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Reporting views (exports, analytics) read a snapshot of the database
+# taken by the refresh_snapshot command, as long as it is at most
+# REPORTING_MAX_STALENESS seconds old (see store/snapshots.py).
+REPORTING_SNAPSHOT_PATH = BASE_DIR / 'reporting.sqlite3'
+REPORTING_MAX_STALENESS = 60 * 15
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Migrations are made locally, not kept in the repository: test
+        # databases are created from the models
+        'TEST': {'MIGRATE': False},
+    },
+    'reporting': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{REPORTING_SNAPSHOT_PATH}?mode=ro',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['store.routers.ReportingRouter']
+
+# Shared by the worker processes of a host, so a brand's cache version
+# bump (see store/cache.py) reaches all of them. With several hosts, use
+# a network cache (Redis, Memcached) instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    },
 }
 
 
@@ -115,6 +143,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Logins load the user's brand with the user (see
+# userauths/authentication.py).
+AUTHENTICATION_BACKENDS = [
+    'userauths.authentication.LoginBackend',
+]
+
+# The first hasher hashes new passwords; passwords hashed by the others,
+# or with other parameters, are rehashed at their user's next login.
+PASSWORD_HASHERS = [
+    'userauths.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 iterations per password (None: Django's default, 600,000 in
+# Django 4.2). Each login costs about this many SHA256 rounds.
+PASSWORD_HASH_ITERATIONS = None
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -138,6 +186,55 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored once per distinct content (see store/storage.py).
+# Image variants are named after their original, so they go through a
+# plain file system storage.
+STORAGES = {
+    'default': {
+        'BACKEND': 'store.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'variants': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+}
+
+REST_FRAMEWORK = {
+    # Bearer tokens first; reads trust the token's claims instead of
+    # loading the user (see userauths/authentication.py)
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'userauths.authentication.TokenClaimsAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+    # Token buckets for the views with a throttle_scope, per user or IP
+    # (see store/throttling.py)
+    'DEFAULT_THROTTLE_CLASSES': (
+        'store.throttling.BucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'register': '10/hour',
+        'password-reset': '5/hour',
+        'password-change': '10/hour',
+        'cart': '120/minute',
+        'uploads': '600/minute',
+    },
+    # Anonymous clients are throttled by IP: the number of reverse proxies
+    # in front of the app, whose X-Forwarded-For entries can be trusted.
+    # 0 uses the connection's address and ignores the header, which any
+    # client can set.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+# Set to False to load and check the user on every request with a token.
+JWT_TRUST_CLAIMS_ON_READ = True
+
+# Product forms send every specification, color, size and picture as
+# separate fields; leave room for products with hundreds of variants.
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10_000
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 AUTH_USER_MODEL = 'userauths.User'
@@ -179,6 +276,8 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+
+    'TOKEN_REFRESH_SERIALIZER': 'userauths.blacklist.TokenRefreshSerializer',
 }
 
 JAZZMIN_SETTINGS = {
@@ -225,4 +324,81 @@ JAZZMIN_UI_TWEAKS = {
         "success": "btn-outline-success"
     },
     "actions_sticky_top": False
-}
\ No newline at end of file
+}
+
+
+# Generator for public product/order/picture ids (see store/ids.py).
+# Every process locks a worker id of its host's ID_WORKER_IDS range
+# ("first-last", within 0-1023) in ID_WORKER_LOCK_DIR (None: under the
+# temporary directory). Hosts sharing a database need disjoint ranges;
+# in production the range must come from the environment.
+ID_GENERATOR = "store.ids.SnowflakeGenerator"
+ID_WORKER_IDS = os.environ.get("ID_WORKER_IDS", "0-1023" if DEBUG else None)
+ID_WORKER_LOCK_DIR = None
+
+# Payment gateway webhooks (see store/payments.py). Every event must carry
+# an HMAC-SHA256 X-Riz-Signature header made with the secret; until the
+# secret is set, all events are refused.
+PAYMENT_WEBHOOK_SECRET = os.environ.get("PAYMENT_WEBHOOK_SECRET")
+PAYMENT_EVENT_WORKERS = 4
+
+# Cached brand dashboards and analytics are invalidated on writes (see
+# store/cache.py); the timeout only bounds staleness of product titles
+# and slugs.
+BRAND_DASHBOARD_CACHE_TIMEOUT = 60 * 5
+
+# Rows fetched per database round trip and written per response chunk by
+# the streaming order exports (see store/exports.py).
+EXPORT_CHUNK_SIZE = 2000
+
+# Products written per transaction by catalog imports and bulk updates
+# (see store/catalog.py), and the largest catalog file in bytes imported
+# within a request; larger ones go through the import_catalog command.
+CATALOG_IMPORT_BATCH_SIZE = 1000
+CATALOG_IMPORT_MAX_UPLOAD = 2 * 2**20
+
+# Best seller rankings (see store/rankings.py): rolling windows in days,
+# the number of products kept per list, and how old order lines must be
+# to be collected, longer than any transaction writing them.
+RANKING_WINDOWS = (7, 30, 90)
+RANKING_SIZE = 20
+RANKING_COMMIT_LAG = timedelta(minutes=5)
+
+# Order lines converted to arrays per step by the brand analytics
+# (see store/analytics.py).
+ANALYTICS_CHUNK_SIZE = 10_000
+
+# Resized copies written next to every uploaded image (see
+# store/images.py): longest side in pixels per variant, each also saved
+# as WebP, and the worker threads that write them.
+IMAGE_VARIANTS = {"medium": 960, "thumb": 320}
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# Resumable chunked uploads (see store/uploads.py): where unfinished and
+# unclaimed files are kept, the largest file accepted in bytes, how many
+# uploads a user may have open, and how long an upload nobody writes to
+# or uses is kept.
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'uploads'
+CHUNKED_UPLOAD_MAX_SIZE = 100 * 2**20
+CHUNKED_UPLOAD_MAX_OPEN = 100
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Bulk user imports (see userauths/provisioning.py): users validated and
+# written per transaction, and the processes the import_users command
+# hashes their passwords in (None: one per CPU). Imports sent to the API
+# hash in the request's process.
+USER_IMPORT_BATCH_SIZE = 1000
+USER_IMPORT_HASH_WORKERS = None
+
+# Blacklisted refresh tokens (see userauths/blacklist.py): the filter
+# checked on refresh, written by build_blacklist_filter (run it every few
+# minutes), the seconds between the serving processes' checks for a new
+# one, and its false positive rate. Delete expired tokens with
+# prune_tokens.
+BLACKLIST_FILTER_PATH = BASE_DIR / 'blacklist-filter.bin'
+BLACKLIST_FILTER_RELOAD = 30
+BLACKLIST_FILTER_ERROR_RATE = 0.01
+
+# Cache of CACHES holding the throttling buckets, shared by every worker
+# using it; None keeps them in each process's memory.
+THROTTLE_CACHE = None
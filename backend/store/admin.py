@@ -11,6 +11,9 @@ from store.models import (
     Cart,
     CartOrder,
     CartOrderProduct,
+    BrandOrder,
+    BrandStats,
+    ProductRanking,
     Review,
     ProductFAQ,
     Favorite,
@@ -150,6 +153,43 @@ class CartOrderProductAdmin(admin.ModelAdmin):
     ]
 
 
+class BrandOrderAdmin(admin.ModelAdmin):
+    """
+    Admin class for BrandOrder model.
+    """
+
+    search_fields = ["oid"]
+    list_filter = ["payment_status", "order_status"]
+    list_display = [
+        "oid",
+        "brand",
+        "payment_status",
+        "order_status",
+        "sub_total",
+        "shipping_amount",
+        "total",
+        "date",
+    ]
+
+
+class BrandStatsAdmin(admin.ModelAdmin):
+    """
+    Admin class for BrandStats model.
+    """
+
+    list_display = ["brand", "products", "orders", "income", "updated"]
+
+
+class ProductRankingAdmin(admin.ModelAdmin):
+    """
+    Admin class for ProductRanking model.
+    """
+
+    list_display = ["scope", "scope_id", "window", "metric", "rank",
+                    "product", "units", "revenue", "computed"]
+    list_filter = ["scope", "window", "metric"]
+
+
 class ReviewAdmin(admin.ModelAdmin):
     """
     Admin class for Review model.
@@ -179,7 +219,9 @@ class CouponAdmin(admin.ModelAdmin):
         "coupon_code",
         "active",
     ]
-    list_display = ["brand", "coupon_code", "discount", "active", "date"]
+    list_display = [
+        "brand", "coupon_code", "discount", "uses", "max_uses", "active", "date"
+    ]
 
 
 admin.site.register(Category)
@@ -187,6 +229,9 @@ admin.site.register(Product, ProductAdmin)
 admin.site.register(Cart, CartAdmin)
 admin.site.register(CartOrder, CartOrderAdmin)
 admin.site.register(CartOrderProduct, CartOrderProductAdmin)
+admin.site.register(BrandOrder, BrandOrderAdmin)
+admin.site.register(BrandStats, BrandStatsAdmin)
+admin.site.register(ProductRanking, ProductRankingAdmin)
 admin.site.register(Review, ReviewAdmin)
 admin.site.register(ProductFAQ, ProductFaqAdmin)
 admin.site.register(Favorite)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        # Connect the coupon cache invalidation handlers
+        from store import coupons  # noqa: F401
+        # Connect the image variant handlers
+        from store import images  # noqa: F401
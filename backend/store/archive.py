@@ -0,0 +1,105 @@
+"""
+Hot/cold split for orders.
+
+Completed and cancelled orders older than a cutoff are moved from
+CartOrder/CartOrderProduct into ArchivedCartOrder/ArchivedCartOrderProduct
+so the live tables only hold orders that are still being worked on.
+Rows keep their primary keys and oids, which lets read paths fall back
+to the archive with the same lookup.
+"""
+
+from django.db import transaction
+
+from store.models import (
+    CartOrder,
+    CartOrderProduct,
+    ArchivedCartOrder,
+    ArchivedCartOrderProduct,
+)
+
+ARCHIVABLE_STATUSES = ("Completed", "Cancelled")
+
+
+def _copy(instance, model, **overrides):
+    """
+    Build an unsaved `model` row with the concrete field values of
+    `instance`, primary key included.
+    """
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in model._meta.concrete_fields
+    }
+    values.update(overrides)
+    return model(**values)
+
+
+def archivable_orders(cutoff):
+    """
+    Return the live orders that may be archived.
+    """
+    return CartOrder.objects.filter(
+        order_status__in=ARCHIVABLE_STATUSES, date__lt=cutoff
+    )
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Move at most `batch_size` orders (with their lines and brand links)
+    into the archive in one transaction. Returns the number moved.
+    """
+    with transaction.atomic():
+        order_ids = list(
+            archivable_orders(cutoff)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        orders = CartOrder.objects.filter(id__in=order_ids)
+        ArchivedCartOrder.objects.bulk_create(
+            [_copy(order, ArchivedCartOrder) for order in orders]
+        )
+
+        lines = CartOrderProduct.objects.filter(order_id__in=order_ids)
+        ArchivedCartOrderProduct.objects.bulk_create(
+            [_copy(line, ArchivedCartOrderProduct) for line in lines]
+        )
+
+        through = CartOrder.brand.through
+        ArchivedCartOrder.brand.through.objects.bulk_create(
+            [
+                ArchivedCartOrder.brand.through(
+                    archivedcartorder_id=link.cartorder_id,
+                    brand_id=link.brand_id,
+                )
+                for link in through.objects.filter(cartorder_id__in=order_ids)
+            ]
+        )
+
+        # Lines and brand links cascade with the order
+        CartOrder.objects.filter(id__in=order_ids).delete()
+    return len(order_ids)
+
+
+def archive_orders(cutoff, batch_size=500):
+    """
+    Archive every eligible order in bounded batches. Yields the size of
+    each batch so callers can report progress.
+    """
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            return
+        yield moved
+
+
+def get_order(**lookup):
+    """
+    Fetch an order from the live table, falling back to the archive.
+    Raises ArchivedCartOrder.DoesNotExist when neither has it.
+    """
+    try:
+        return CartOrder.objects.get(**lookup)
+    except CartOrder.DoesNotExist:
+        return ArchivedCartOrder.objects.get(**lookup)
@@ -0,0 +1,48 @@
+"""
+Cache versions for per-brand views.
+
+Cached brand responses put the brand's current version in their key.
+Writes that change what a brand sees call bump_brand_version(), which
+makes every older entry unreachable without having to know its key.
+
+The bump happens once the writer's transaction commits: bumped any
+earlier, a request could read the new version with the old rows and
+cache them under it. The versions live in the default cache, which
+every worker process has to share for a bump to reach them all.
+"""
+
+import time
+
+from django.core.cache import cache
+
+from store.deferred import defer
+
+
+def _version_key(brand_id):
+    return f"brand-version:{brand_id}"
+
+
+def brand_version(brand_id):
+    """Return the current cache version of a brand."""
+    key = _version_key(brand_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        # Another process may have set it in the meantime
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_brand_versions(brand_ids):
+    version = time.time_ns()
+    cache.set_many(
+        {_version_key(brand_id): version for brand_id in brand_ids}, None)
+
+
+def bump_brand_version(brand_id):
+    """
+    Invalidate every cached response of a brand when the current
+    transaction commits.
+    """
+    defer(bump_brand_versions, brand_id)
@@ -0,0 +1,530 @@
+"""
+Bulk catalog imports and updates.
+
+Brands with large catalogs send one file instead of one create-product
+request per product. The file is CSV or JSON Lines with one product per
+record. Nested rows travel with their product:
+
+- JSON Lines: "specifications", "colors", "sizes" and "gallery" are lists
+- CSV: the same columns hold those lists as JSON
+
+Images are references to uploads already in storage (a storage name or
+a media URL); gallery items may be given as a plain reference. A
+reference naming no MediaBlob fails its row, and every imported
+reference counts towards its blob, as a saved file field does.
+
+Records are read as a stream and written CATALOG_IMPORT_BATCH_SIZE at a
+time, each batch in one transaction with one bulk_create per table.
+Slugs and pids are allocated before the insert, so a batch runs one
+query to find taken slugs and, on databases that return inserted ids,
+none to read its products back.
+
+Progress is kept in a Watermark named after the brand and a digest of
+the file and moves in the batch's transaction. Importing the same file
+again resumes after the last committed batch, and a finished file adds
+nothing.
+
+bulk_update_products() changes prices, stock and status of many products
+by pid with bulk_update, in batches of the same size. It skips
+Product.save(), whose rating recompute costs two queries per product and
+does not depend on these fields.
+"""
+
+import csv
+import hashlib
+import io
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.fields import BooleanField
+
+from store.images import queue_variants
+from store.models import (
+    BrandDailyStats,
+    BrandStats,
+    Category,
+    Color,
+    MediaBlob,
+    Picture,
+    Product,
+    Size,
+    Specification,
+    Watermark,
+)
+from store.nested import REQUIRED_FIELD, stored_name
+from store.storage import is_blob
+
+FORMATS = ("csv", "jsonl")
+
+# Product fields a record may set, besides "category" (an id or slug)
+PRODUCT_FIELDS = (
+    "title",
+    "description",
+    "image",
+    "price",
+    "old_price",
+    "shipping_amount",
+    "stock_qty",
+    "in_stock",
+    "status",
+    "featured",
+    "slug",
+)
+
+# Model of each nested collection and the fields an item may set
+NESTED_MODELS = {
+    "specifications": (Specification, ("title", "content")),
+    "colors": (Color, ("name", "color_code", "image")),
+    "sizes": (Size, ("name", "price")),
+    "gallery": (Picture, ("image",)),
+}
+
+# Product fields bulk_update_products() may change
+UPDATE_FIELDS = ("price", "old_price", "stock_qty", "in_stock", "status")
+
+MAX_REPORTED_ERRORS = 100
+
+
+def file_digest(stream):
+    """
+    Return a short digest of a binary file's content and rewind it.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()[:16]
+
+
+def read_records(stream, file_type):
+    """
+    Yield the raw records of a binary stream: a dict of the non-empty
+    cells of a CSV row, or the text of a JSON line.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        if file_type == "csv":
+            for row in csv.DictReader(text):
+                yield {key: value for key, value in row.items() if value}
+        else:
+            for line in text:
+                if line.strip():
+                    yield line
+    finally:
+        # Leave the stream to its owner
+        text.detach()
+
+
+def _clean(model, name, value, errors, label):
+    field = model._meta.get_field(name)
+    if name == "image" and value:
+        value = stored_name(value)
+    elif isinstance(field, models.BooleanField) and isinstance(value, str):
+        # The spellings the API accepts ("true", "no", "1", ...)
+        if value.strip() in BooleanField.TRUE_VALUES:
+            value = True
+        elif value.strip() in BooleanField.FALSE_VALUES:
+            value = False
+    try:
+        value = field.clean(value, None)
+        # Model fields leave the sign of positive integers to the
+        # database's check constraint
+        if (isinstance(field, models.PositiveIntegerField)
+                and value is not None):
+            MinValueValidator(0)(value)
+        return value
+    except ValidationError as error:
+        errors[label] = error.messages
+
+
+def _clean_nested(collection, items, errors):
+    """
+    Validate the items of one nested collection and return them as lists
+    of field values.
+    """
+    if isinstance(items, str):
+        try:
+            items = json.loads(items)
+        except ValueError:
+            errors[collection] = ["Not valid JSON"]
+            return []
+    if not isinstance(items, list):
+        errors[collection] = ["Expected a list"]
+        return []
+
+    model, fields = NESTED_MODELS[collection]
+    required = REQUIRED_FIELD[collection]
+    cleaned = []
+    for index, item in enumerate(items):
+        if collection == "gallery" and isinstance(item, str):
+            item = {"image": item}
+        label = f"{collection}[{index}]"
+        if not isinstance(item, dict):
+            errors[label] = ["Expected an object"]
+            continue
+        unknown = set(item) - set(fields)
+        if unknown:
+            errors[label] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+            continue
+        if not item.get(required):
+            errors[f"{label}[{required}]"] = ["This field is required."]
+            continue
+        cleaned.append({
+            name: _clean(model, name, value, errors, f"{label}[{name}]")
+            for name, value in item.items()
+        })
+    return cleaned
+
+
+def clean_record(record, categories):
+    """
+    Validate a raw record. Returns the product's field values and its
+    nested items by collection, or raises ValidationError with a dict of
+    messages by field.
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise ValidationError({"record": ["Not valid JSON"]})
+        if not isinstance(record, dict):
+            raise ValidationError({"record": ["Expected an object"]})
+
+    errors = {}
+    unknown = set(record) - set(PRODUCT_FIELDS) - set(NESTED_MODELS) - {
+        "category"}
+    if unknown:
+        errors["record"] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+    if not record.get("title"):
+        errors["title"] = ["This field is required."]
+
+    values = {
+        name: _clean(Product, name, record[name], errors, name)
+        for name in PRODUCT_FIELDS
+        if name in record
+    }
+    if "category" in record:
+        values["category_id"] = categories.get(str(record["category"]))
+        if values["category_id"] is None:
+            errors["category"] = ["Unknown category"]
+    nested = {
+        collection: _clean_nested(collection, record[collection], errors)
+        for collection in NESTED_MODELS
+        if collection in record
+    }
+    if errors:
+        raise ValidationError(errors)
+    return values, nested
+
+
+def _images(values, nested):
+    """
+    Yield the (label, storage name) of the images a validated row sets.
+    """
+    if values.get("image"):
+        yield "image", values["image"]
+    for collection in ("colors", "gallery"):
+        for index, item in enumerate(nested.get(collection, ())):
+            if item.get("image"):
+                yield f"{collection}[{index}][image]", item["image"]
+
+
+def _check_images(rows):
+    """
+    Keep the rows of a batch whose images are all stored uploads. Returns
+    the rows to insert and the errors.
+    """
+    names = {
+        name
+        for _, values, nested in rows
+        for _, name in _images(values, nested)
+    }
+    stored = set(
+        MediaBlob.objects.filter(name__in=names)
+        .values_list("name", flat=True)
+    )
+    kept, errors = [], []
+    for number, values, nested in rows:
+        unknown = {
+            label: ["Unknown image; upload the file first."]
+            for label, name in _images(values, nested)
+            if name not in stored
+        }
+        if unknown:
+            errors.append((number, unknown))
+        else:
+            kept.append((number, values, nested))
+    return kept, errors
+
+
+def _add_references(names):
+    """
+    Count the imported references to blobs, one update per count.
+    """
+    by_count = defaultdict(list)
+    for name, count in Counter(names).items():
+        by_count[count].append(name)
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(
+            refs=models.F("refs") + count)
+
+
+def _allocate_slugs(rows):
+    """
+    Give every product of a batch a free slug. A generated slug that is
+    taken gets the product's pid appended; a taken slug given in the file
+    is an error. Returns the rows to insert and the errors.
+    """
+    taken = set(
+        Product.objects.filter(
+            slug__in=[product.slug for _, product, _ in rows]
+        ).values_list("slug", flat=True)
+    )
+    slug_length = Product._meta.get_field("slug").max_length
+    kept, errors = [], []
+    for number, product, nested in rows:
+        if product.slug in taken:
+            if product.explicit_slug:
+                errors.append((number, {"slug": [
+                    "Product with this slug already exists."]}))
+                continue
+            base = product.slug[: slug_length - len(product.pid) - 1]
+            product.slug = f"{base}-{product.pid}" if base else product.pid
+        taken.add(product.slug)
+        kept.append((number, product, nested))
+    return kept, errors
+
+
+def write_batch(brand_id, watermark_name, position, rows):
+    """
+    Insert a batch of validated (number, values, nested) rows and move
+    the watermark to `position` in one transaction. Rows at or before
+    the watermark are skipped, so a batch is never imported twice.
+    Returns the number of products created and the rows' errors.
+    """
+    with transaction.atomic():
+        watermark = Watermark.lock(watermark_name)
+        rows, image_errors = _check_images(
+            [row for row in rows if row[0] > watermark.position])
+        products = []
+        for number, values, nested in rows:
+            # rating matches what Product.save() computes for a product
+            # without reviews
+            product = Product(brand_id=brand_id, rating=None, **values)
+            product.explicit_slug = bool(product.slug)
+            if not product.slug:
+                product.slug = slugify(product.title)[:50] or product.pid
+            products.append((number, product, nested))
+        products, errors = _allocate_slugs(products)
+        errors += image_errors
+
+        Product.objects.bulk_create([product for _, product, _ in products])
+        missing = [product for _, product, _ in products if product.pk is None]
+        if missing:
+            ids = dict(
+                Product.objects.filter(
+                    pid__in=[product.pid for product in missing]
+                ).values_list("pid", "id")
+            )
+            for product in missing:
+                product.pk = ids[product.pid]
+
+        for collection, (model, _) in NESTED_MODELS.items():
+            model.objects.bulk_create([
+                model(product=product, **item)
+                for _, product, nested in products
+                for item in nested.get(collection, ())
+            ])
+
+        # bulk_create skips the storage, which counts blob references,
+        # and the post_save handlers that queue image variants and count
+        # products
+        images = [product.image.name for _, product, _ in products] + [
+            item.get("image")
+            for _, _, nested in products
+            for collection in ("colors", "gallery")
+            for item in nested.get(collection, ())
+        ]
+        _add_references([name for name in images if is_blob(name)])
+        queue_variants(images)
+        if products:
+            BrandStats.adjust(brand_id, products=len(products))
+            BrandDailyStats.adjust(
+                brand_id, timezone.localdate(), products=len(products))
+        watermark.position = max(position, watermark.position)
+        watermark.save(update_fields=["position", "updated"])
+    return len(products), errors
+
+
+class CatalogImport:
+    """
+    Import of one catalog file into a brand. Iterate run() to import the
+    file batch by batch; the attributes hold the running totals.
+    """
+
+    def __init__(self, brand_id, stream, file_type):
+        if file_type not in FORMATS:
+            raise ValueError(f"Unknown file type {file_type}")
+        self.brand_id = brand_id
+        self.stream = stream
+        self.file_type = file_type
+        self.watermark = f"catalog:{brand_id}:{file_digest(stream)}"
+        self.resumed_from = (
+            Watermark.objects.filter(name=self.watermark)
+            .values_list("position", flat=True)
+            .first()
+            or 0
+        )
+        self.position = self.resumed_from
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def _record_errors(self, errors):
+        self.failed += len(errors)
+        room = MAX_REPORTED_ERRORS - len(self.errors)
+        self.errors += [
+            {"row": number, "errors": messages}
+            for number, messages in errors[:max(room, 0)]
+        ]
+
+    def run(self, batch_size=None):
+        """
+        Import the records past the watermark. Yields after every batch.
+        """
+        batch_size = batch_size or getattr(
+            settings, "CATALOG_IMPORT_BATCH_SIZE", 1000)
+        categories = {}
+        for category_id, slug in Category.objects.values_list("id", "slug"):
+            categories[str(category_id)] = categories[slug] = category_id
+
+        records = islice(
+            enumerate(read_records(self.stream, self.file_type), 1),
+            self.resumed_from,
+            None,
+        )
+        while batch := list(islice(records, batch_size)):
+            rows, errors = [], []
+            for number, record in batch:
+                try:
+                    rows.append((number, *clean_record(record, categories)))
+                except ValidationError as error:
+                    errors.append((number, error.message_dict))
+            created, conflicts = write_batch(
+                self.brand_id, self.watermark, batch[-1][0], rows)
+            self.position = batch[-1][0]
+            self.created += created
+            self._record_errors(
+                sorted(errors + conflicts, key=lambda error: error[0]))
+            yield self
+
+    def summary(self):
+        return {
+            "rows": self.position,
+            "resumed_from": self.resumed_from,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def clean_update(update):
+    """
+    Validate one bulk update. Returns the pid and the new field values,
+    or raises ValidationError with a dict of messages by field.
+    """
+    if not isinstance(update, dict):
+        raise ValidationError({"update": ["Expected an object"]})
+    errors = {}
+    pid = update.get("pid")
+    if not pid or not isinstance(pid, str):
+        errors["pid"] = ["This field is required."]
+    unknown = set(update) - set(UPDATE_FIELDS) - {"pid"}
+    if unknown:
+        errors["update"] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+    values = {
+        name: _clean(Product, name, update[name], errors, name)
+        for name in UPDATE_FIELDS
+        if name in update
+    }
+    if errors:
+        raise ValidationError(errors)
+    return pid, values
+
+
+def _update_batch(brand_id, rows):
+    """
+    Apply a batch of validated (index, pid, values) updates in one
+    transaction. Returns the outcome of every row by index.
+    """
+    outcomes = {}
+    with transaction.atomic():
+        products = {
+            product.pid: product
+            for product in Product.objects.filter(
+                brand_id=brand_id, pid__in=[pid for _, pid, _ in rows]
+            ).only("id", "pid", *UPDATE_FIELDS)
+        }
+        changed, fields = [], set()
+        for index, pid, values in rows:
+            product = products.get(pid)
+            if product is None:
+                outcomes[index] = {"pid": pid, "result": "error",
+                                   "errors": {"pid": ["Product not found"]}}
+                continue
+            dirty = {
+                name for name, value in values.items()
+                if getattr(product, name) != value
+            }
+            for name in dirty:
+                setattr(product, name, values[name])
+            if dirty:
+                changed.append(product)
+                fields |= dirty
+            outcomes[index] = {
+                "pid": pid, "result": "updated" if dirty else "unchanged"}
+        if changed:
+            Product.objects.bulk_update(changed, sorted(fields))
+    return outcomes
+
+
+def bulk_update_products(brand_id, updates, batch_size=None):
+    """
+    Apply {"pid", "price", "old_price", "stock_qty", "in_stock", "status"}
+    updates to a brand's products. Only the fields given change, and
+    only rows that differ are written.
+
+    Returns one outcome per update, in order: {"pid", "result"} with a
+    result of "updated", "unchanged" or "error" (with "errors").
+    """
+    batch_size = batch_size or getattr(
+        settings, "CATALOG_IMPORT_BATCH_SIZE", 1000)
+    outcomes = [None] * len(updates)
+    rows, seen = [], set()
+    for index, update in enumerate(updates):
+        try:
+            pid, values = clean_update(update)
+            if pid in seen:
+                raise ValidationError({"pid": ["Duplicate pid"]})
+        except ValidationError as error:
+            outcomes[index] = {
+                "pid": update.get("pid") if isinstance(update, dict) else None,
+                "result": "error",
+                "errors": error.message_dict,
+            }
+            continue
+        seen.add(pid)
+        rows.append((index, pid, values))
+
+    for start in range(0, len(rows), batch_size):
+        batch = _update_batch(brand_id, rows[start:start + batch_size])
+        for index, outcome in batch.items():
+            outcomes[index] = outcome
+    return outcomes
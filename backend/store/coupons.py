@@ -0,0 +1,185 @@
+"""
+Coupon redemption.
+
+Brands choose their codes, so one code may name a coupon of several
+brands; it applies to the lines of the coupon's brand, and an order with
+none of them is told it does not apply. Codes are resolved through a
+cache of code -> active coupons (id, brand, discount), dropped whenever a
+coupon is saved or deleted and when a queryset update changes what is
+cached (see CouponQuerySet). Everything that must be exact (active flag,
+remaining uses, who already redeemed it) is checked in the database
+inside one transaction:
+
+- the per-user check goes through the used_by through table, whose
+  (coupon, user) unique index also rejects a second concurrent redemption
+- limited coupons are reserved with a conditional UPDATE of `uses`, so two
+  buyers can never take the last use at the same time
+
+Only the buyer can apply a coupon, and only to an order not paid yet:
+the discount comes off the lines' sub totals, and their totals, before
+any sale is counted. A redemption that loses a lock to another one
+(SQLite's "database is locked", a deadlock elsewhere) is answered with
+CouponBusy, which the client can retry.
+"""
+
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+from store.models import BrandOrder, CartOrder, CartOrderProduct, Coupon
+
+# Bounds how long a change made behind the ORM's back stays cached
+CACHE_TIMEOUT = 5 * 60
+CENT = Decimal("0.01")
+
+
+class CouponBusy(APIException):
+    """
+    A redemption that could not get its locks in time.
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The coupon is busy, please try again."
+    default_code = "coupon_busy"
+
+
+def _cache_key(code):
+    return f"coupon:{code}"
+
+
+def lookup_coupons(code):
+    """
+    Return [{"id", "brand_id", "discount"}] of the active coupons with a
+    code, oldest first.
+    """
+    key = _cache_key(code)
+    coupons = cache.get(key)
+    if coupons is None:
+        coupons = list(
+            Coupon.objects.filter(coupon_code=code, active=True)
+            .order_by("id")
+            .values("id", "brand_id", "discount")
+        )
+        cache.set(key, coupons, CACHE_TIMEOUT)
+    return coupons
+
+
+def forget_codes(codes):
+    """Drop the cached lookups of coupon codes."""
+    cache.delete_many([_cache_key(code) for code in codes])
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def forget_coupon(sender, instance, **kwargs):
+    """Drop the cached lookup whenever a coupon changes."""
+    forget_codes([instance.coupon_code])
+
+
+def apply_coupon(order_oid, code, user):
+    """
+    Redeem `code` against the lines from the coupon's brand of one of
+    `user`'s pending orders.
+
+    Returns the updated order and the amount saved. Raises NotFound or
+    ValidationError when the coupon cannot be used, CouponBusy when the
+    redemption should be retried.
+    """
+    try:
+        coupons = lookup_coupons(code)
+        if not coupons:
+            raise NotFound("Coupon does not exist")
+        return _redeem(order_oid, coupons, code, user)
+    except OperationalError:
+        raise CouponBusy()
+
+
+def _redeem(order_oid, coupons, code, user):
+    with transaction.atomic():
+        try:
+            order = CartOrder.objects.select_for_update().get(
+                oid=order_oid, buyer_id=user.pk)
+        except CartOrder.DoesNotExist:
+            raise NotFound("Order does not exist")
+        if order.payment_status != "pending":
+            raise ValidationError("Coupons only apply to unpaid orders")
+
+        # The coupon of the first brand with lines in the order
+        brands = set(
+            CartOrderProduct.objects.filter(order=order)
+            .values_list("brand_id", flat=True)
+        )
+        coupon = next(
+            (coupon for coupon in coupons if coupon["brand_id"] in brands),
+            None)
+        if coupon is None:
+            raise ValidationError("Coupon does not apply to this order")
+
+        redemptions = Coupon.used_by.through.objects
+        if redemptions.filter(
+            coupon_id=coupon["id"], user_id=order.buyer_id
+        ).exists():
+            raise ValidationError("Coupon has already been used")
+
+        lines = list(
+            CartOrderProduct.objects.select_for_update().filter(
+                order=order, brand_id=coupon["brand_id"]
+            )
+        )
+        if not lines:
+            raise ValidationError("Coupon does not apply to this order")
+
+        # Reserve a use; stale cache entries fail here as well
+        reserved = Coupon.objects.filter(
+            models.Q(max_uses__isnull=True)
+            | models.Q(uses__lt=models.F("max_uses")),
+            id=coupon["id"],
+            coupon_code=code,
+            active=True,
+        ).update(uses=models.F("uses") + 1)
+        if not reserved:
+            raise ValidationError("Coupon is no longer available")
+
+        try:
+            with transaction.atomic():
+                redemptions.create(
+                    coupon_id=coupon["id"], user_id=order.buyer_id)
+        except IntegrityError:
+            raise ValidationError("Coupon has already been used")
+
+        rate = min(max(Decimal(coupon["discount"]), 0), 100) / 100
+        saved = Decimal("0.00")
+        for line in lines:
+            # Off the goods only; shipping, tax and fees stay as they are
+            discount = (line.sub_total * rate).quantize(CENT)
+            if not line.original_total:
+                line.original_total = line.total
+            line.sub_total -= discount
+            line.total -= discount
+            line.amount_saved = (line.amount_saved or 0) + discount
+            saved += discount
+        CartOrderProduct.objects.bulk_update(
+            lines, ["original_total", "sub_total", "total", "amount_saved"]
+        )
+        BrandOrder.objects.filter(
+            order=order, brand_id=coupon["brand_id"]
+        ).update(
+            sub_total=models.F("sub_total") - saved,
+            total=models.F("total") - saved,
+        )
+
+        if not order.original_total:
+            order.original_total = order.total
+        order.sub_total -= saved
+        order.total -= saved
+        order.amount_saved = (order.amount_saved or 0) + saved
+        order.save(
+            update_fields=["original_total", "sub_total", "total", "amount_saved"]
+        )
+
+    return order, saved
@@ -0,0 +1,64 @@
+"""
+Signal work deferred to the end of the transaction.
+
+Some post_save handlers recompute a value derived from the saved row:
+every review save re-averaged its product's rating and saved the whole
+product, and every user save saved the user's profile again. A
+transaction changing many rows (an import, an admin list edit, a view
+saving the same user twice) repeated that work once per change.
+
+Such handlers call defer(handler, key) instead. The keys deferred to a
+handler are collected, and handler(keys) runs once when the transaction
+commits, so every object is recomputed once, usually in a single query.
+Outside a transaction the handler runs straight away with the one key,
+as the signal did before.
+
+Keys deferred in a transaction that rolls back are dropped with it.
+Handlers must still recompute from the database rather than trust the
+rows that were saved: keys deferred inside a savepoint that was rolled
+back are passed on.
+"""
+
+import functools
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+def _pending(connection):
+    # {handler: keys} deferred for the connection's current on_commit
+    # callbacks. Django starts a new run_on_commit list whenever it runs
+    # or discards them (commit, rollback, savepoint rollback, reconnect),
+    # so keys left by a rolled back transaction are not carried over.
+    pending = connection.__dict__.get("deferred_keys")
+    if pending is None or pending[0] is not connection.run_on_commit:
+        pending = connection.deferred_keys = (connection.run_on_commit, {})
+    return pending[1]
+
+
+def _run(handler, pending):
+    keys = pending.pop(handler, None)
+    if keys:
+        handler(keys)
+
+
+def defer(handler, key, using=DEFAULT_DB_ALIAS):
+    """
+    Call handler(keys) once the current transaction on `using` commits,
+    with `key` among the keys.
+    """
+    pending = _pending(connections[using])
+    pending.setdefault(handler, set()).add(key)
+    # Registered on every call: a savepoint rollback discards the
+    # callbacks registered inside it, and the first surviving one runs
+    # the handler for all keys
+    transaction.on_commit(functools.partial(_run, handler, pending), using=using)
+
+
+def chunked(keys, size=500):
+    """
+    Yield `keys` in sorted lists of at most `size`, to keep IN clauses
+    within the database's parameter limit.
+    """
+    keys = sorted(keys)
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
@@ -0,0 +1,112 @@
+"""
+Streaming exports of a brand's order lines.
+
+Rows are read with a server-side iterator and written out a chunk at a
+time, so memory use stays flat no matter how many lines are exported.
+Archived lines are exported before live ones.
+"""
+
+import csv
+import io
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from store.models import ArchivedCartOrderProduct, CartOrderProduct
+
+COLUMNS = {
+    "oid": "oid",
+    "order": "order__oid",
+    "date": "date",
+    "payment_status": "order__payment_status",
+    "order_status": "order__order_status",
+    "product": "product__pid",
+    "title": "product__title",
+    "color": "color",
+    "size": "size",
+    "qty": "qty",
+    "price": "price",
+    "sub_total": "sub_total",
+    "shipping_amount": "shipping_amount",
+    "tax_fee": "tax_fee",
+    "service_fee": "service_fee",
+    "total": "total",
+    "amount_saved": "amount_saved",
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_rows(brand_id, since, until):
+    """
+    Yield a tuple of COLUMNS values for every line of the brand dated
+    from `since` up to, but not including, `until`.
+    """
+    chunk_size = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+    for model in (ArchivedCartOrderProduct, CartOrderProduct):
+        lines = (
+            model.objects.filter(
+                brand_id=brand_id,
+                date__gte=since,
+                date__lt=until,
+            )
+            .order_by("date", "id")
+            .values_list(*COLUMNS.values())
+        )
+        yield from lines.iterator(chunk_size=chunk_size)
+
+
+def _chunks(rows, write, buffer):
+    """
+    Run `write` for each row and yield the buffered text every
+    EXPORT_CHUNK_SIZE rows.
+    """
+    chunk_size = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+    for count, row in enumerate(rows, 1):
+        write(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def csv_chunks(rows):
+    """Render rows as CSV text, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+
+    def write(row):
+        writer.writerow(
+            [value.isoformat() if isinstance(value, datetime) else value
+             for value in row]
+        )
+
+    return _chunks(rows, write, buffer)
+
+
+def ndjson_chunks(rows):
+    """Render rows as one JSON object per line."""
+    buffer = io.StringIO()
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    names = list(COLUMNS)
+
+    def write(row):
+        buffer.write(encoder.encode(dict(zip(names, row))))
+        buffer.write("\n")
+
+    return _chunks(rows, write, buffer)
+
+
+def export_chunks(brand_id, since, until, file_format="csv"):
+    """
+    Return an iterator of text chunks for the brand's order lines.
+    """
+    render = csv_chunks if file_format == "csv" else ndjson_chunks
+    return render(export_rows(brand_id, since, until))
@@ -0,0 +1,240 @@
+"""
+Time-ordered identifiers for products, orders and pictures.
+
+The public ids (pid, oid, pic_id) used to be random ShortUUIDs. Random
+values land all over the unique index, collide more often as tables
+grow and say nothing about creation order. The generators here build
+Snowflake-style ids instead: a millisecond timestamp, a worker id and a
+per-process sequence packed into 63 bits and written out as fixed-width
+base32, so newer ids always sort after older ones.
+
+The generator is pluggable through the ``ID_GENERATOR`` setting (a
+dotted path to a class). Two processes with the same worker id would
+hand out the same ids, so every process claims its own: it takes an
+exclusive lock on one lock file per worker id in ``ID_WORKER_LOCK_DIR``,
+the first free one of the host's ``ID_WORKER_IDS`` range. The lock goes
+away with the process. Hosts sharing a database need disjoint ranges;
+without a range nothing starts (see ``check_worker_ids``).
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+import shortuuid
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+
+# Crockford base32 in lower case, digits first so that string order
+# matches numeric order
+ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+
+
+class SnowflakeGenerator:
+    """
+    Monotonic 63-bit ids: 41 bits of milliseconds since EPOCH_MS,
+    10 bits of worker id and 12 bits of sequence per millisecond.
+    """
+
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    LENGTH = 13  # ceil(63 / 5) base32 characters
+
+    def __init__(self, worker_id=None):
+        self._lock = threading.Lock()
+        self._fixed_worker_id = worker_id
+        self._lock_file = None
+        self._reset()
+        # A forked worker must not share a worker id with its parent
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        if self._lock_file is not None:
+            # Inherited from the parent, whose lock it is
+            self._lock_file.close()
+            self._lock_file = None
+        self.worker_id = self._fixed_worker_id
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _claim_worker_id(self):
+        """
+        Lock the first free worker id of ID_WORKER_IDS for this process.
+        """
+        worker_ids = worker_id_range()
+        if worker_ids is None:
+            raise ImproperlyConfigured(
+                "ID_WORKER_IDS must give this host a range of worker ids")
+        directory = getattr(settings, "ID_WORKER_LOCK_DIR", None) or (
+            os.path.join(tempfile.gettempdir(), "riz-id-workers"))
+        os.makedirs(directory, exist_ok=True)
+        for worker_id in worker_ids:
+            lock_file = open(os.path.join(directory, f"{worker_id}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            self._lock_file = lock_file
+            return worker_id
+        raise ImproperlyConfigured(
+            f"All worker ids of ID_WORKER_IDS ({worker_ids.start}-"
+            f"{worker_ids.stop - 1}) are taken by other processes")
+
+    def _now_ms(self):
+        return time.time_ns() // 1_000_000 - self.EPOCH_MS
+
+    def next_int(self):
+        """
+        Return the next id as an integer.
+        """
+        with self._lock:
+            if self.worker_id is None:
+                self.worker_id = self._claim_worker_id()
+            now = self._now_ms()
+            # Never go backwards, even if the system clock does
+            if now < self._last_ms:
+                now = self._last_ms
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & (
+                    (1 << self.SEQUENCE_BITS) - 1
+                )
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond, borrow the next
+                    now = self._last_ms + 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+
+            return (
+                (now << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def __call__(self):
+        return encode(self.next_int(), self.LENGTH)
+
+
+class ShortUUIDGenerator:
+    """
+    The previous random scheme, kept for comparison and as a fallback.
+    """
+
+    def __init__(self, length=10, alphabet="abcdefghij123456789"):
+        self._uuid = shortuuid.ShortUUID(alphabet=alphabet)
+        self.length = length
+
+    def __call__(self):
+        return self._uuid.random(length=self.length)
+
+
+def encode(value, length):
+    """
+    Encode a non-negative integer as fixed-width base32.
+    """
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def decode(value):
+    """
+    Turn an encoded id back into an integer.
+    """
+    number = 0
+    for char in value:
+        number = number * 32 + ALPHABET.index(char)
+    return number
+
+
+def id_timestamp(value):
+    """
+    Return the creation time of a Snowflake id in epoch seconds.
+    """
+    bits = SnowflakeGenerator.WORKER_BITS + SnowflakeGenerator.SEQUENCE_BITS
+    return ((decode(value) >> bits) + SnowflakeGenerator.EPOCH_MS) / 1000
+
+
+def worker_id_range():
+    """
+    Return ID_WORKER_IDS ("first-last", e.g. "0-63") as a range, or None.
+    """
+    value = getattr(settings, "ID_WORKER_IDS", None)
+    if not value:
+        return None
+    first, _, last = str(value).partition("-")
+    worker_ids = range(int(first), int(last or first) + 1)
+    if not worker_ids or worker_ids.start < 0 or worker_ids.stop > 1 << (
+            SnowflakeGenerator.WORKER_BITS):
+        raise ImproperlyConfigured(
+            f"ID_WORKER_IDS must be within 0-"
+            f"{(1 << SnowflakeGenerator.WORKER_BITS) - 1}")
+    return worker_ids
+
+
+@checks.register()
+def check_worker_ids(app_configs, **kwargs):
+    """
+    Refuse to start without worker ids for the Snowflake generator.
+    """
+    path = getattr(settings, "ID_GENERATOR", "store.ids.SnowflakeGenerator")
+    if path != "store.ids.SnowflakeGenerator":
+        return []
+    try:
+        if worker_id_range() is not None:
+            return []
+        message = "ID_WORKER_IDS is not set."
+    except (ImproperlyConfigured, ValueError) as error:
+        message = str(error)
+    return [checks.Error(
+        message,
+        hint="Give every host sharing the database its own range of "
+             "worker ids, e.g. ID_WORKER_IDS=0-63.",
+        id="store.E001",
+    )]
+
+
+@lru_cache(maxsize=None)
+def get_id_generator():
+    """
+    Return the process-wide generator named by settings.ID_GENERATOR.
+    """
+    path = getattr(settings, "ID_GENERATOR", "store.ids.SnowflakeGenerator")
+    return import_string(path)()
+
+
+def generate_id():
+    """
+    Default callable for TimeOrderedIDField.
+    """
+    return get_id_generator()()
+
+
+class TimeOrderedIDField(models.CharField):
+    """
+    CharField filled from the configured id generator.
+    """
+
+    description = _("A time-ordered id field.")
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("max_length", 20)
+        kwargs["default"] = generate_id
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop("default", None)
+        return name, path, args, kwargs
@@ -0,0 +1,274 @@
+"""
+Resized and WebP copies of uploaded images.
+
+Catalog pages used to load every image as the original upload. After an
+image is saved, a worker pool writes smaller copies of it next to the
+original, one per IMAGE_VARIANTS size and format:
+
+    product/shoe.jpg -> product/shoe__thumb.jpg, product/shoe__thumb.webp,
+                        product/shoe__medium.jpg, product/shoe__medium.webp
+
+Copies keep the original's aspect ratio and are never larger than it.
+PNG originals get PNG copies (to keep transparency), everything else
+JPEG. Once every copy is written, the rows showing the image get its
+name in image_variants_of: serializers expose variant URLs only while it
+matches the row's image, without asking the storage.
+
+Work happens off the request path: post_save handlers queue the image
+names once the transaction commits, and IMAGE_DERIVATIVE_WORKERS threads
+do the resizing (Pillow releases the GIL while it decodes, resamples and
+encodes). Images queued when a process stops are picked up by the
+generate_image_derivatives command, which also backfills existing media.
+Setting IMAGE_VARIANTS to {} turns the copies off.
+"""
+
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+from brand.models import Brand
+from store.models import Category, Color, Picture, Product
+from userauths.models import Profile
+
+logger = logging.getLogger(__name__)
+
+# Models whose "image" field gets variants
+IMAGE_MODELS = (Product, Picture, Color, Category, Brand, Profile)
+
+FORMATS = {
+    ".png": ("PNG", {"optimize": True}),
+    ".jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    ".webp": ("WEBP", {"quality": 80, "method": 4}),
+}
+
+
+def variant_storage():
+    """
+    Return the storage copies are written to. Copies are named after
+    their original, so it must keep names as given; the "variants" entry
+    of STORAGES is used when there is one.
+    """
+    if "variants" in settings.STORAGES:
+        return storages["variants"]
+    return default_storage
+
+
+def variant_sizes():
+    """
+    Return (variant, longest side) pairs from the largest to the smallest.
+    """
+    sizes = getattr(
+        settings, "IMAGE_VARIANTS", {"medium": 960, "thumb": 320})
+    return sorted(sizes.items(), key=lambda item: -item[1])
+
+
+def variant_names(name):
+    """
+    Return {key: storage name} of the copies of an image, in the order
+    they are written. Keys are the variant, and the variant with a
+    "_webp" suffix for the WebP copy.
+    """
+    stem, extension = os.path.splitext(name)
+    extension = ".png" if extension.lower() == ".png" else ".jpg"
+    names = {}
+    for variant, _ in variant_sizes():
+        names[variant] = f"{stem}__{variant}{extension}"
+        names[f"{variant}_webp"] = f"{stem}__{variant}.webp"
+    return names
+
+
+def variants_ready(name):
+    """
+    Return whether every copy of an image is in the storage.
+    """
+    names = list(variant_names(name).values())
+    return bool(names) and variant_storage().exists(names[-1])
+
+
+def _write(name, image, extension):
+    image_format, options = FORMATS[extension]
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    storage = variant_storage()
+    # save() would pick another name rather than overwrite
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(buffer.getvalue()))
+    return buffer.tell()
+
+
+def mark_variants(name):
+    """
+    Record on the rows showing an image that its copies are written.
+    """
+    for model in IMAGE_MODELS:
+        model.objects.filter(image=name).exclude(
+            image_variants_of=name).update(image_variants_of=name)
+
+
+def unmarked_images():
+    """
+    Return the names of the stored images some row shows without copies.
+    """
+    names = set()
+    for model in IMAGE_MODELS:
+        names.update(
+            model.objects.exclude(image="").exclude(image=None)
+            .exclude(image_variants_of=F("image"))
+            .values_list("image", flat=True).distinct()
+        )
+    return names
+
+
+def generate_variants(name, force=False):
+    """
+    Write every copy of a stored image and mark the rows showing it.
+    Returns the number of bytes written: 0 when the copies already exist
+    (unless `force`) or when the file is missing or not an image.
+    """
+    if not force and variants_ready(name):
+        mark_variants(name)
+        return 0
+    try:
+        with default_storage.open(name, "rb") as source:
+            image = Image.open(source)
+            # Let JPEG decoding skip detail the largest copy does not need
+            image.draft("RGB", (variant_sizes()[0][1],) * 2)
+            image.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError) as error:
+        logger.info("No image variants for %s: %s", name, error)
+        return 0
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        # Palette and CMYK images resample poorly or not at all
+        transparent = "transparency" in image.info or "A" in image.mode
+        image = image.convert("RGBA" if transparent else "RGB")
+
+    written = 0
+    names = variant_names(name)
+    # Each copy is resized from the previous, larger one
+    for variant, size in variant_sizes():
+        image.thumbnail((size, size), Image.LANCZOS)
+        for key in (variant, f"{variant}_webp"):
+            target = names[key]
+            written += _write(target, image, os.path.splitext(target)[1])
+    mark_variants(name)
+    return written
+
+
+def delete_variants(name):
+    """Remove the copies of an image that is no longer stored."""
+    storage = variant_storage()
+    for target in variant_names(name).values():
+        storage.delete(target)
+
+
+def variant_urls(file, request=None):
+    """
+    Return {key: url} of the copies of a file field's image, or None
+    while its row is not marked as having them.
+    """
+    if not file or getattr(
+            file.instance, "image_variants_of", None) != file.name:
+        return None
+    urls = {}
+    storage = variant_storage()
+    for key, target in variant_names(file.name).items():
+        url = storage.url(target)
+        urls[key] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Read-only URLs of the resized and WebP copies of an image field.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        kwargs.setdefault("source", "image")
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get("request"))
+
+
+class VariantPool:
+    """
+    Worker threads generating image copies. A name already queued is not
+    queued again.
+    """
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="image-variants")
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, names):
+        for name in names:
+            with self.lock:
+                if name in self.pending:
+                    continue
+                self.pending.add(name)
+            self.executor.submit(self._run, name)
+
+    def _run(self, name):
+        try:
+            generate_variants(name)
+        except Exception:
+            logger.exception("Image variants of %s failed", name)
+        finally:
+            with self.lock:
+                self.pending.discard(name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide pool, starting it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = VariantPool(
+                getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2))
+    return _pool
+
+
+def queue_variants(names):
+    """
+    Generate the copies of the given images once the current transaction
+    commits.
+    """
+    names = {name for name in names if name}
+    if names and variant_sizes():
+        transaction.on_commit(lambda: get_pool().submit(names))
+
+
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    """Queue the copies of a saved row's image."""
+    if update_fields is not None and "image" not in update_fields:
+        return
+    queue_variants([instance.image.name if instance.image else None])
+
+
+for model in IMAGE_MODELS:
+    post_save.connect(
+        image_saved, sender=model, dispatch_uid=f"image-variants-{model._meta.label}")
@@ -0,0 +1,97 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.utils import timezone
+
+from store.archive import archive_orders
+from store.models import (
+    CartOrder,
+    CartOrderProduct,
+    ArchivedCartOrder,
+    ArchivedCartOrderProduct,
+)
+
+
+class Command(BaseCommand):
+    """
+    Move completed and cancelled orders older than --days into the
+    archive tables, --batch-size orders per transaction.
+    """
+
+    help = "Archive completed/cancelled orders older than a cutoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            help="Print table sizes and sample query latency before and after",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        if options["report"]:
+            self.report("before")
+
+        total = 0
+        for moved in archive_orders(cutoff, options["batch_size"]):
+            total += moved
+            self.stdout.write(f"archived {total} orders")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} orders older than {cutoff:%Y-%m-%d}"))
+
+        if options["report"]:
+            self.report("after")
+
+    def report(self, label):
+        self.stdout.write(f"-- {label} --")
+        for model in (
+            CartOrder,
+            CartOrderProduct,
+            ArchivedCartOrder,
+            ArchivedCartOrderProduct,
+        ):
+            self.stdout.write(
+                f"{model._meta.db_table:<32}{model.objects.count():>10} rows"
+                f"{self.table_kib(model._meta.db_table):>10} KiB"
+            )
+
+        # Queries on the hot path: a brand's paid income and a buyer's
+        # pending orders
+        queries = {
+            "brand income": lambda: CartOrderProduct.objects.filter(
+                brand_id=1, order__payment_status="paid"
+            ).aggregate(models.Sum("sub_total")),
+            "pending orders": lambda: list(
+                CartOrder.objects.filter(payment_status="pending")
+                .values_list("id", flat=True)[:100]
+            ),
+        }
+        for name, query in queries.items():
+            started = time.perf_counter()
+            for _ in range(10):
+                query()
+            elapsed = (time.perf_counter() - started) / 10 * 1000
+            self.stdout.write(f"{name:<32}{elapsed:>10.2f} ms")
+
+    def table_kib(self, table):
+        """
+        Size of a table and its indexes; only available on SQLite.
+        """
+        if connection.vendor != "sqlite":
+            return "-"
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name = %s "
+                    "OR name IN (SELECT name FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = %s)",
+                    [table, table],
+                )
+            except Exception:
+                return "-"
+            return (cursor.fetchone()[0] or 0) // 1024
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from store.models import (
+    ArchivedCartOrder,
+    ArchivedCartOrderProduct,
+    BrandOrder,
+    CartOrder,
+    CartOrderProduct,
+)
+
+
+class Command(BaseCommand):
+    """
+    Create the per-brand sub-orders for orders placed before BrandOrder
+    existed, walking live and archived orders in primary key chunks.
+    Sub-orders that already exist are left alone, so the command can be
+    re-run or resumed with --start.
+    """
+
+    help = "Backfill BrandOrder rows from existing order lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1_000)
+        parser.add_argument("--start", type=int, default=0,
+                            help="Resume after this order id")
+
+    def handle(self, *args, **options):
+        for order_model, line_model, live in (
+            (CartOrder, CartOrderProduct, True),
+            (ArchivedCartOrder, ArchivedCartOrderProduct, False),
+        ):
+            last_id = options["start"]
+            created = 0
+            while True:
+                ids = list(
+                    order_model.objects.filter(id__gt=last_id)
+                    .order_by("id")
+                    .values_list("id", flat=True)[: options["chunk_size"]]
+                )
+                if not ids:
+                    break
+                created += self.backfill(line_model, ids, live)
+                last_id = ids[-1]
+                self.stdout.write(
+                    f"{order_model.__name__}: up to id {last_id}, "
+                    f"{created} sub-orders"
+                )
+
+    @transaction.atomic
+    def backfill(self, line_model, order_ids, live):
+        rows = (
+            line_model.objects.filter(order_id__in=order_ids)
+            .values(
+                "order_id",
+                "brand_id",
+                "order__oid",
+                "order__date",
+                "order__payment_status",
+                "order__order_status",
+            )
+            .annotate(
+                sum_sub_total=models.Sum("sub_total"),
+                sum_shipping=models.Sum("shipping_amount"),
+                sum_tax=models.Sum("tax_fee"),
+                sum_service=models.Sum("service_fee"),
+                sum_total=models.Sum("total"),
+                sum_qty=models.Sum("qty"),
+            )
+        )
+        brand_orders = [
+            BrandOrder(
+                brand_id=row["brand_id"],
+                # Archived orders have left CartOrder, keep only the oid
+                order_id=row["order_id"] if live else None,
+                oid=row["order__oid"],
+                date=row["order__date"],
+                payment_status=row["order__payment_status"],
+                order_status=row["order__order_status"],
+                sub_total=row["sum_sub_total"],
+                shipping_amount=row["sum_shipping"],
+                tax_fee=row["sum_tax"],
+                service_fee=row["sum_service"],
+                total=row["sum_total"],
+                units=row["sum_qty"],
+            )
+            for row in rows
+        ]
+        BrandOrder.objects.bulk_create(brand_orders, ignore_conflicts=True)
+        return len(brand_orders)
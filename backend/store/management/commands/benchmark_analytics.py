@@ -0,0 +1,124 @@
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from datetime import time as day_start
+
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from store import analytics
+from store.models import CartOrderProduct
+
+
+class Command(BaseCommand):
+    """
+    Time the NumPy brand analytics against the same metrics computed with
+    ORM aggregate queries (one per metric, finished in Python where SQL
+    cannot express them portably), and check that both agree.
+
+    Only live order lines are read by the ORM version.
+    """
+
+    help = "Benchmark brand analytics: NumPy arrays vs ORM aggregates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, required=True)
+        parser.add_argument("--days", type=int, default=365)
+
+    def handle(self, *args, **options):
+        end = timezone.localdate()
+        start = end - timedelta(days=options["days"] - 1)
+        since = timezone.make_aware(datetime.combine(start, day_start.min))
+        lines = CartOrderProduct.objects.filter(
+            brand_id=options["brand"],
+            order__payment_status="paid",
+            order__date__gte=since,
+        )
+        self.stdout.write(f"paid lines in range: {lines.count():,}")
+
+        started = time.perf_counter()
+        result = analytics.brand_analytics(options["brand"], start, end)
+        numpy_time = time.perf_counter() - started
+
+        timings = {}
+        orm = {}
+        for name in ("daily_revenue", "repeat_customers", "order_values",
+                     "cohorts"):
+            started = time.perf_counter()
+            orm[name] = getattr(self, name)(lines)
+            timings[name] = time.perf_counter() - started
+
+        for name, elapsed in timings.items():
+            self.stdout.write(f"orm {name:<24}{elapsed:>10.2f} s")
+        orm_time = sum(timings.values())
+        self.stdout.write(f"orm total{'':<20}{orm_time:>10.2f} s")
+        self.stdout.write(f"numpy (load + all metrics)   {numpy_time:>10.2f} s")
+
+        checks = {
+            "revenue": (
+                round(sum(day["revenue"] for day in result["daily_revenue"]), 2),
+                round(orm["daily_revenue"], 2),
+            ),
+            "repeat customers": (
+                result["repeat_customers"]["repeat_customers"],
+                orm["repeat_customers"],
+            ),
+            "median order value": (
+                result["order_values"]["percentiles"].get("p50"),
+                round(orm["order_values"], 2),
+            ),
+            "cohort buyers": (
+                sum(row["customers"] for row in result["cohorts"]),
+                orm["cohorts"],
+            ),
+        }
+        for name, (numpy_value, orm_value) in checks.items():
+            self.stdout.write(f"{name:<20}{numpy_value!s:>16}{orm_value!s:>16}")
+
+    def daily_revenue(self, lines):
+        days = (
+            lines.annotate(day=TruncDate("order__date"))
+            .values("day")
+            .annotate(revenue=models.Sum(
+                models.F("sub_total") + models.F("shipping_amount")))
+            .order_by("day")
+        )
+        return float(sum(row["revenue"] for row in days))
+
+    def repeat_customers(self, lines):
+        return (
+            lines.exclude(order__buyer=None)
+            .values("order__buyer")
+            .annotate(orders=models.Count("order", distinct=True))
+            .filter(orders__gt=1)
+            .count()
+        )
+
+    def order_values(self, lines):
+        values = (
+            lines.values("order")
+            .annotate(value=models.Sum(
+                models.F("sub_total") + models.F("shipping_amount")))
+            .values_list("value", flat=True)
+        )
+        return statistics.median(float(value) for value in values)
+
+    def cohorts(self, lines):
+        months = defaultdict(set)
+        rows = (
+            lines.exclude(order__buyer=None)
+            .annotate(month=TruncMonth("order__date"))
+            .values_list("order__buyer", "month")
+            .distinct()
+        )
+        for buyer, month in rows:
+            months[buyer].add(month.year * 12 + month.month)
+        retained = defaultdict(int)
+        for active in months.values():
+            first = min(active)
+            for month in active:
+                retained[(first, month - first)] += 1
+        return sum(count for (_, age), count in retained.items() if age == 0)
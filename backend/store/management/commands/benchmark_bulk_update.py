@@ -0,0 +1,88 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from brand.models import Brand
+from store.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Change the price and stock of --rows products of a brand through the
+    bulk update endpoint, as the brand's owner, then save --baseline of them one by one with
+    Product.save() the way the single product update does, and compare.
+    """
+
+    help = "Benchmark the bulk price and stock update endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, required=True)
+        parser.add_argument("--rows", type=int, default=10_000)
+        parser.add_argument("--baseline", type=int, default=1_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        brand = Brand.objects.filter(id=options["brand"]).first()
+        if brand is None or brand.user is None:
+            raise CommandError(
+                f"Brand {options['brand']} does not exist or has no owner")
+        pids = list(
+            Product.objects.filter(brand_id=options["brand"])
+            .order_by("id")
+            .values_list("pid", flat=True)[: options["rows"]]
+        )
+        if len(pids) < options["rows"]:
+            raise CommandError(
+                f"Brand {options['brand']} has only {len(pids)} products")
+        updates = [
+            {
+                "pid": pid,
+                "price": f"{rng.randint(500, 20_000) / 100:.2f}",
+                "stock_qty": rng.randint(0, 500),
+            }
+            for pid in pids
+        ]
+        body = json.dumps({"products": updates})
+
+        auth = f"Bearer {AccessToken.for_user(brand.user)}"
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = Client().post(
+                f"/api/v1/brand/bulk-update-products/{options['brand']}/",
+                body,
+                content_type="application/json",
+                HTTP_AUTHORIZATION=auth,
+            )
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(response.content.decode()[:500])
+        result = response.json()
+        self.stdout.write(
+            f"bulk endpoint  {len(updates):>7,} rows {elapsed:>8.2f} s "
+            f"{len(updates) / elapsed:>9,.0f} rows/s "
+            f"{len(queries):>6,} queries "
+            f"({result['updated']:,} updated, {result['failed']:,} failed)")
+
+        products = list(
+            Product.objects.filter(pid__in=pids[: options["baseline"]]))
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for product in products:
+                product.price = Decimal(rng.randint(500, 20_000)) / 100
+                product.stock_qty = rng.randint(0, 500)
+                with transaction.atomic():
+                    product.save()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Product.save() {len(products):>7,} rows {elapsed:>8.2f} s "
+            f"{len(products) / elapsed:>9,.0f} rows/s "
+            f"{len(queries):>6,} queries")
@@ -0,0 +1,133 @@
+import csv
+import hashlib
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from brand.models import Brand
+from store.catalog import FORMATS, CatalogImport
+from store.models import (
+    Color, MediaBlob, Picture, Product, Size, Specification)
+
+
+def sample_blobs(count=64):
+    """
+    Return the names of `count` blobs for the records' images. Imports
+    only check that a blob row exists, so the files are not written.
+    """
+    names = []
+    for index in range(count):
+        digest = hashlib.sha256(f"catalog-{index}".encode()).hexdigest()
+        names.append(f"cas/{digest[:2]}/{digest[2:4]}/{digest}.jpg")
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name) for name in names], ignore_conflicts=True)
+    return names
+
+
+def catalog_records(count, rng, images):
+    """
+    Yield synthetic product records with a few nested rows each.
+    """
+    for index in range(count):
+        yield {
+            "title": f"Catalog item {index}",
+            "description": "Imported product " * rng.randint(1, 10),
+            "price": f"{rng.randint(500, 20_000) / 100:.2f}",
+            "stock_qty": rng.randint(0, 100),
+            "image": rng.choice(images),
+            "specifications": [
+                {"title": f"Spec {spec}", "content": "Value"}
+                for spec in range(rng.randint(0, 4))
+            ],
+            "colors": [
+                {"name": name, "color_code": code}
+                for name, code in rng.sample(
+                    [("Red", "#f00"), ("Green", "#0f0"), ("Blue", "#00f")],
+                    rng.randint(0, 3))
+            ],
+            "sizes": [
+                {"name": name, "price": "0.00"}
+                for name in ("S", "M", "L")[: rng.randint(0, 3)]
+            ],
+            "gallery": rng.sample(images, rng.randint(0, 3)),
+        }
+
+
+class Command(BaseCommand):
+    """
+    Write a synthetic catalog file, import it into a new brand and report
+    throughput and the peak resident memory of the process.
+
+    Peak RSS comes from getrusage, so run one import per process.
+    """
+
+    help = "Benchmark the streaming catalog import"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--file-type", choices=FORMATS, default="jsonl")
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        file_type = options["file_type"]
+        brand = Brand.objects.create(
+            name="Catalog benchmark", slug=f"catalog-{time.time_ns()}")
+        images = sample_blobs()
+        # Titles repeat across runs, so later runs also exercise the
+        # slug conflict path
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=f".{file_type}", delete=False, newline=""
+        ) as output:
+            if file_type == "csv":
+                writer = csv.writer(output)
+                writer.writerow(next(catalog_records(1, rng, images)))
+            for record in catalog_records(
+                    options["products"], rng, images):
+                if file_type == "csv":
+                    writer.writerow(
+                        json.dumps(value) if isinstance(value, list)
+                        else value
+                        for value in record.values()
+                    )
+                else:
+                    output.write(json.dumps(record) + "\n")
+        size = os.path.getsize(output.name)
+
+        counts = self.counts()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            with open(output.name, "rb") as stream:
+                started = time.perf_counter()
+                catalog = CatalogImport(brand.id, stream, file_type)
+                for _ in catalog.run(options["batch_size"]):
+                    pass
+                elapsed = time.perf_counter() - started
+        finally:
+            os.unlink(output.name)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        self.stdout.write(f"file        {size / 2**20:>11,.1f} MiB")
+        self.stdout.write(f"rows        {catalog.position:>14,}")
+        self.stdout.write(f"created     {catalog.created:>14,}")
+        self.stdout.write(f"failed      {catalog.failed:>14,}")
+        for name, added in zip(counts, self.counts().values()):
+            self.stdout.write(f"{name:<12}{added - counts[name]:>14,}")
+        self.stdout.write(f"time        {elapsed:>12,.2f} s")
+        self.stdout.write(f"rows/s      {catalog.position / elapsed:>14,.0f}")
+        self.stdout.write(f"RSS before  {before / 1024:>11,.1f} MiB")
+        self.stdout.write(f"RSS peak    {peak / 1024:>11,.1f} MiB")
+        self.stdout.write(f"database    {connection.vendor}")
+
+    def counts(self):
+        return {
+            model._meta.model_name: model.objects.count()
+            for model in (Product, Specification, Color, Size, Picture)
+        }
@@ -0,0 +1,236 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from brand.models import Brand
+from store.models import Picture
+from userauths.models import User
+
+BLOCK = 2**20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory(pid):
+    """
+    Return the current and peak resident memory of a process in bytes,
+    from /proc (Linux only).
+    """
+    values = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) * 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def photo_blocks(index, size, start=0, end=None):
+    """
+    Yield bytes `start` to `end` of sample photo `index`, a block at a
+    time. Every photo has distinct content, so uploads are not shared.
+    """
+    end = size if end is None else end
+    filler = bytes(range(256)) * (BLOCK // 256)
+    position = start
+    while position < end:
+        block_number, skip = divmod(position, BLOCK)
+        block = (
+            index.to_bytes(4, "big") + block_number.to_bytes(4, "big")
+            + filler[8:]
+        )
+        length = min(BLOCK - skip, end - position)
+        yield block[skip:skip + length]
+        position += length
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body generated while it is sent, with its
+    length known up front.
+    """
+
+    def __init__(self, fields, photos, size):
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        for name, value in fields.items():
+            self.parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; '
+                f'name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, index in photos.items():
+            self.parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; '
+                f'name="{name}"; filename="photo-{index}.jpg"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n'.encode())
+            self.parts.append((index, size))
+            self.parts.append(b"\r\n")
+        self.parts.append(f"--{self.boundary}--\r\n".encode())
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return sum(
+            part[1] if isinstance(part, tuple) else len(part)
+            for part in self.parts
+        )
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, tuple):
+                yield from photo_blocks(*part)
+            else:
+                yield part
+
+
+class Command(BaseCommand):
+    """
+    Compare the memory a worker needs to receive a product with a large
+    gallery as one multipart form and as chunked uploads referred to by
+    token.
+
+    Each mode runs against its own `runserver` process (no threading, no
+    reloader) on the configured database and media root, and reports
+    that process's resident memory before the uploads and at its peak.
+    The photos are generated, incompressible bytes; they are not images,
+    so no resized copies are made. Chunks are sent as the brand's user.
+    The sample brand and user are deleted afterwards; collect_media
+    drops the blobs they leave.
+    """
+
+    help = "Measure worker memory of multipart and chunked product uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--photos", type=int, default=50)
+        parser.add_argument("--photo-mib", type=int, default=20)
+        parser.add_argument("--chunk-mib", type=int, default=8)
+        parser.add_argument(
+            "--mode", choices=("multipart", "chunked"), action="append",
+            help="Modes to run (default: both)")
+
+    def handle(self, *args, **options):
+        size = options["photo_mib"] * 2**20
+        if size > getattr(settings, "CHUNKED_UPLOAD_MAX_SIZE", 100 * 2**20):
+            raise CommandError("Photos are larger than CHUNKED_UPLOAD_MAX_SIZE")
+        tag = time.time_ns()
+        self.user = User.objects.create(
+            email=f"upload-{tag}@example.com", username=f"upload-{tag}")
+        brand = Brand.objects.create(
+            user=self.user, name="Upload benchmark", slug=f"upload-{tag}")
+        try:
+            for mode in options["mode"] or ("multipart", "chunked"):
+                self.run(mode, brand, size, options)
+        finally:
+            brand.delete()
+            self.user.delete()
+
+    def run(self, mode, brand, size, options):
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, "manage.py"),
+             "runserver", f"127.0.0.1:{port}", "--noreload",
+             "--nothreading", "--skip-checks"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            connection = self.connect(port, server)
+            # Load the views and serializers before measuring
+            self.request(connection, "GET", "/api/v1/category/")
+            baseline, _ = memory(server.pid)
+
+            slug = f"{brand.slug}-{mode}"
+            fields = {"title": f"Upload {mode}", "brand": brand.id,
+                      "slug": slug}
+            started = time.perf_counter()
+            if mode == "multipart":
+                photos = {
+                    f"gallery[{index}][image]": index
+                    for index in range(options["photos"])
+                }
+                self.create(connection, fields, photos, size)
+            else:
+                for index in range(options["photos"]):
+                    token = self.upload(
+                        connection, index, size, options["chunk_mib"] * 2**20)
+                    fields[f"gallery[{index}][upload]"] = token
+                self.create(connection, fields, {}, size)
+            elapsed = time.perf_counter() - started
+            _, peak = memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+        stored = Picture.objects.filter(product__slug=slug).count()
+        if stored != options["photos"]:
+            raise CommandError(f"{mode}: {stored} pictures stored")
+        sent = options["photos"] * size
+        self.stdout.write(f"-- {mode} --")
+        self.stdout.write(
+            f"uploaded    {sent / 2**20:>10,.0f} MiB in {elapsed:,.1f} s "
+            f"({sent / 2**20 / elapsed:,.1f} MiB/s)")
+        self.stdout.write(f"RSS before  {baseline / 2**20:>10,.1f} MiB")
+        self.stdout.write(
+            f"RSS peak    {peak / 2**20:>10,.1f} MiB "
+            f"(+{(peak - baseline) / 2**20:,.1f} MiB)")
+
+    def connect(self, port, server):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("The server did not start")
+            try:
+                with socket.create_connection(("127.0.0.1", port), 1):
+                    return http.client.HTTPConnection("127.0.0.1", port)
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError("The server did not start")
+
+    def request(self, connection, method, url, body=None, headers=None):
+        # The development server closes every connection after a response
+        connection.close()
+        connection.request(method, url, body=body, headers=headers or {})
+        response = connection.getresponse()
+        content = response.read()
+        if response.status >= 300:
+            raise CommandError(
+                f"{method} {url}: {response.status} {content[:500]!r}")
+        return json.loads(content) if content else None
+
+    def create(self, connection, fields, photos, size):
+        body = MultipartBody(fields, photos, size)
+        self.request(
+            connection, "POST", "/api/v1/brand/create-product/", iter(body),
+            {"Content-Type": body.content_type,
+             "Content-Length": str(len(body))})
+
+    def upload(self, connection, index, size, chunk):
+        # A new token per photo, so long runs outlive none
+        auth = f"Bearer {AccessToken.for_user(self.user)}"
+        upload = self.request(
+            connection, "POST", "/api/v1/uploads/",
+            json.dumps({"filename": f"photo-{index}.jpg", "size": size}),
+            {"Content-Type": "application/json", "Authorization": auth})
+        for start in range(0, size, chunk):
+            end = min(start + chunk, size)
+            self.request(
+                connection, "PUT", f"/api/v1/uploads/{upload['token']}/",
+                photo_blocks(index, size, start, end),
+                {"Upload-Offset": str(start),
+                 "Content-Length": str(end - start),
+                 "Content-Type": "application/octet-stream",
+                 "Authorization": auth})
+        return upload["token"]
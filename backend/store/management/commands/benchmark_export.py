@@ -0,0 +1,51 @@
+import resource
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.exports import FORMATS, export_chunks
+
+
+class Command(BaseCommand):
+    """
+    Export a brand's order lines the way the export endpoint does and
+    report throughput and the peak resident memory of the process.
+
+    Output is discarded; only the rows and bytes produced are counted.
+    Peak RSS comes from getrusage, so run one export per process.
+    """
+
+    help = "Benchmark the streaming order line export"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, required=True)
+        parser.add_argument("--days", type=int, default=3650,
+                            help="Export lines from the last N days")
+        parser.add_argument("--file-type", choices=list(FORMATS),
+                            default="csv")
+
+    def handle(self, *args, **options):
+        until = timezone.now()
+        since = until - timedelta(days=options["days"])
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        started = time.perf_counter()
+        rows = size = 0
+        for chunk in export_chunks(
+            options["brand"], since, until, options["file_type"]
+        ):
+            rows += chunk.count("\n")
+            size += len(chunk.encode())
+        elapsed = time.perf_counter() - started
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if options["file_type"] == "csv":
+            rows -= 1
+        self.stdout.write(f"rows        {rows:>14,}")
+        self.stdout.write(f"output      {size / 2**20:>11,.1f} MiB")
+        self.stdout.write(f"time        {elapsed:>12,.2f} s")
+        self.stdout.write(f"rows/s      {rows / elapsed:>14,.0f}")
+        self.stdout.write(f"RSS before  {before / 1024:>11,.1f} MiB")
+        self.stdout.write(f"RSS peak    {peak / 1024:>11,.1f} MiB")
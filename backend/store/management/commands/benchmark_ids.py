@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.ids import ShortUUIDGenerator, SnowflakeGenerator
+
+
+class Command(BaseCommand):
+    """
+    Compare insert throughput and unique index size of the old random
+    ShortUUID ids against the time-ordered Snowflake ids.
+
+    Each scheme gets its own scratch SQLite file with a table shaped like
+    the pid column of store_product, so the numbers are not affected by
+    the project database.
+    """
+
+    help = "Benchmark id generators: insert rate and unique index size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--batch", type=int, default=1_000)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        batch = options["batch"]
+        generators = {
+            "shortuuid": ShortUUIDGenerator(),
+            "snowflake": SnowflakeGenerator(worker_id=1),
+        }
+
+        self.stdout.write(f"{'scheme':<12}{'rows/s':>12}{'index KiB':>12}")
+        for name, generator in generators.items():
+            rate, index_bytes = self.run(generator, rows, batch)
+            self.stdout.write(
+                f"{name:<12}{rate:>12,.0f}{index_bytes / 1024:>12,.0f}"
+            )
+
+    def run(self, generator, rows, batch):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = sqlite3.connect(os.path.join(directory, "ids.db"))
+            connection.execute(
+                "CREATE TABLE item ("
+                "id INTEGER PRIMARY KEY, pid VARCHAR(20) NOT NULL UNIQUE)"
+            )
+
+            started = time.perf_counter()
+            for offset in range(0, rows, batch):
+                values = [
+                    (generator(),) for _ in range(min(batch, rows - offset))
+                ]
+                connection.executemany(
+                    "INSERT INTO item (pid) VALUES (?)", values)
+                connection.commit()
+            elapsed = time.perf_counter() - started
+
+            index_bytes = connection.execute(
+                "SELECT SUM(pgsize) FROM dbstat "
+                "WHERE name LIKE 'sqlite_autoindex_item%'"
+            ).fetchone()[0]
+            connection.close()
+
+        return rows / elapsed, index_bytes
@@ -0,0 +1,123 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from brand.models import Brand
+
+BACKENDS = {
+    "plain": "django.core.files.storage.FileSystemStorage",
+    "content-addressed": "store.storage.ContentAddressedStorage",
+}
+
+
+def disk_usage(root):
+    """Return the number of files under `root` and their total size."""
+    files = size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+class Command(BaseCommand):
+    """
+    Create a sample catalog through the product endpoints with each
+    storage backend and compare disk use and request latency.
+
+    Every product uploads one of --photos photos as its image and again
+    in its gallery next to a second photo, then is edited --edits times,
+    re-sending its gallery as the product form does. Image variants are
+    turned off so only the originals are measured. The sample brand is
+    deleted afterwards; collect_media drops the blob rows it leaves.
+    """
+
+    help = "Compare plain and content-addressed media storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--photos", type=int, default=40)
+        parser.add_argument("--photo-kib", type=int, default=400)
+        parser.add_argument("--edits", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        photos = [
+            rng.randbytes(options["photo_kib"] * 1024)
+            for _ in range(options["photos"])
+        ]
+        for label, backend in BACKENDS.items():
+            with tempfile.TemporaryDirectory() as root, override_settings(
+                MEDIA_ROOT=root,
+                STORAGES={
+                    "default": {"BACKEND": backend},
+                    "staticfiles": {"BACKEND": "django.contrib.staticfiles"
+                                    ".storage.StaticFilesStorage"},
+                },
+                IMAGE_VARIANTS={},
+            ):
+                self.run(label, photos, random.Random(options["seed"]),
+                         root, options)
+
+    def run(self, label, photos, rng, root, options):
+        client = Client()
+        brand = Brand.objects.create(
+            name=f"Media {label}", slug=f"media-{time.time_ns()}")
+
+        def form(index, photo, other):
+            return {
+                "title": f"Media item {index}",
+                "brand": brand.id,
+                "slug": f"{brand.slug}-{index}",
+                "image": SimpleUploadedFile("photo.jpg", photos[photo]),
+                "gallery[0][image]": SimpleUploadedFile(
+                    "photo.jpg", photos[photo]),
+                "gallery[1][image]": SimpleUploadedFile(
+                    "other.jpg", photos[other]),
+            }
+
+        creates, edits, products = [], [], []
+        for index in range(options["products"]):
+            photo, other = rng.sample(range(len(photos)), 2)
+            started = time.perf_counter()
+            response = client.post(
+                "/api/v1/brand/create-product/", form(index, photo, other))
+            creates.append(time.perf_counter() - started)
+            if response.status_code != 201:
+                raise CommandError(response.content.decode()[:500])
+            products.append((index, response.json()["pid"], photo, other))
+
+        for _ in range(options["edits"]):
+            for index, pid, photo, other in products:
+                body = encode_multipart(BOUNDARY, form(index, photo, other))
+                started = time.perf_counter()
+                response = client.put(
+                    f"/api/v1/brand/update-product/{brand.id}/{pid}/",
+                    body, content_type=MULTIPART_CONTENT)
+                edits.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(response.content.decode()[:500])
+
+        uploaded = 3 * (1 + options["edits"]) * options["products"] * (
+            options["photo_kib"] * 1024)
+        files, size = disk_usage(root)
+        self.stdout.write(f"-- {label} --")
+        self.stdout.write(f"uploaded    {uploaded / 2**20:>10,.1f} MiB")
+        self.stdout.write(
+            f"on disk     {size / 2**20:>10,.1f} MiB in {files:,} files")
+        for name, timings in (("create", creates), ("edit", edits)):
+            if not timings:
+                continue
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            self.stdout.write(
+                f"{name:<12}{statistics.median(timings) * 1000:>8.1f} ms "
+                f"median {p95 * 1000:>8.1f} ms p95")
+        brand.delete()
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from store.nested import parse_nested
+
+
+def legacy_parse(data):
+    """
+    The per-key loop the product views used before parse_nested(): a
+    string split and extra lookups for every matched key.
+    """
+    specifications, colors, sizes, pictures = [], [], [], []
+    for key, value in data.items():
+        if key.startswith("specifications") and "[title]" in key:
+            index = key.split("[")[1].split("]")[0]
+            content = data.get(f"specifications[{index}][content]")
+            specifications.append({"title": value, "content": content})
+        elif key.startswith("colors") and "[name]" in key:
+            index = key.split("[")[1].split("]")[0]
+            color_code = data.get(f"colors[{index}][color_code]")
+            colors.append({"name": value, "color_code": color_code})
+        elif key.startswith("sizes") and "[name]" in key:
+            index = key.split("[")[1].split("]")[0]
+            price = data.get(f"sizes[{index}][price]")
+            sizes.append({"name": value, "price": price})
+        elif key.startswith("gallery") and "[image]" in key:
+            pictures.append({"image": value})
+    return specifications, colors, sizes, pictures
+
+
+class Command(BaseCommand):
+    """
+    Time parse_nested() against the old per-key loop on a product form
+    with --items entries in every nested collection.
+    """
+
+    help = "Micro-benchmark the nested product form parser"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=1_000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        data = QueryDict(mutable=True)
+        data.update({"title": "Product", "brand": "1", "slug": "product"})
+        for index in range(options["items"]):
+            data[f"specifications[{index}][title]"] = f"Spec {index}"
+            data[f"specifications[{index}][content]"] = "Content"
+            data[f"colors[{index}][name]"] = f"Color {index}"
+            data[f"colors[{index}][color_code]"] = "#ffffff"
+            data[f"sizes[{index}][name]"] = f"Size {index}"
+            data[f"sizes[{index}][price]"] = "9.99"
+            data[f"gallery[{index}][id]"] = str(index)
+        self.stdout.write(f"{len(data):,} form keys")
+
+        for name, parse in (("legacy loop", legacy_parse),
+                            ("parse_nested", parse_nested)):
+            parse(data)
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                parse(data)
+            elapsed = (time.perf_counter() - started) / options["repeat"]
+            self.stdout.write(f"{name:<16}{elapsed * 1000:>10.2f} ms")
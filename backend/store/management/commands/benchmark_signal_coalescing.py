@@ -0,0 +1,158 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from brand.models import Brand
+from store.models import Product, Review, update_product_rating
+from userauths.models import Profile, User, save_user_profile
+
+
+def legacy_rating(sender, instance, **kwargs):
+    # The handler before coalescing
+    if instance.product:
+        instance.product.save()
+
+
+def legacy_profile(sender, instance, **kwargs):
+    instance.profile.save()
+
+
+class Command(BaseCommand):
+    """
+    Count the queries of bulk review and user edits made in one
+    transaction, with the post_save handlers running per save (legacy)
+    and deferred to commit, and check both leave the same ratings and
+    profiles.
+
+    Reviews: every review of --products products (--reviews each) gets a
+    new rating. Users: each of --users users is saved twice, as a form
+    saving a user and then their password would. Image variants are
+    turned off. The sample rows are deleted afterwards.
+    """
+
+    help = "Count queries of per-save and coalesced signal handlers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20)
+        parser.add_argument("--reviews", type=int, default=50)
+        parser.add_argument("--users", type=int, default=500)
+
+    @override_settings(IMAGE_VARIANTS={})
+    def handle(self, *args, **options):
+        tag = time.time_ns()
+        brand = Brand.objects.create(name="Signals", slug=f"signals-{tag}")
+        with transaction.atomic():
+            users = [
+                User.objects.create(
+                    email=f"signals-{tag}-{index}@example.com",
+                    username=f"signals-{tag}-{index}",
+                )
+                for index in range(options["users"])
+            ]
+            products = Product.objects.bulk_create(
+                Product(title=f"Signals {index}", brand=brand,
+                        slug=f"signals-{tag}-{index}")
+                for index in range(options["products"])
+            )
+            Review.objects.bulk_create(
+                Review(product=product, user=users[index % len(users)],
+                       review="Sample", rating=1 + index % 5)
+                for product in products
+                for index in range(options["reviews"])
+            )
+        product_ids = [product.id for product in products]
+        user_ids = [user.id for user in users]
+        try:
+            results = {}
+            for mode in ("legacy", "deferred"):
+                results[mode] = (
+                    self.reviews(mode, product_ids),
+                    self.users(mode, user_ids),
+                )
+        finally:
+            brand.delete()
+            User.objects.filter(id__in=user_ids).delete()
+
+        for index, name in enumerate(("reviews", "users")):
+            legacy, deferred = results["legacy"][index], results["deferred"][index]
+            if legacy[2] != deferred[2]:
+                raise CommandError(f"{name}: results differ")
+            self.stdout.write(f"-- {name} --")
+            for mode, (queries, elapsed, _) in (
+                ("legacy", legacy), ("deferred", deferred)
+            ):
+                self.stdout.write(
+                    f"{mode:<10}{queries:>8,} queries {elapsed * 1000:>9.1f} ms")
+
+    def swap(self, mode, sender, current, legacy):
+        # Connect the handler of `mode` in place of the other one
+        if mode == "legacy":
+            post_save.disconnect(current, sender=sender)
+            post_save.connect(legacy, sender=sender)
+        else:
+            post_save.disconnect(legacy, sender=sender)
+            post_save.connect(current, sender=sender)
+
+    def measure(self, work):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            with transaction.atomic():
+                work()
+            elapsed = time.perf_counter() - started
+        return len(queries), elapsed
+
+    def reviews(self, mode, product_ids):
+        reviews = list(
+            Review.objects.filter(product_id__in=product_ids)
+            .select_related("product")
+        )
+        # Shift every rating, differently in each mode
+        shift = 1 if mode == "legacy" else 2
+
+        def work():
+            for review in reviews:
+                review.rating = 1 + (review.rating - 1 + shift) % 5
+                review.save()
+
+        self.swap(mode, Review, update_product_rating, legacy_rating)
+        try:
+            queries, elapsed = self.measure(work)
+        finally:
+            self.swap("deferred", Review, update_product_rating, legacy_rating)
+        # Compare against a fresh recompute of the same ratings
+        expected = {
+            product.id: product.product_rating()
+            for product in Product.objects.filter(id__in=product_ids)
+        }
+        stored = dict(
+            Product.objects.filter(id__in=product_ids)
+            .values_list("id", "rating")
+        )
+        if {key: int(value) for key, value in expected.items()} != stored:
+            raise CommandError(f"{mode}: stale product ratings")
+        return queries, elapsed, True
+
+    def users(self, mode, user_ids):
+        Profile.objects.filter(user_id__in=user_ids).update(full_name="")
+        users = list(User.objects.filter(id__in=user_ids))
+        suffix = mode
+
+        def work():
+            for user in users:
+                user.full_name = f"{user.username} {suffix}"
+                user.save()
+                user.set_unusable_password()
+                user.save()
+
+        self.swap(mode, User, save_user_profile, legacy_profile)
+        try:
+            queries, elapsed = self.measure(work)
+        finally:
+            self.swap("deferred", User, save_user_profile, legacy_profile)
+        synced = Profile.objects.filter(
+            user_id__in=user_ids, full_name__endswith=f" {suffix}").count()
+        return queries, elapsed, synced == len(user_ids)
@@ -0,0 +1,184 @@
+import contextlib
+import io
+import itertools
+import math
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from store.throttling import parse_rate
+from userauths.models import User
+
+NORMAL_PATHS = ("/api/v1/category/", "/api/v1/products/")
+
+
+class Command(BaseCommand):
+    """
+    Load test of the throttled endpoints: --abusers scripted clients, each
+    from its own IP, request password resets, registrations and the cart
+    list every --interval seconds, while --normal clients browse the
+    catalog with --think seconds between requests. Reports the latency of
+    the normal requests and what became of the abusive ones, without
+    abuse, with throttling off, and with the local and cache buckets.
+    A last run has the abusive clients send a new X-Forwarded-For with
+    every request; it fails the command if that gets them more resets or
+    registrations than their own IPs are allowed.
+
+    The threads share this process, and the SQLite database, as the
+    workers of one server would; the clients' own work counts with the
+    server's, hence the pacing of the abusive ones. The sample users are
+    deleted afterwards.
+    """
+
+    help = "Load test the request throttling"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=30)
+        parser.add_argument("--abusers", type=int, default=4)
+        parser.add_argument("--normal", type=int, default=2)
+        parser.add_argument("--think", type=float, default=0.02)
+        parser.add_argument("--interval", type=float, default=0.005)
+
+    def handle(self, *args, **options):
+        self.tag = time.time_ns()
+        self.emails = itertools.count()
+        self.target = User.objects.create(
+            email=f"throttle-{self.tag}@example.com",
+            username=f"throttle-{self.tag}",
+        )
+        unthrottled = {
+            **settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": {}}
+        scenarios = (
+            ("no abuse", 0, {}, False),
+            ("unthrottled", options["abusers"],
+             {"REST_FRAMEWORK": unthrottled}, False),
+            ("local buckets", options["abusers"], {"THROTTLE_CACHE": None},
+             False),
+            ("cache buckets", options["abusers"],
+             {"THROTTLE_CACHE": "default"}, False),
+            ("rotating XFF", options["abusers"], {"THROTTLE_CACHE": None},
+             True),
+        )
+        try:
+            # The password reset view prints every reset link
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = []
+                for name, abusers, overrides, spoof in scenarios:
+                    cache.clear()
+                    with override_settings(**overrides):
+                        results.append(
+                            (name, self.run(abusers, options, spoof)))
+        finally:
+            User.objects.filter(email__startswith=f"throttle-{self.tag}").delete()
+            User.objects.filter(email__startswith=f"abuse-{self.tag}-").delete()
+
+        for name, (latencies, statuses, writes, rate) in results:
+            latencies.sort()
+            line = (
+                f"{name:<14} normal p50 "
+                f"{statistics.median(latencies) * 1000:6.1f} ms p99 "
+                f"{latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms")
+            if statuses:
+                served = sum(
+                    count for code, count in statuses.items() if code < 400)
+                line += (
+                    f" | abusive {rate:5.0f} req/s: {served:,} served, "
+                    f"{statuses[429]:,} throttled, {statuses[500]:,} failed, "
+                    f"{writes['reset']:,} resets, "
+                    f"{writes['register']:,} registrations")
+            self.stdout.write(line)
+
+        writes = results[-1][1][2]
+        for scope, kind in (("password-reset", "reset"),
+                            ("register", "register")):
+            allowed = self.allowance(scope, options)
+            if writes[kind] > allowed:
+                raise CommandError(
+                    f"Rotating X-Forwarded-For got {writes[kind]:,} {kind}s "
+                    f"past a limit of {allowed:,}: check NUM_PROXIES")
+
+    def allowance(self, scope, options):
+        # What the abusive clients' own IPs may do in one run
+        capacity, per_second = parse_rate(
+            settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"][scope])
+        return options["abusers"] * math.ceil(
+            capacity + per_second * options["duration"])
+
+    def run(self, abusers, options, spoof=False):
+        stop = threading.Event()
+        latencies, statuses = [], Counter()
+        writes = Counter()
+        lock = threading.Lock()
+
+        def normal(index):
+            client = Client(
+                REMOTE_ADDR=f"10.0.0.{index}", raise_request_exception=False)
+            try:
+                while not stop.is_set():
+                    for path in NORMAL_PATHS:
+                        started = time.perf_counter()
+                        client.get(path)
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            latencies.append(elapsed)
+                        time.sleep(options["think"])
+            finally:
+                connection.close()
+
+        def abusive(index):
+            # Other IPs than the earlier runs', whose local buckets remain
+            client = Client(
+                REMOTE_ADDR=f"10.{8 if spoof else 9}.0.{index}",
+                raise_request_exception=False)
+            try:
+                while not stop.is_set():
+                    number = next(self.emails)
+                    email = f"abuse-{self.tag}-{number}@example.com"
+                    headers = {}
+                    if spoof:
+                        headers["HTTP_X_FORWARDED_FOR"] = (
+                            f"198.18.{number // 256 % 256}.{number % 256}")
+                    requests = (
+                        ("reset", lambda: client.get(
+                            f"/api/v1/user/password-reset/{self.target.email}/",
+                            **headers)),
+                        ("register", lambda: client.post(
+                            "/api/v1/user/register/", {
+                                "full_name": "Abuse", "email": email,
+                                "phone": "0", "password": "Abuse-pass-314",
+                                "password2": "Abuse-pass-314"}, **headers)),
+                        ("cart", lambda: client.get(
+                            "/api/v1/cart-view/", **headers)),
+                    )
+                    for kind, request in requests:
+                        code = request().status_code
+                        with lock:
+                            statuses[code] += 1
+                            if code < 400 and kind != "cart":
+                                writes[kind] += 1
+                        time.sleep(options["interval"])
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=normal, args=(index,))
+            for index in range(options["normal"])
+        ] + [
+            threading.Thread(target=abusive, args=(index,))
+            for index in range(abusers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options["duration"])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        rate = sum(statuses.values()) / options["duration"]
+        return latencies, statuses, writes, rate
@@ -0,0 +1,42 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from store.analytics import brand_analytics
+
+
+class Command(BaseCommand):
+    """
+    Print the revenue analytics of a brand as JSON, the same document the
+    brand analytics endpoint returns.
+    """
+
+    help = "Compute revenue analytics for a brand"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, required=True)
+        parser.add_argument("--start", help="YYYY-MM-DD (default: a year "
+                            "before end)")
+        parser.add_argument("--end", help="YYYY-MM-DD (default: today)")
+
+    def handle(self, *args, **options):
+        end = self.parse(options["end"]) or timezone.localdate()
+        start = self.parse(options["start"]) or end - timedelta(days=365)
+        if start > end:
+            raise CommandError("--start must not be after --end")
+        analytics = brand_analytics(options["brand"], start, end)
+        self.stdout.write(json.dumps(analytics, indent=2))
+
+    def parse(self, value):
+        if value is None:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f"{value} is not a YYYY-MM-DD date")
+        return day
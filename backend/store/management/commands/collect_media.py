@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from store.storage import ContentAddressedStorage, collect_blobs
+
+
+class Command(BaseCommand):
+    """
+    Recount the references to content-addressed uploads and delete the
+    ones nothing refers to. Meant to run periodically (e.g. from cron).
+    """
+
+    help = "Garbage-collect unreferenced content-addressed uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-minutes", type=int, default=60,
+            help="Keep unreferenced blobs younger than this")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError(
+                "The default storage is not ContentAddressedStorage")
+        stats = collect_blobs(
+            default_storage,
+            grace=timedelta(minutes=options["grace_minutes"]),
+            dry_run=options["dry_run"],
+        )
+        self.stdout.write(
+            f"{stats['blobs']:,} blobs, {stats['references']:,} references, "
+            f"{stats['stored_bytes'] / 2**20:,.1f} MiB stored, "
+            f"{stats['saved_bytes'] / 2**20:,.1f} MiB saved by sharing")
+        self.stdout.write(
+            f"recounted {stats['recounted']:,}, adopted {stats['adopted']:,}")
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['deleted']:,} unreferenced blobs "
+            f"({stats['deleted_bytes'] / 2**20:,.1f} MiB)"))
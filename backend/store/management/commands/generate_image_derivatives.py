@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.images import IMAGE_MODELS, generate_variants, unmarked_images
+
+
+class Command(BaseCommand):
+    """
+    Write the resized and WebP copies of every stored image whose rows are
+    not marked as having them, with --workers threads, and report
+    throughput. Images whose copies exist are only marked.
+    """
+
+    help = "Backfill resized and WebP copies of stored images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int,
+            default=getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2))
+        parser.add_argument("--force", action="store_true",
+                            help="Rewrite copies that already exist")
+
+    def handle(self, *args, **options):
+        if options["force"]:
+            names = set()
+            for model in IMAGE_MODELS:
+                names.update(
+                    model.objects.exclude(image="").exclude(image=None)
+                    .values_list("image", flat=True).distinct()
+                )
+        else:
+            names = unmarked_images()
+        self.stdout.write(f"{len(names):,} images to process")
+
+        started = time.perf_counter()
+        done = written = 0
+        with ThreadPoolExecutor(options["workers"]) as executor:
+            for size in executor.map(
+                lambda name: generate_variants(name, options["force"]),
+                sorted(names),
+            ):
+                done += 1
+                written += size
+                if done % 100 == 0:
+                    self.stdout.write(f"processed {done:,} images")
+        elapsed = time.perf_counter() - started
+
+        ready = len(names - unmarked_images())
+        self.stdout.write(self.style.SUCCESS(
+            f"{ready:,} of {len(names):,} images have variants, "
+            f"{written / 2**20:,.1f} MiB written in {elapsed:.1f} s "
+            f"({len(names) / max(elapsed, 1e-9):,.1f} images/s)"))
@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brand.models import Brand
+from store.catalog import FORMATS, CatalogImport
+
+
+class Command(BaseCommand):
+    """
+    Import a brand's products from a CSV or JSON Lines catalog file.
+    Running it again on the same file resumes after the last committed
+    batch.
+    """
+
+    help = "Import products from a CSV or JSON Lines catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--brand", type=int, required=True)
+        parser.add_argument("--file-type", choices=FORMATS,
+                            help="Default: from the file extension")
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        if not Brand.objects.filter(id=options["brand"]).exists():
+            raise CommandError(f"Brand {options['brand']} does not exist")
+        file_type = options["file_type"] or os.path.splitext(
+            options["path"])[1].lstrip(".").lower()
+        if file_type not in FORMATS:
+            raise CommandError(f"Pass --file-type ({', '.join(FORMATS)})")
+
+        with open(options["path"], "rb") as stream:
+            catalog = CatalogImport(options["brand"], stream, file_type)
+            if catalog.resumed_from:
+                self.stdout.write(
+                    f"resuming after row {catalog.resumed_from:,}")
+            started = time.perf_counter()
+            for _ in catalog.run(options["batch_size"]):
+                self.stdout.write(
+                    f"row {catalog.position:,}: {catalog.created:,} created, "
+                    f"{catalog.failed:,} failed")
+            elapsed = time.perf_counter() - started
+
+        for error in catalog.errors:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        rows = catalog.position - catalog.resumed_from
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {catalog.created:,} products from {rows:,} rows in "
+            f"{elapsed:.1f} s ({rows / max(elapsed, 1e-9):,.0f} rows/s)"))
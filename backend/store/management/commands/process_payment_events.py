@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from store.models import PaymentEvent
+from store.payments import EventDispatcher
+
+
+class Command(BaseCommand):
+    """
+    Apply payment events that are still in the "received" state, e.g.
+    events stored just before a restart.
+    """
+
+    help = "Apply pending payment webhook events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+
+    def handle(self, *args, **options):
+        order_oids = (
+            PaymentEvent.objects.filter(state="received")
+            .values_list("order_oid", flat=True)
+            .distinct()
+        )
+        dispatcher = EventDispatcher(options["workers"])
+        count = 0
+        for order_oid in order_oids.iterator():
+            dispatcher.submit(order_oid)
+            count += 1
+        dispatcher.join()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed events for {count} orders"))
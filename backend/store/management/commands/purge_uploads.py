@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.uploads import purge_uploads
+
+
+class Command(BaseCommand):
+    """
+    Remove chunked uploads nobody finished or used in a product form.
+    Meant to run periodically (e.g. from cron).
+    """
+
+    help = "Remove abandoned chunked uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours", type=float,
+            help="Remove uploads idle for longer than this "
+            "(default: CHUNKED_UPLOAD_EXPIRY)")
+
+    def handle(self, *args, **options):
+        if options["hours"] is None:
+            expiry = getattr(
+                settings, "CHUNKED_UPLOAD_EXPIRY", timedelta(hours=24))
+        else:
+            expiry = timedelta(hours=options["hours"])
+        removed, freed = purge_uploads(expiry)
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed:,} uploads ({freed / 2**20:,.1f} MiB)"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.rankings import collect_sales, rank_products
+
+
+class Command(BaseCommand):
+    """
+    Fold new order lines into the per-day product sales and rebuild the
+    best seller rankings. Meant to run periodically (e.g. from cron).
+    """
+
+    help = "Collect new order lines and rebuild best seller rankings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for collected in collect_sales(options["batch_size"]):
+            total += collected
+            self.stdout.write(f"collected {total} order lines")
+        rows = rank_products()
+        self.stdout.write(self.style.SUCCESS(
+            f"Collected {total} order lines, wrote {rows} ranking rows"))
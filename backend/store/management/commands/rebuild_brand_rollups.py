@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from brand.models import Brand
+from store.models import BrandDailyStats
+
+
+class Command(BaseCommand):
+    """
+    Recompute the per-brand daily rollups behind the brand charts, for
+    all brands or the ones given with --brand.
+    """
+
+    help = "Backfill BrandDailyStats from sub-orders and products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, action="append",
+                            help="Only rebuild this brand id (repeatable)")
+
+    def handle(self, *args, **options):
+        brand_ids = options["brand"] or Brand.objects.values_list(
+            "id", flat=True)
+        for brand_id in brand_ids:
+            days = BrandDailyStats.rebuild(brand_id)
+            self.stdout.write(f"brand {brand_id}: {days} days")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from brand.models import Brand
+from store.models import BrandStats
+
+
+class Command(BaseCommand):
+    """
+    Recompute BrandStats from products and sub-orders, for all brands or
+    the ones given with --brand.
+    """
+
+    help = "Rebuild the materialized brand statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brand", type=int, action="append",
+                            help="Only rebuild this brand id (repeatable)")
+
+    def handle(self, *args, **options):
+        brand_ids = options["brand"] or Brand.objects.values_list(
+            "id", flat=True)
+        count = 0
+        for brand_id in brand_ids:
+            BrandStats.rebuild(brand_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} brands"))
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from store.snapshots import refresh_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Take a new read-only snapshot of the database for reporting views.
+    Run it from cron, or keep it running with --every.
+    """
+
+    help = "Copy the database into the reporting snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--every", type=int, default=0,
+            help="Keep refreshing every N seconds",
+        )
+        parser.add_argument(
+            "--pages", type=int, default=4096,
+            help="Pages copied per backup step",
+        )
+
+    def handle(self, *args, **options):
+        if getattr(settings, "REPORTING_SNAPSHOT_PATH", None) is None:
+            raise CommandError("REPORTING_SNAPSHOT_PATH is not set")
+        while True:
+            try:
+                elapsed = refresh_snapshot(options["pages"])
+            except ValueError as error:
+                raise CommandError(str(error))
+            self.stdout.write(
+                f"Snapshot written to {settings.REPORTING_SNAPSHOT_PATH} "
+                f"in {elapsed:.2f}s")
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
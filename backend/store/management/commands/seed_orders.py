@@ -0,0 +1,137 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from brand.models import Brand
+from store.models import CartOrder, CartOrderProduct, Product
+from userauths.models import User
+
+
+class Command(BaseCommand):
+    """
+    Fill the database with synthetic brands, products and orders.
+
+    Only meant for local benchmarking; rows are written with bulk_create
+    so model save hooks and signals do not run.
+    """
+
+    help = "Create synthetic brands, products and orders for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--brands", type=int, default=10)
+        parser.add_argument("--products", type=int, default=50,
+                            help="Products per brand")
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument("--lines", type=int, default=3,
+                            help="Maximum lines per order")
+        parser.add_argument("--days", type=int, default=730,
+                            help="Spread order dates over this many days")
+        parser.add_argument("--buyers", type=int, default=0,
+                            help="Signed-in buyers to spread orders over "
+                            "(default: guest orders only)")
+        parser.add_argument("--batch", type=int, default=2_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        now = timezone.now()
+
+        with transaction.atomic():
+            brands = Brand.objects.bulk_create(
+                [
+                    Brand(name=f"Seed brand {index}",
+                          slug=f"seed-brand-{now.timestamp():.0f}-{index}")
+                    for index in range(options["brands"])
+                ]
+            )
+            products = Product.objects.bulk_create(
+                [
+                    Product(
+                        title=f"{brand.name} item {index}",
+                        brand=brand,
+                        price=Decimal(rng.randint(500, 20_000)) / 100,
+                        slug=f"{brand.slug}-item-{index}",
+                        date=now - timedelta(days=rng.randint(0, options["days"])),
+                    )
+                    for brand in brands
+                    for index in range(options["products"])
+                ]
+            )
+            buyers = User.objects.bulk_create(
+                [
+                    User(username=f"seed-{now.timestamp():.0f}-{index}",
+                         email=f"seed-{now.timestamp():.0f}-{index}@example.com")
+                    for index in range(options["buyers"])
+                ]
+            )
+
+        created = 0
+        while created < options["orders"]:
+            size = min(options["batch"], options["orders"] - created)
+            self.create_orders(rng, now, products, buyers, size, options)
+            created += size
+            self.stdout.write(f"{created} orders")
+
+    @transaction.atomic
+    def create_orders(self, rng, now, products, buyers, size, options):
+        # Pick the lines first so order totals are known before insert
+        baskets = []
+        orders = []
+        for _ in range(size):
+            basket = []
+            for product in rng.sample(products, rng.randint(1, options["lines"])):
+                qty = rng.randint(1, 4)
+                basket.append((product, qty, product.price * qty,
+                               Decimal("2.50") * qty))
+            sub_total = sum(line[2] for line in basket)
+            shipping = sum(line[3] for line in basket)
+            baskets.append(basket)
+            orders.append(
+                CartOrder(
+                    buyer=rng.choice(buyers) if buyers else None,
+                    payment_status=rng.choice(
+                        ["paid", "paid", "paid", "pending", "cancelled"]),
+                    order_status=rng.choice(
+                        ["Completed", "Completed", "Pending", "Cancelled"]),
+                    sub_total=sub_total,
+                    shipping_amount=shipping,
+                    total=sub_total + shipping,
+                    original_total=sub_total + shipping,
+                    date=now - timedelta(
+                        days=rng.randint(0, options["days"]),
+                        seconds=rng.randint(0, 86_399),
+                    ),
+                )
+            )
+        orders = CartOrder.objects.bulk_create(orders)
+
+        lines = []
+        links = set()
+        for order, basket in zip(orders, baskets):
+            for product, qty, sub_total, shipping in basket:
+                lines.append(
+                    CartOrderProduct(
+                        order=order,
+                        product=product,
+                        brand_id=product.brand_id,
+                        qty=qty,
+                        price=product.price,
+                        sub_total=sub_total,
+                        shipping_amount=shipping,
+                        total=sub_total + shipping,
+                        original_total=sub_total + shipping,
+                        date=order.date,
+                    )
+                )
+                links.add((order.id, product.brand_id))
+        CartOrderProduct.objects.bulk_create(lines)
+
+        through = CartOrder.brand.through
+        through.objects.bulk_create(
+            [through(cartorder_id=order_id, brand_id=brand_id)
+             for order_id, brand_id in links]
+        )
@@ -0,0 +1,126 @@
+import json
+import random
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import Client
+
+from store.models import CartOrder, PaymentEvent
+from store.payments import get_dispatcher, sign
+
+WEBHOOK_PATH = "/api/v1/payment/webhook/"
+
+
+class Command(BaseCommand):
+    """
+    Local stand-in for a payment gateway.
+
+    Takes pending orders, generates the events a gateway would send for
+    them (processing, then paid or cancelled), adds redeliveries and
+    shuffles them, and replays them against the webhook. Without --url
+    the events go through the Django test client in this process, so the
+    run can wait for the background workers and report the end result.
+    Events are signed with PAYMENT_WEBHOOK_SECRET, or --secret for a
+    server configured with another one.
+    """
+
+    help = "Replay simulated payment gateway events against the webhook"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1_000)
+        parser.add_argument("--duplicates", type=float, default=0.1,
+                            help="Share of events delivered twice")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--url", help="Send to a running server instead")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--secret", help="Webhook secret of --url")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        oids = list(
+            CartOrder.objects.filter(payment_status="pending")
+            .values_list("oid", flat=True)[: options["orders"]]
+        )
+        events = self.build_events(rng, oids, options["duplicates"])
+        self.stdout.write(
+            f"Replaying {len(events)} events for {len(oids)} orders")
+
+        secret = options["secret"] or settings.PAYMENT_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError(
+                "Set PAYMENT_WEBHOOK_SECRET (or --secret) to sign the events")
+        send = (
+            self.http_sender(options["url"], secret) if options["url"]
+            else self.client_sender(secret)
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            codes = list(pool.map(send, events))
+        accepted = time.perf_counter() - started
+        self.stdout.write(
+            f"Accepted in {accepted:.2f}s "
+            f"({len(events) / accepted:,.0f} events/s), "
+            f"non-200 responses: {sum(code != 200 for code in codes)}"
+        )
+
+        if options["url"]:
+            return
+        get_dispatcher().join()
+        done = time.perf_counter() - started
+        states = PaymentEvent.objects.filter(
+            order_oid__in=oids).values_list("state", flat=True)
+        summary = {}
+        for state in states:
+            summary[state] = summary.get(state, 0) + 1
+        self.stdout.write(
+            f"Applied in {done:.2f}s ({len(events) / done:,.0f} events/s), "
+            f"event states: {summary}"
+        )
+
+    def build_events(self, rng, oids, duplicates):
+        events = []
+        now = time.time()
+        for oid in oids:
+            final = "paid" if rng.random() < 0.9 else "cancelled"
+            for offset, state in enumerate(("processing", final)):
+                events.append({
+                    "id": f"evt_{uuid.uuid4().hex}",
+                    "order_oid": oid,
+                    "status": state,
+                    "created": now + offset,
+                })
+        events += [dict(event) for event in events if rng.random() < duplicates]
+        rng.shuffle(events)
+        return events
+
+    def client_sender(self, secret):
+        def send(event):
+            body = json.dumps(event).encode()
+            try:
+                return Client().post(
+                    WEBHOOK_PATH, data=body, content_type="application/json",
+                    HTTP_X_RIZ_SIGNATURE=sign(body, secret),
+                ).status_code
+            finally:
+                close_old_connections()
+        return send
+
+    def http_sender(self, url, secret):
+        def send(event):
+            body = json.dumps(event).encode()
+            request = urllib.request.Request(
+                url.rstrip("/") + WEBHOOK_PATH,
+                data=body,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Riz-Signature": sign(body, secret),
+                },
+            )
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        return send
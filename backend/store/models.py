@@ -3,8 +3,13 @@ from shortuuid.django_fields import ShortUUIDField
 from django.utils import timezone
 from django.dispatch import receiver
 from django.utils.text import slugify
-from django.db.models.signals import post_save
+from django.db import IntegrityError, transaction
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
 from brand.models import Brand
+from store.ids import TimeOrderedIDField
+from store.cache import bump_brand_version
+from store.deferred import chunked, defer
 from userauths.models import User, Profile
 
 
@@ -14,6 +19,8 @@ class Category(models.Model):
     image = models.FileField(
         upload_to="category", default="category.jpg", null=True, blank=True
     )
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
     active = models.BooleanField(default=True)
     slug = models.SlugField(unique=True)
 
@@ -40,6 +47,8 @@ class Product(models.Model):
     image = models.FileField(
         upload_to="product", blank=True, null=True, default="product.jpg"
     )
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
     description = models.TextField(null=True, blank=True)
     category = models.ForeignKey(
         Category, on_delete=models.SET_NULL, null=True, blank=True
@@ -63,9 +72,7 @@ class Product(models.Model):
     views = models.PositiveIntegerField(default=0)
     rating = models.IntegerField(default=0, null=True, blank=True)
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
-    pid = ShortUUIDField(
-        unique=True, length=10, max_length=20, alphabet="abcdefghij123456789"
-    )
+    pid = TimeOrderedIDField(unique=True, max_length=20)
     slug = models.SlugField(unique=True)
     date = models.DateTimeField(default=timezone.now)
 
@@ -115,10 +122,11 @@ class Picture(models.Model):
     """Model representing a picture associated with a product."""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True)
     image = models.FileField(upload_to="product", default="product  .jpg")
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
     active = models.BooleanField(default=True)
     date = models.DateTimeField(auto_now_add=True)
-    pic_id = ShortUUIDField(
-        length=10, max_length=25, alphabet="abcdefghij123456789")
+    pic_id = TimeOrderedIDField(unique=True, max_length=25)
 
     def __str__(self):
         return self.product.title
@@ -151,6 +159,8 @@ class Color(models.Model):
     name = models.CharField(max_length=100, blank=True, null=True)
     color_code = models.CharField(max_length=100, blank=True, null=True)
     image = models.FileField(upload_to="product", blank=True, null=True)
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -190,8 +200,8 @@ class Cart(models.Model):
         return f"{self.cart_id} - {self.product.title}"
 
 
-class CartOrder(models.Model):
-    """Model representing an order made from the shopping cart."""
+class AbstractCartOrder(models.Model):
+    """Columns shared by live and archived orders."""
     PAYMENT_STATUS = (
         ("paid", "Paid"),
         ("pending", "Pending"),
@@ -241,22 +251,38 @@ class CartOrder(models.Model):
     city = models.CharField(max_length=1000, null=True, blank=True)
     state = models.CharField(max_length=1000, null=True, blank=True)
     country = models.CharField(max_length=1000, null=True, blank=True)
-    oid = ShortUUIDField(
-        length=10, max_length=25, alphabet="abcdefghij123456789")
+    oid = TimeOrderedIDField(unique=True, max_length=25)
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return self.oid
 
+
+class CartOrder(AbstractCartOrder):
+    """Model representing an order made from the shopping cart."""
+
     def get_order_items(self):
         """Return all items in the order."""
         return CartOrderProduct.objects.filter(order=self)
 
 
-class CartOrderProduct(models.Model):
-    """Model representing a product within an order."""
+class ArchivedCartOrder(AbstractCartOrder):
+    """
+    Completed or cancelled order moved out of CartOrder by the
+    archive_orders command. Keeps the primary key of the original row.
+    """
+
+    def get_order_items(self):
+        """Return all items in the archived order."""
+        return ArchivedCartOrderProduct.objects.filter(order=self)
+
+
+class AbstractCartOrderProduct(models.Model):
+    """Columns shared by live and archived order lines."""
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
-    order = models.ForeignKey(CartOrder, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     qty = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
@@ -271,8 +297,7 @@ class CartOrderProduct(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     color = models.CharField(max_length=100, null=True, blank=True)
     size = models.CharField(max_length=100, null=True, blank=True)
-    oid = ShortUUIDField(
-        length=10, max_length=25, alphabet="abcdefghij123456789")
+    oid = TimeOrderedIDField(unique=True, max_length=25)
     date = models.DateTimeField(default=timezone.now)
 
     # Coupons that can be given
@@ -282,10 +307,462 @@ class CartOrderProduct(models.Model):
         max_digits=12, decimal_places=2, default=0.00, null=True, blank=True
     )
 
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return self.oid
 
 
+class CartOrderProduct(AbstractCartOrderProduct):
+    """Model representing a product within an order."""
+    order = models.ForeignKey(CartOrder, on_delete=models.CASCADE)
+
+
+class ArchivedCartOrderProduct(AbstractCartOrderProduct):
+    """Order line belonging to an ArchivedCartOrder."""
+    order = models.ForeignKey(ArchivedCartOrder, on_delete=models.CASCADE)
+
+
+class BrandOrder(models.Model):
+    """
+    One brand's share of an order.
+
+    Written together with the order lines so brand-facing queries read
+    one narrow table instead of joining CartOrder through its brand M2M.
+    The row outlives the order when it is archived.
+    """
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
+    order = models.ForeignKey(
+        CartOrder, on_delete=models.SET_NULL, null=True, blank=True)
+    oid = models.CharField(max_length=25)
+    sub_total = models.DecimalField(
+        default=0.00, max_digits=12, decimal_places=2)
+    shipping_amount = models.DecimalField(
+        default=0.00, max_digits=12, decimal_places=2)
+    tax_fee = models.DecimalField(
+        default=0.00, max_digits=12, decimal_places=2)
+    service_fee = models.DecimalField(
+        default=0.00, max_digits=12, decimal_places=2)
+    total = models.DecimalField(default=0.00, max_digits=12, decimal_places=2)
+    units = models.PositiveIntegerField(default=0)
+    payment_status = models.CharField(
+        max_length=100, choices=CartOrder.PAYMENT_STATUS, default="pending"
+    )
+    order_status = models.CharField(
+        max_length=100, choices=CartOrder.ORDER_STATUS, default="Pending"
+    )
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["brand", "oid"], name="unique_brand_order")
+        ]
+        indexes = [models.Index(fields=["brand", "payment_status", "date"])]
+
+    def __str__(self):
+        return f"{self.oid} - {self.brand}"
+
+
+class BrandStats(models.Model):
+    """
+    Running totals behind the brand dashboard, keyed by brand.
+
+    Kept up to date as products are added/removed and as orders move in
+    and out of "paid"; rebuild() recomputes a row from scratch.
+    """
+    brand = models.OneToOneField(
+        Brand, on_delete=models.CASCADE, primary_key=True)
+    products = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    income = models.DecimalField(
+        default=0.00, max_digits=14, decimal_places=2)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Brand Stats"
+
+    def __str__(self):
+        return str(self.brand)
+
+    @classmethod
+    def adjust(cls, brand_id, products=0, orders=0, income=0):
+        """Add the given deltas to a brand's totals."""
+        changes = {
+            "products": models.F("products") + products,
+            "orders": models.F("orders") + orders,
+            "income": models.F("income") + income,
+            "updated": timezone.now(),
+        }
+        if not cls.objects.filter(brand_id=brand_id).update(**changes):
+            cls.rebuild(brand_id)
+        bump_brand_version(brand_id)
+
+    @classmethod
+    def rebuild(cls, brand_id):
+        """Recompute a brand's totals from products and sub-orders."""
+        paid = BrandOrder.objects.filter(
+            brand_id=brand_id, payment_status="paid"
+        ).aggregate(
+            orders=models.Count("id"),
+            income=models.Sum(
+                models.F("sub_total") + models.F("shipping_amount")),
+        )
+        stats, _ = cls.objects.update_or_create(
+            brand_id=brand_id,
+            defaults={
+                "products": Product.objects.filter(brand_id=brand_id).count(),
+                "orders": paid["orders"],
+                "income": paid["income"] or 0,
+            },
+        )
+        bump_brand_version(brand_id)
+        return stats
+
+
+class BrandDailyStats(models.Model):
+    """
+    Per-brand totals for one day: paid orders, units sold, revenue and
+    products added. Brand charts add these rows up instead of scanning
+    orders and products.
+    """
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(
+        default=0.00, max_digits=14, decimal_places=2)
+    products = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Brand Daily Stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["brand", "day"], name="unique_brand_day")
+        ]
+
+    def __str__(self):
+        return f"{self.brand} - {self.day}"
+
+    @classmethod
+    def adjust(cls, brand_id, day, **deltas):
+        """Add the given deltas to a brand's row for `day`."""
+        changes = {
+            field: models.F(field) + value for field, value in deltas.items()
+        }
+        rows = cls.objects.filter(brand_id=brand_id, day=day)
+        if not rows.update(**changes):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(brand_id=brand_id, day=day, **deltas)
+            except IntegrityError:
+                # Created concurrently, add to that row instead
+                rows.update(**changes)
+        bump_brand_version(brand_id)
+
+    @classmethod
+    def rebuild(cls, brand_id):
+        """Recompute every daily row of a brand from scratch."""
+        days = {}
+        paid = (
+            BrandOrder.objects.filter(brand_id=brand_id, payment_status="paid")
+            .annotate(day=TruncDate("date"))
+            .values("day")
+            .annotate(
+                order_count=models.Count("id"),
+                unit_count=models.Sum("units"),
+                income=models.Sum(
+                    models.F("sub_total") + models.F("shipping_amount")),
+            )
+        )
+        for row in paid:
+            day = days.setdefault(
+                row["day"], cls(brand_id=brand_id, day=row["day"]))
+            day.orders = row["order_count"]
+            day.units = row["unit_count"] or 0
+            day.revenue = row["income"] or 0
+        added = (
+            Product.objects.filter(brand_id=brand_id)
+            .annotate(day=TruncDate("date"))
+            .values("day")
+            .annotate(product_count=models.Count("id"))
+        )
+        for row in added:
+            day = days.setdefault(
+                row["day"], cls(brand_id=brand_id, day=row["day"]))
+            day.products = row["product_count"]
+
+        with transaction.atomic():
+            cls.objects.filter(brand_id=brand_id).delete()
+            cls.objects.bulk_create(days.values(), batch_size=1000)
+        bump_brand_version(brand_id)
+        return len(days)
+
+
+class Watermark(models.Model):
+    """Position up to which a background job has processed a table."""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+    @classmethod
+    def lock(cls, name):
+        """
+        Return the watermark row, locked until the end of the current
+        transaction.
+        """
+        cls.objects.get_or_create(name=name)
+        return cls.objects.select_for_update().get(name=name)
+
+
+class ProductSales(models.Model):
+    """
+    Units and revenue of paid order lines, per product and day.
+
+    Filled incrementally by store.rankings.collect_sales() from the order
+    lines past its watermark. Lines the job has already passed are
+    counted by add_counted() when their order is paid or refunded later.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(
+        default=0.00, max_digits=14, decimal_places=2)
+
+    WATERMARK = "product_sales"
+
+    class Meta:
+        verbose_name_plural = "Product Sales"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "day"], name="unique_product_day"),
+        ]
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self):
+        return f"{self.product_id} {self.day}"
+
+    @classmethod
+    def add(cls, totals):
+        """
+        Add {(product_id, day): (units, revenue)} onto the stored rows.
+        Callers hold the watermark lock.
+        """
+        created = []
+        for (product_id, day), (units, revenue) in totals.items():
+            if not cls.objects.filter(product_id=product_id, day=day).update(
+                units=models.F("units") + units,
+                revenue=models.F("revenue") + revenue,
+            ):
+                created.append(cls(product_id=product_id, day=day,
+                                   units=units, revenue=revenue))
+        cls.objects.bulk_create(created, batch_size=1000)
+        # Brand dashboards list their best sellers from these rows
+        for brand_id in Product.objects.filter(
+            id__in={product_id for product_id, _ in totals}
+        ).values_list("brand_id", flat=True).distinct():
+            bump_brand_version(brand_id)
+
+    @classmethod
+    def add_counted(cls, lines):
+        """
+        Apply (line_id, product_id, day, units, revenue) changes, keeping
+        only lines the collector has already counted; later lines are
+        picked up by the collector with their current status.
+        """
+        with transaction.atomic():
+            watermark = Watermark.lock(cls.WATERMARK)
+            totals = {}
+            for line_id, product_id, day, units, revenue in lines:
+                if line_id > watermark.position:
+                    continue
+                old = totals.get((product_id, day), (0, 0))
+                totals[(product_id, day)] = (old[0] + units, old[1] + revenue)
+            cls.add(totals)
+
+
+class ProductRanking(models.Model):
+    """
+    Precomputed best sellers for one scope, window and metric.
+
+    Rebuilt from ProductSales by store.rankings.rank_products(); scope_id
+    is the brand or category id and is empty for the global lists.
+    """
+
+    SCOPES = (
+        ("global", "Global"),
+        ("brand", "Brand"),
+        ("category", "Category"),
+    )
+    METRICS = (
+        ("units", "Units"),
+        ("revenue", "Revenue"),
+    )
+
+    scope = models.CharField(choices=SCOPES, max_length=10)
+    scope_id = models.PositiveIntegerField(null=True, blank=True)
+    window = models.PositiveSmallIntegerField(help_text="Days")
+    metric = models.CharField(choices=METRICS, max_length=10)
+    rank = models.PositiveIntegerField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(
+        default=0.00, max_digits=14, decimal_places=2)
+    computed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["rank"]
+        indexes = [
+            models.Index(fields=["scope", "scope_id", "window", "metric",
+                                 "rank"]),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.window}d #{self.rank} {self.product_id}"
+
+
+class MediaBlob(models.Model):
+    """
+    A stored upload of store.storage.ContentAddressedStorage and the
+    number of file fields pointing to it.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refs = models.IntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
+
+
+class ChunkedUpload(models.Model):
+    """
+    A file sent in chunks through store.uploads, and how much of it arrived.
+    """
+    token = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return self.received >= self.size
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+
+@receiver(post_save, sender=CartOrder)
+def sync_brand_order_status(sender, instance, created, **kwargs):
+    """
+    Keep the brand sub-orders' statuses in step with their order and
+    move their totals in or out of the brand stats when the order
+    starts or stops being paid.
+    """
+    if created:
+        return
+    with transaction.atomic():
+        brand_orders = BrandOrder.objects.filter(order=instance)
+        changed = list(
+            brand_orders.select_for_update()
+            .exclude(payment_status=instance.payment_status)
+            .values("brand_id", "payment_status", "date", "units",
+                    "sub_total", "shipping_amount")
+        )
+        brand_orders.update(
+            payment_status=instance.payment_status,
+            order_status=instance.order_status,
+        )
+        counted = 0
+        for row in changed:
+            if instance.payment_status == "paid":
+                sign = 1
+            elif row["payment_status"] == "paid":
+                sign = -1
+            else:
+                continue
+            counted = sign
+            income = row["sub_total"] + row["shipping_amount"]
+            BrandStats.adjust(
+                row["brand_id"], orders=sign, income=sign * income)
+            BrandDailyStats.adjust(
+                row["brand_id"],
+                timezone.localdate(row["date"]),
+                orders=sign,
+                units=sign * row["units"],
+                revenue=sign * income,
+            )
+        if counted:
+            ProductSales.add_counted(
+                (line.id, line.product_id, timezone.localdate(line.date),
+                 counted * line.qty, counted * line.sub_total)
+                for line in CartOrderProduct.objects.filter(order=instance)
+                .only("id", "product_id", "date", "qty", "sub_total")
+            )
+
+
+@receiver(post_save, sender=Product)
+def count_added_product(sender, instance, created, **kwargs):
+    """Count a new product in its brand's stats."""
+    if created:
+        BrandStats.adjust(instance.brand_id, products=1)
+        BrandDailyStats.adjust(
+            instance.brand_id, timezone.localdate(instance.date), products=1)
+
+
+@receiver(post_delete, sender=Product)
+def count_removed_product(sender, instance, **kwargs):
+    """Drop a deleted product from its brand's stats."""
+    # No rebuild here: the brand itself may be in the middle of a delete
+    BrandStats.objects.filter(brand_id=instance.brand_id).update(
+        products=models.F("products") - 1, updated=timezone.now()
+    )
+    BrandDailyStats.objects.filter(
+        brand_id=instance.brand_id, day=timezone.localdate(instance.date)
+    ).update(products=models.F("products") - 1)
+    bump_brand_version(instance.brand_id)
+
+
+class PaymentEvent(models.Model):
+    """
+    Payment gateway notification, stored before it is processed.
+
+    event_id is the gateway's id and is unique, so a redelivered event is
+    recorded only once. Events of one order are applied in gateway order.
+    """
+    STATE = (
+        ("received", "Received"),
+        ("applied", "Applied"),
+        ("skipped", "Skipped"),
+        ("failed", "Failed"),
+    )
+
+    event_id = models.CharField(max_length=255, unique=True)
+    order_oid = models.CharField(max_length=25)
+    payment_status = models.CharField(
+        max_length=100, choices=CartOrder.PAYMENT_STATUS)
+    payload = models.JSONField(default=dict, blank=True)
+    created = models.DateTimeField(help_text="Event time at the gateway")
+    received = models.DateTimeField(auto_now_add=True)
+    state = models.CharField(max_length=20, choices=STATE, default="received")
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=1000, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["order_oid", "state", "created"])]
+
+    def __str__(self):
+        return self.event_id
+
+
 class ProductFAQ(models.Model):
     """Model representing frequently asked questions about a product."""
     user = models.ForeignKey(
@@ -337,11 +814,37 @@ class Review(models.Model):
         return Profile.objects.get(user=self.user)
 
 
+def refresh_ratings(product_ids):
+    """
+    Store the average review rating of the given products, writing only
+    the ratings that changed.
+    """
+    rating = Product._meta.get_field("rating")
+    for ids in chunked(product_ids):
+        averages = dict(
+            Review.objects.filter(product_id__in=ids)
+            .values("product_id")
+            .annotate(average=models.Avg("rating"))
+            .values_list("product_id", "average")
+        )
+        changed = []
+        for product in Product.objects.filter(id__in=ids).only("id", "rating"):
+            # Stored the way Product.save() stores it
+            average = rating.get_prep_value(averages.get(product.id))
+            if product.rating != average:
+                product.rating = average
+                changed.append(product)
+        Product.objects.bulk_update(changed, ["rating"])
+
+
 @receiver(post_save, sender=Review)
 def update_product_rating(sender, instance, **kwargs):
-    """Update product rating after saving a review."""
-    if instance.product:
-        instance.product.save()
+    """
+    Update the product rating after saving a review, once per product
+    when the transaction commits.
+    """
+    if instance.product_id:
+        defer(refresh_ratings, instance.product_id)
 
 
 class Favorite(models.Model):
@@ -355,15 +858,42 @@ class Favorite(models.Model):
         return self.product.title
 
 
+class CouponQuerySet(models.QuerySet):
+    # Fields of the cached code lookups of store/coupons.py
+    CACHED_FIELDS = {"active", "brand", "brand_id", "coupon_code", "discount"}
+
+    def update(self, **kwargs):
+        """
+        As QuerySet.update(), also dropping the cached lookups of the codes
+        whose coupons change. Updates of other fields (uses) skip this.
+        """
+        if not self.CACHED_FIELDS & set(kwargs):
+            return super().update(**kwargs)
+        from store.coupons import forget_codes
+
+        codes = set(self.values_list("coupon_code", flat=True))
+        if "coupon_code" in kwargs:
+            codes.add(kwargs["coupon_code"])
+        updated = super().update(**kwargs)
+        forget_codes(codes)
+        return updated
+
+
 class Coupon(models.Model):
     """Model representing a coupon for discounts."""
     brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True)
     used_by = models.ManyToManyField(User, blank=True)
-    coupon_code = models.CharField(max_length=1000)
+    coupon_code = models.CharField(max_length=1000, db_index=True)
     discount = models.IntegerField(default=1)
+    max_uses = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Leave empty for unlimited uses"
+    )
+    uses = models.PositiveIntegerField(default=0)
     active = models.BooleanField(default=True)
     date = models.DateTimeField(auto_now_add=True)
 
+    objects = CouponQuerySet.as_manager()
+
     def __str__(self):
         return self.coupon_code
 
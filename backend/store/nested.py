@@ -0,0 +1,259 @@
+"""
+Parsing and diff-based saving of a product's nested rows.
+
+Product forms are multipart, so nested rows arrive as flat keys such as
+specifications[0][title] or gallery[2][image]. parse_nested() groups
+them into ordered lists of dicts in a single pass over the form. A
+gallery item may name a finished chunked upload (gallery[2][upload], see
+store/uploads.py) instead of carrying the file.
+
+save_nested() then matches the items against the product's stored rows
+(none yet for a new product), by id when the item carries one and
+otherwise by a natural key (title, name or image). Only what differs is
+written:
+
+- matched rows whose fields changed: one bulk_update
+- items without a match: one bulk_create
+- stored rows no longer sent: one delete, plus removal of the gallery
+  files (and their resized copies) nothing else points to once the
+  transaction commits
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from store.images import delete_variants, queue_variants
+from store.models import Picture
+from store.uploads import claim_upload
+from store.serializer import (
+    ColorSerializer,
+    PictureSerializer,
+    SizeSerializer,
+    SpecificationSerializer,
+)
+
+# Fields each nested collection accepts, and the one an item must have
+NESTED_FIELDS = {
+    "specifications": ("id", "title", "content"),
+    "colors": ("id", "name", "color_code"),
+    "sizes": ("id", "name", "price"),
+    "gallery": ("id", "image", "upload"),
+}
+REQUIRED_FIELD = {
+    "specifications": "title",
+    "colors": "name",
+    "sizes": "name",
+    "gallery": "image",
+}
+
+
+def parse_nested(data):
+    """
+    Collect the nested collections of a product form in one pass.
+
+    Returns {collection: [item, ...]} with items ordered by their index;
+    indices need not start at 0 or follow each other. Raises
+    ValidationError for malformed keys, bracketed keys of unknown
+    collections, unknown fields and items without their required field
+    (a gallery item may give an id or an upload instead of an image).
+    """
+    found = {name: defaultdict(dict) for name in NESTED_FIELDS}
+    errors = defaultdict(list)
+    # MultiValueDict.items() looks every key up again; lists() does not
+    pairs = data.lists() if hasattr(data, "lists") else (
+        (key, [value]) for key, value in data.items())
+    for key, values in pairs:
+        collection, _, rest = key.partition("[")
+        items = found.get(collection)
+        if items is None:
+            # Product fields are plain keys
+            if rest:
+                errors["nested"].append(f"Unknown collection {key}")
+            continue
+        # rest is "<index>][<field>]"
+        index, _, field = rest.partition("][")
+        if not (index.isdigit() and field.endswith("]")):
+            errors[collection].append(f"Malformed key {key}")
+            continue
+        field = field[:-1]
+        if field not in NESTED_FIELDS[collection]:
+            errors[collection].append(f"Unknown field {key}")
+            continue
+        items[int(index)][field] = values[-1]
+
+    parsed = {}
+    for collection, items in found.items():
+        required = REQUIRED_FIELD[collection]
+        parsed[collection] = []
+        for index in sorted(items):
+            item = items[index]
+            if not item.get(required) and not (
+                collection == "gallery"
+                and (item.get("id") or item.get("upload"))
+            ):
+                errors[collection].append(
+                    f"{collection}[{index}][{required}] is required")
+            parsed[collection].append(item)
+    if errors:
+        raise ValidationError(dict(errors))
+    return parsed
+
+
+def _match(item, existing, by_key, key_value, kept):
+    """
+    Find the stored row for an incoming item, by id first and then by
+    natural key. A row is matched at most once.
+    """
+    item_id = str(item.get("id") or "")
+    row = existing.get(int(item_id)) if item_id.isdigit() else None
+    if row is None and key_value is not None:
+        row = by_key.get(key_value)
+    if row is None or row.id in kept:
+        return None
+    return row
+
+
+def sync_rows(product, serializer_class, items, key, fields):
+    """
+    Reconcile the product's rows of the serializer's model with `items`.
+    `key` is the natural key field and `fields` the fields an item may
+    change. Returns the number of rows created, updated and deleted.
+    """
+    model = serializer_class.Meta.model
+    serializer = serializer_class(
+        data=[{field: item.get(field) for field in fields} for item in items],
+        many=True,
+    )
+    serializer.is_valid(raise_exception=True)
+
+    existing = {row.id: row for row in model.objects.filter(product=product)}
+    by_key = {getattr(row, key): row for row in existing.values()}
+    kept, changed, created = set(), [], []
+    for item, values in zip(items, serializer.validated_data):
+        row = _match(item, existing, by_key, values.get(key), kept)
+        if row is None:
+            created.append(model(product=product, **values))
+            continue
+        kept.add(row.id)
+        dirty = False
+        for field in fields:
+            if field in values and getattr(row, field) != values[field]:
+                setattr(row, field, values[field])
+                dirty = True
+        if dirty:
+            changed.append(row)
+
+    removed = [row_id for row_id in existing if row_id not in kept]
+    if changed:
+        model.objects.bulk_update(changed, fields)
+    if created:
+        model.objects.bulk_create(created)
+    if removed:
+        model.objects.filter(id__in=removed).delete()
+    return len(created), len(changed), len(removed)
+
+
+def stored_name(reference):
+    """
+    Turn an image reference sent back by a client (a storage name or a
+    media URL) into a storage name.
+    """
+    reference = str(reference)
+    if settings.MEDIA_URL in reference:
+        reference = reference.split(settings.MEDIA_URL, 1)[1]
+    return reference.lstrip("/")
+
+
+def _discard_files(names):
+    """
+    Delete stored gallery files no picture refers to any more, once the
+    surrounding transaction has committed.
+    """
+    names = {name for name in names if name}
+    if not names:
+        return
+
+    def discard():
+        in_use = set(
+            Picture.objects.filter(image__in=names)
+            .values_list("image", flat=True)
+        )
+        storage = Picture._meta.get_field("image").storage
+        for name in names - in_use:
+            storage.delete(name)
+            # A shared blob outlives one of its references
+            if not storage.exists(name):
+                delete_variants(name)
+
+    transaction.on_commit(discard)
+
+
+def sync_pictures(product, items):
+    """
+    Reconcile the product's gallery with `items`. An item is either a new
+    upload (a file or a chunked upload token) or a reference (id and/or
+    image name or URL) to a stored picture; an upload carrying a stored
+    picture's id replaces its file.
+    Returns the number of pictures created, updated and deleted.
+    """
+    existing = {row.id: row for row in Picture.objects.filter(product=product)}
+    by_name = {row.image.name: row for row in existing.values()}
+    kept, uploads, replaced, orphaned = set(), [], [], []
+    for item in items:
+        image = item.get("image")
+        if item.get("upload"):
+            image = claim_upload(item["upload"], "gallery")
+        if isinstance(image, UploadedFile):
+            row = _match(item, existing, by_name, None, kept)
+            if row is None:
+                uploads.append({"image": image})
+                continue
+            kept.add(row.id)
+            orphaned.append(row.image.name)
+            row.image = image
+            replaced.append(row)
+            continue
+
+        name = stored_name(image) if image else None
+        row = _match(item, existing, by_name, name, kept)
+        if row is None:
+            raise ValidationError(
+                {"gallery": f"Unknown picture {item.get('id') or image}"})
+        kept.add(row.id)
+
+    created = []
+    if uploads:
+        serializer = PictureSerializer(data=uploads, many=True)
+        serializer.is_valid(raise_exception=True)
+        created = Picture.objects.bulk_create(
+            [Picture(product=product, **values)
+             for values in serializer.validated_data]
+        )
+        # bulk_create skips the post_save handler that queues variants
+        queue_variants([picture.image.name for picture in created])
+    # New files have to be written to storage, which bulk_update skips
+    for row in replaced:
+        row.save(update_fields=["image"])
+
+    removed = [row for row_id, row in existing.items() if row_id not in kept]
+    if removed:
+        Picture.objects.filter(id__in=[row.id for row in removed]).delete()
+    _discard_files(orphaned + [row.image.name for row in removed])
+    return len(created), len(replaced), len(removed)
+
+
+def save_nested(product, nested):
+    """
+    Save the collections returned by parse_nested() for a product.
+    """
+    sync_rows(product, SpecificationSerializer, nested["specifications"],
+              "title", ["title", "content"])
+    sync_rows(product, ColorSerializer, nested["colors"],
+              "name", ["name", "color_code"])
+    sync_rows(product, SizeSerializer, nested["sizes"],
+              "name", ["name", "price"])
+    sync_pictures(product, nested["gallery"])
@@ -0,0 +1,200 @@
+"""
+Payment webhook processing.
+
+The webhook view only records the event (deduplicated on the gateway's
+event id) and hands the order oid to the dispatcher. The dispatcher owns
+a fixed set of worker threads and always sends the same oid to the same
+worker, so events of one order are applied one at a time and in the
+gateway's order, while different orders are processed in parallel.
+
+That ordering only holds within one process: every web worker starts
+its own dispatcher, so two workers receiving events of the same order
+may apply them concurrently. apply_event still claims each event and
+locks the order row, so an event is never applied twice and every
+transition is checked against the order's current status, but a late
+event may then be skipped instead of applied after an earlier one.
+
+Events are durable: anything left in the "received" state (for example
+after a restart) is picked up again by process_payment_events.
+"""
+
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from store.models import CartOrder, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+# Payment status changes a gateway event may make
+TRANSITIONS = {
+    "pending": {"processing", "paid", "cancelled"},
+    "processing": {"paid", "cancelled"},
+    "paid": {"cancelled"},
+    "cancelled": set(),
+}
+
+
+def sign(body, secret):
+    """
+    Return the X-Riz-Signature of a webhook body.
+    """
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature):
+    """
+    Check the HMAC-SHA256 signature of a webhook body. Never passes when
+    no PAYMENT_WEBHOOK_SECRET is configured.
+    """
+    secret = getattr(settings, "PAYMENT_WEBHOOK_SECRET", None)
+    if not secret:
+        logger.error("Payment webhook refused: no PAYMENT_WEBHOOK_SECRET")
+        return False
+    return hmac.compare_digest(sign(body, secret), signature or "")
+
+
+def event_time(value):
+    """
+    Turn a gateway timestamp (unix seconds) into an aware datetime.
+    Raises ValueError for a timestamp out of range.
+    """
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (OverflowError, OSError):
+        raise ValueError(f"Timestamp out of range: {value}")
+
+
+def record_event(event, payload):
+    """
+    Store a webhook event, validated by PaymentWebhookSerializer, with
+    its raw payload. Returns (event, created); created is False for an
+    event id that was already recorded.
+    """
+    try:
+        with transaction.atomic():
+            stored = PaymentEvent.objects.create(
+                event_id=event["id"],
+                order_oid=event["order_oid"],
+                payment_status=event["status"],
+                payload=payload,
+                created=event["created"],
+            )
+    except IntegrityError:
+        return PaymentEvent.objects.get(event_id=event["id"]), False
+    return stored, True
+
+
+def apply_event(event):
+    """
+    Apply one event to its order. Returns the new state of the event.
+    """
+    with transaction.atomic():
+        # Claim the event so a second process cannot apply it again
+        claimed = PaymentEvent.objects.filter(
+            id=event.id, state="received"
+        ).update(state="applied", processed_at=timezone.now())
+        if not claimed:
+            return None
+
+        order = (
+            CartOrder.objects.select_for_update()
+            .filter(oid=event.order_oid)
+            .first()
+        )
+        if order is None:
+            state, error = "failed", "Order does not exist"
+        elif event.payment_status == order.payment_status:
+            state, error = "skipped", "Order already has this status"
+        elif event.payment_status not in TRANSITIONS.get(
+            order.payment_status, ()
+        ):
+            state, error = "skipped", (
+                f"{order.payment_status} -> {event.payment_status} "
+                "is not allowed"
+            )
+        else:
+            order.payment_status = event.payment_status
+            # post_save keeps the brand sub-orders in step
+            order.save(update_fields=["payment_status"])
+            state, error = "applied", None
+
+        if state != "applied":
+            PaymentEvent.objects.filter(id=event.id).update(
+                state=state, error=error)
+    return state
+
+
+def process_order_events(order_oid):
+    """
+    Apply every received event of an order in gateway order.
+    """
+    events = PaymentEvent.objects.filter(
+        order_oid=order_oid, state="received"
+    ).order_by("created", "id")
+    for event in events:
+        try:
+            apply_event(event)
+        except Exception:
+            logger.exception("Payment event %s failed", event.event_id)
+            PaymentEvent.objects.filter(id=event.id).update(
+                state="failed", error="Unexpected error")
+
+
+class EventDispatcher:
+    """
+    Routes order oids to worker threads, one queue per worker.
+    """
+
+    def __init__(self, workers):
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.threads = []
+        for index, work in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._run, args=(work,),
+                name=f"payment-events-{index}", daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, order_oid):
+        index = zlib.crc32(order_oid.encode()) % len(self.queues)
+        self.queues[index].put(order_oid)
+
+    def join(self):
+        """Block until every submitted order has been processed."""
+        for work in self.queues:
+            work.join()
+
+    def _run(self, work):
+        while True:
+            order_oid = work.get()
+            try:
+                process_order_events(order_oid)
+            finally:
+                close_old_connections()
+                work.task_done()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Return the process-wide dispatcher, starting it on first use.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EventDispatcher(
+                getattr(settings, "PAYMENT_EVENT_WORKERS", 4))
+    return _dispatcher
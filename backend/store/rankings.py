@@ -0,0 +1,151 @@
+"""
+Best seller rankings.
+
+collect_sales() folds order lines into ProductSales, starting after the
+line id stored in the "product_sales" watermark, so each run only reads
+the lines created since the previous one. Lines that were not paid yet
+when they were collected are counted by the CartOrder post_save handler
+once their order is paid.
+
+Ids are handed out when a line is inserted, not when its transaction
+commits, so a line can appear after lines with higher ids were already
+collected and the watermark moved past it. The collector stays
+RANKING_COMMIT_LAG behind: it stops at the first line created since,
+leaving it and everything after to a later run. A line whose
+transaction stays open longer than that is still missed.
+
+rank_products() then ranks the per-day totals over each window of
+RANKING_WINDOWS days into ProductRanking, which the ranking endpoints
+read with a single indexed query.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from itertools import takewhile
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from store.models import (
+    CartOrderProduct,
+    ProductRanking,
+    ProductSales,
+    Watermark,
+)
+
+
+def collect_batch(batch_size):
+    """
+    Collect at most `batch_size` order lines past the watermark, up to
+    the first one created less than RANKING_COMMIT_LAG ago. Returns the
+    number of lines read.
+    """
+    cutoff = timezone.now() - getattr(
+        settings, "RANKING_COMMIT_LAG", timedelta(minutes=5))
+    with transaction.atomic():
+        watermark = Watermark.lock(ProductSales.WATERMARK)
+        lines = (
+            CartOrderProduct.objects.filter(id__gt=watermark.position)
+            .order_by("id")
+            .values_list("id", "date")[:batch_size]
+        )
+        ids = [line_id for line_id, _ in takewhile(
+            lambda line: line[1] <= cutoff, lines)]
+        if not ids:
+            return 0
+
+        rows = (
+            CartOrderProduct.objects.filter(
+                id__gt=watermark.position,
+                id__lte=ids[-1],
+                order__payment_status="paid",
+            )
+            .annotate(day=TruncDate("date"))
+            .values("product_id", "day")
+            .annotate(units=models.Sum("qty"),
+                      revenue=models.Sum("sub_total"))
+        )
+        ProductSales.add(
+            {
+                (row["product_id"], row["day"]): (row["units"],
+                                                  row["revenue"])
+                for row in rows
+            }
+        )
+        watermark.position = ids[-1]
+        watermark.save(update_fields=["position", "updated"])
+    return len(ids)
+
+
+def collect_sales(batch_size=10_000):
+    """
+    Collect every order line past the watermark in bounded batches.
+    Yields the size of each batch.
+    """
+    while True:
+        collected = collect_batch(batch_size)
+        if not collected:
+            return
+        yield collected
+
+
+def _ranked(totals, metric, size):
+    other = "revenue" if metric == "units" else "units"
+    return sorted(
+        totals,
+        key=lambda row: (-row[metric], -row[other], row["product_id"]),
+    )[:size]
+
+
+def rank_products(windows=None, size=None):
+    """
+    Rebuild ProductRanking for every window, scope and metric. Returns
+    the number of ranking rows written.
+    """
+    windows = windows or settings.RANKING_WINDOWS
+    size = size or settings.RANKING_SIZE
+    today = timezone.localdate()
+    now = timezone.now()
+
+    rankings = []
+    for window in windows:
+        totals = list(
+            ProductSales.objects.filter(
+                day__gt=today - timedelta(days=window),
+                product__status="published",
+            )
+            .values("product_id", "product__brand_id",
+                    "product__category_id")
+            .annotate(units=models.Sum("units"),
+                      revenue=models.Sum("revenue"))
+        )
+        scopes = defaultdict(list)
+        for row in totals:
+            scopes[("global", None)].append(row)
+            scopes[("brand", row["product__brand_id"])].append(row)
+            if row["product__category_id"] is not None:
+                scopes[("category", row["product__category_id"])].append(row)
+
+        for (scope, scope_id), rows in scopes.items():
+            for metric, _ in ProductRanking.METRICS:
+                for rank, row in enumerate(_ranked(rows, metric, size), 1):
+                    rankings.append(
+                        ProductRanking(
+                            scope=scope,
+                            scope_id=scope_id,
+                            window=window,
+                            metric=metric,
+                            rank=rank,
+                            product_id=row["product_id"],
+                            units=row["units"],
+                            revenue=row["revenue"],
+                            computed=now,
+                        )
+                    )
+
+    with transaction.atomic():
+        ProductRanking.objects.all().delete()
+        ProductRanking.objects.bulk_create(rankings, batch_size=1000)
+    return len(rankings)
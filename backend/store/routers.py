@@ -0,0 +1,26 @@
+from store.snapshots import REPORTING_ALIAS, REPORTING_MODELS, current_source
+
+
+class ReportingRouter:
+    """
+    Send the order table reads of reporting views (see store.snapshots)
+    to the database they picked. Writes always go to the default
+    database and nothing is migrated on the reporting copy.
+    """
+
+    def db_for_read(self, model, **hints):
+        source = current_source()
+        if source is not None and model._meta.label_lower in REPORTING_MODELS:
+            return source["alias"]
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPORTING_ALIAS:
+            return False
+        return None
@@ -9,12 +9,17 @@ from store.models import (
     Cart,
     CartOrder,
     CartOrderProduct,
+    ArchivedCartOrder,
+    ArchivedCartOrderProduct,
     ProductFAQ,
     Review,
     Favorite,
     Coupon,
+    ProductRanking,
 )
 from brand.models import Brand
+from store.images import ImageVariantsField
+from store.payments import event_time
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -22,6 +27,8 @@ class CategorySerializer(serializers.ModelSerializer):
     Serializer for the Category model.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Category
         fields = "__all__"
@@ -32,6 +39,8 @@ class PictureSerializer(serializers.ModelSerializer):
     Serializer for the Picture model.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Picture
         fields = "__all__"
@@ -62,6 +71,8 @@ class ColorSerializer(serializers.ModelSerializer):
     Serializer for the Color model.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Color
         fields = "__all__"
@@ -86,6 +97,7 @@ class ProductSerializer(serializers.ModelSerializer):
     color = ColorSerializer(many=True, read_only=True)
     specification = SpecificationSerializer(many=True, read_only=True)
     size = SizeSerializer(many=True, read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Product
@@ -93,6 +105,7 @@ class ProductSerializer(serializers.ModelSerializer):
             "id",
             "title",
             "image",
+            "image_variants",
             "description",
             "category",
             "price",
@@ -184,6 +197,33 @@ class CartOrderSerializer(serializers.ModelSerializer):
             self.Meta.depth = 3
 
 
+class ArchivedCartOrderProductSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the ArchivedCartOrderProduct model.
+    """
+
+    class Meta:
+        model = ArchivedCartOrderProduct
+        fields = "__all__"
+        depth = 3
+
+
+class ArchivedCartOrderSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the ArchivedCartOrder model.
+
+    Archived orders are read-only, so the nested depth is fixed.
+    """
+
+    get_order_items = ArchivedCartOrderProductSerializer(
+        many=True, read_only=True)
+
+    class Meta:
+        model = ArchivedCartOrder
+        fields = "__all__"
+        depth = 3
+
+
 class ProductFAQSerializer(serializers.ModelSerializer):
     """
     Serializer for the ProductFAQ model.
@@ -207,6 +247,8 @@ class BrandSerializer(serializers.ModelSerializer):
     Serializer for the Brand model.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Brand
         fields = "__all__"
@@ -274,6 +316,44 @@ class CouponSerializer(serializers.ModelSerializer):
             self.Meta.depth = 3
 
 
+class CouponApplySerializer(serializers.Serializer):
+    """
+    Serializer for applying a coupon to an order.
+    """
+
+    order_oid = serializers.CharField(max_length=25)
+    coupon_code = serializers.CharField(max_length=1000)
+
+
+class PaymentWebhookSerializer(serializers.Serializer):
+    """
+    Serializer validating a payment gateway event.
+    """
+
+    id = serializers.CharField(max_length=255)
+    order_oid = serializers.CharField(max_length=25)
+    status = serializers.ChoiceField(choices=CartOrder.PAYMENT_STATUS)
+    created = serializers.FloatField(help_text="Event time (unix seconds)")
+
+    def validate_created(self, value):
+        try:
+            return event_time(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+
+class ProductRankingSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the ProductRanking model.
+    """
+
+    class Meta:
+        model = ProductRanking
+        fields = ["rank", "units", "revenue", "window", "metric", "computed",
+                  "product"]
+        depth = 1
+
+
 class BrandStatsSerializer(serializers.Serializer):
     """
     Serializer for the BrandStats model.
@@ -0,0 +1,166 @@
+"""
+Read-only snapshots for reporting queries.
+
+Exports and analytics scan large parts of the order tables. On SQLite a
+long read holds the database's shared lock and stalls cart and order
+writes, so these views read from a copy instead:
+
+- refresh_snapshot() copies the default database into
+  REPORTING_SNAPSHOT_PATH with the SQLite online backup API, then swaps
+  the copy into place. Open readers keep the file they started with.
+- views wrapped in reporting_view() send their reads of the order
+  tables (REPORTING_MODELS) to the "reporting" alias through
+  store.routers.ReportingRouter, as long as the snapshot is younger than
+  REPORTING_MAX_STALENESS seconds; otherwise they read the live
+  database. Everything else they read, such as the user, the session or
+  the brand, always comes from the live database.
+- every wrapped response says where its data came from in the
+  X-Data-Source header (snapshot, replica or live) and, when known, how
+  old it is in X-Data-As-Of and X-Data-Age.
+
+On other engines point the "reporting" alias at a read replica and set
+REPORTING_SNAPSHOT_PATH to None; the replica's lag is not known here.
+"""
+
+import functools
+import os
+import sqlite3
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+REPORTING_ALIAS = "reporting"
+
+# Models whose queries reporting views send to the reporting alias
+REPORTING_MODELS = frozenset({
+    "store.cartorder",
+    "store.cartorderproduct",
+    "store.archivedcartorder",
+    "store.archivedcartorderproduct",
+})
+
+# Where the reads of the current reporting view go: {"alias", "as_of"}
+reporting_source = ContextVar("reporting_source", default=None)
+
+
+def snapshot_taken():
+    """
+    Return when the current snapshot was taken (a UTC datetime), or None
+    when there is no snapshot.
+    """
+    path = getattr(settings, "REPORTING_SNAPSHOT_PATH", None)
+    try:
+        taken = os.path.getmtime(path)
+    except (TypeError, OSError):
+        return None
+    return datetime.fromtimestamp(taken, tz=dt_timezone.utc)
+
+
+def refresh_snapshot(pages=4096):
+    """
+    Copy the default database into a new snapshot. Returns the time it
+    took in seconds.
+
+    The backup copies `pages` pages per step and lets writers in between
+    steps; SQLite restarts it if the source changes mid-copy, so the
+    result is always consistent.
+    """
+    source_settings = connections["default"].settings_dict
+    if source_settings["ENGINE"] != "django.db.backends.sqlite3":
+        raise ValueError(
+            "Snapshots need SQLite; use a replica for the reporting alias")
+    path = str(settings.REPORTING_SNAPSHOT_PATH)
+    partial = f"{path}.partial"
+
+    started = time.time()
+    source = sqlite3.connect(str(source_settings["NAME"]))
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+
+    # The file's modification time records when the copy started
+    os.utime(partial, (started, started))
+    os.replace(partial, path)
+    return time.time() - started
+
+
+def choose_source():
+    """
+    Pick where a reporting request reads from. Returns the alias and the
+    time its data is from (None when unknown).
+    """
+    if REPORTING_ALIAS not in settings.DATABASES:
+        return "default", timezone.now()
+    if getattr(settings, "REPORTING_SNAPSHOT_PATH", None) is None:
+        return REPORTING_ALIAS, None
+
+    taken = snapshot_taken()
+    if taken is None:
+        return "default", timezone.now()
+    age = (timezone.now() - taken).total_seconds()
+    if age > settings.REPORTING_MAX_STALENESS:
+        return "default", timezone.now()
+    return REPORTING_ALIAS, taken
+
+
+def _report(response, alias, as_of):
+    if alias == "default":
+        response["X-Data-Source"] = "live"
+    elif as_of is None:
+        response["X-Data-Source"] = "replica"
+    else:
+        response["X-Data-Source"] = "snapshot"
+    if as_of is not None:
+        response["X-Data-As-Of"] = as_of.isoformat()
+        response["X-Data-Age"] = str(
+            int((timezone.now() - as_of).total_seconds()))
+    return response
+
+
+def _streamed(content, source):
+    # Streaming bodies run their queries after the view has returned
+    token = reporting_source.set(source)
+    try:
+        yield from content
+    finally:
+        reporting_source.reset(token)
+
+
+def current_source():
+    """
+    Return the {"alias", "as_of"} dict of the running reporting view, or
+    None outside one. A view serving cached data replaces "as_of" with
+    the time of that data.
+    """
+    return reporting_source.get()
+
+
+def reporting_view(view):
+    """
+    Run a view's reads against the reporting database and report the
+    data's age in the response headers.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias, as_of = choose_source()
+        source = {"alias": alias, "as_of": as_of}
+        token = reporting_source.set(source)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            reporting_source.reset(token)
+        if isinstance(response, StreamingHttpResponse):
+            response.streaming_content = _streamed(
+                response.streaming_content, source)
+        return _report(response, source["alias"], source["as_of"])
+
+    return wrapper
@@ -0,0 +1,210 @@
+"""
+Content-addressed storage for uploads.
+
+Brands upload the same photos again and again: as the product image, as a
+gallery picture, as a color image and on every product edit. This
+storage names each upload after the SHA-256 of its content,
+
+    product/IMG_0412.jpg -> cas/3f/a2/3fa2...c9.jpg
+
+so identical uploads share one file. Every blob has a MediaBlob row
+counting the file fields saved with it; delete() drops one reference and
+removes the file with the last one. Rows removed without a storage delete
+(cascades, bulk deletes) leave a count too high, never too low;
+collect_blobs() recounts the references from the database and removes
+blobs nothing points to.
+
+A blob's content never changes, so serve_media() lets clients cache blob
+responses for a year. Names outside the prefix (files stored before this
+backend, defaults like product.jpg) behave as in FileSystemStorage.
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.views.static import serve
+
+PREFIX = "cas"
+BLOB_NAME = re.compile(
+    rf"^{PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.\w+)?$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def is_blob(name):
+    """Return whether a storage name is a content-addressed blob."""
+    return bool(name and BLOB_NAME.match(name))
+
+
+def content_digest(content):
+    """
+    Return the SHA-256 hex digest and size of a File's content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that stores each distinct upload once, under a name
+    derived from its content, and counts the references to it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name of an upload is only known once its content is hashed
+        # in _save(); only a blob being written concurrently needs another
+        if is_blob(name):
+            return super().get_available_name(name, max_length)
+        return name
+
+    def _save(self, name, content):
+        from store.models import MediaBlob
+
+        digest, size = content_digest(content)
+        extension = os.path.splitext(name)[1].lower()
+        blob = f"{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+        if not MediaBlob.objects.filter(name=blob).update(
+            refs=models.F("refs") + 1
+        ):
+            try:
+                with transaction.atomic():
+                    MediaBlob.objects.create(name=blob, size=size, refs=1)
+            except IntegrityError:
+                MediaBlob.objects.filter(name=blob).update(
+                    refs=models.F("refs") + 1)
+
+        if not self.exists(blob):
+            stored = super()._save(blob, content)
+            if stored != blob:
+                # The same content was written by another upload meanwhile
+                super().delete(stored)
+        return blob
+
+    def delete(self, name):
+        """
+        Drop one reference to a blob, removing the file with the last
+        one. Other names are deleted right away.
+        """
+        if not is_blob(name):
+            return super().delete(name)
+        from store.models import MediaBlob
+
+        with transaction.atomic():
+            MediaBlob.objects.filter(name=name).update(
+                refs=models.F("refs") - 1)
+            removed, _ = MediaBlob.objects.filter(
+                name=name, refs__lte=0).delete()
+        if removed:
+            super().delete(name)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve, marking blobs as immutable.
+    """
+    response = serve(request, path, document_root, show_indexes)
+    if is_blob(path):
+        response["Cache-Control"] = IMMUTABLE
+    return response
+
+
+def blob_references(storage):
+    """
+    Count the references to every blob of `storage` held by file fields.
+    """
+    counts = Counter()
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if not isinstance(field, models.FileField):
+                continue
+            if field.storage.__class__ is not storage.__class__:
+                continue
+            counts.update(
+                model._default_manager.filter(
+                    **{f"{field.attname}__startswith": f"{PREFIX}/"}
+                ).values_list(field.attname, flat=True)
+            )
+    return counts
+
+
+def collect_blobs(storage, grace=timedelta(hours=1), dry_run=False):
+    """
+    Recount blob references from the database, adopt blob files without a
+    row and delete blobs nothing has referred to for longer than `grace`.
+    Returns counts and sizes for reporting.
+    """
+    from store.images import delete_variants
+    from store.models import MediaBlob
+
+    counts = blob_references(storage)
+    blobs = {blob.name: blob for blob in MediaBlob.objects.all()}
+
+    # Files written by uploads whose transaction rolled back have no row
+    adopted = []
+    root = storage.path(PREFIX)
+    for directory, _, files in os.walk(root):
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, storage.location).replace(
+                os.sep, "/")
+            if is_blob(name) and name not in blobs:
+                stat = os.stat(path)
+                blobs[name] = MediaBlob(
+                    name=name, size=stat.st_size, refs=0,
+                    created=datetime.fromtimestamp(
+                        stat.st_mtime, tz=dt_timezone.utc),
+                )
+                adopted.append(blobs[name])
+
+    changed = []
+    for name, blob in blobs.items():
+        if blob.refs != counts[name]:
+            changed.append((blob, blob.refs))
+            blob.refs = counts[name]
+
+    cutoff = timezone.now() - grace
+    unused = [
+        blob for blob in blobs.values()
+        if blob.refs <= 0 and blob.created < cutoff
+    ]
+    stats = {
+        "blobs": len(blobs),
+        "references": sum(counts[name] for name in blobs),
+        "stored_bytes": sum(blob.size for blob in blobs.values()),
+        "saved_bytes": sum(
+            blob.size * (blob.refs - 1)
+            for blob in blobs.values() if blob.refs > 1
+        ),
+        "recounted": len(changed),
+        "adopted": len(adopted),
+        "deleted": len(unused),
+        "deleted_bytes": sum(blob.size for blob in unused),
+    }
+    if dry_run:
+        return stats
+
+    MediaBlob.objects.bulk_create(adopted, ignore_conflicts=True)
+    for blob, counted in changed:
+        # Leave counts that uploads or deletes changed since they were read
+        MediaBlob.objects.filter(name=blob.name, refs=counted).update(
+            refs=blob.refs)
+    for blob in unused:
+        # An upload may have referred to the blob again since the recount
+        removed, _ = MediaBlob.objects.filter(
+            name=blob.name, refs__lte=0).delete()
+        if removed:
+            FileSystemStorage.delete(storage, blob.name)
+            delete_variants(blob.name)
+    return stats
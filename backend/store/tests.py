@@ -1,3 +1,1026 @@
-from django.test import TestCase
+import fcntl
+import io
+import json
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import QueryDict
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings)
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from brand.models import Brand
+from store.analytics import brand_analytics
+from store.archive import archive_batch
+from store.catalog import CatalogImport
+from store.coupons import CouponBusy, apply_coupon, lookup_coupons
+from store.deferred import defer
+from store.ids import SnowflakeGenerator, check_worker_ids
+from store.images import generate_variants
+from store.models import (
+    ArchivedCartOrder, ArchivedCartOrderProduct, BrandDailyStats, BrandOrder, BrandStats,
+    CartOrder, CartOrderProduct, Category, Coupon, MediaBlob, PaymentEvent,
+    Picture, Product, ProductSales, Review, Watermark)
+from store.nested import parse_nested
+from store.payments import sign
+from store.rankings import collect_sales
+from store.routers import ReportingRouter
+from store.serializer import CategorySerializer
+from store.snapshots import reporting_source
+from store.storage import collect_blobs
+from store.throttling import LocalBuckets
+from store.uploads import upload_path
+from userauths.models import User
+
+
+def create_order(buyer, brand, product, sub_total="100.00", **kwargs):
+    """
+    An order of one line of `product`, with 10.00 shipping on top, and
+    its brand sub-order.
+    """
+    sub_total = Decimal(sub_total)
+    total = sub_total + 10
+    order = CartOrder.objects.create(
+        buyer=buyer, sub_total=sub_total, shipping_amount=10, total=total,
+        **kwargs)
+    CartOrderProduct.objects.create(
+        order=order, brand=brand, product=product, qty=1, price=sub_total,
+        sub_total=sub_total, shipping_amount=10, total=total)
+    BrandOrder.objects.create(
+        brand=brand, order=order, oid=order.oid, date=order.date,
+        sub_total=sub_total, shipping_amount=10, total=total, units=1,
+        payment_status=order.payment_status)
+    return order
+
+
+class CouponMixin:
+    def create_catalog(self):
+        # Coupon lookups are cached by code
+        cache.clear()
+        self.brand = Brand.objects.create(name="Coupons", slug="coupons")
+        self.product = Product.objects.create(
+            title="Coupon product", brand=self.brand, slug="coupon-product")
+        self.coupon = Coupon.objects.create(
+            brand=self.brand, coupon_code="TEN", discount=10)
+
+    def create_buyer(self, name):
+        return User.objects.create(
+            email=f"{name}@example.com", username=name)
+
+
+class BrandStatsTests(CouponMixin, TestCase):
+    def setUp(self):
+        self.create_catalog()
+        self.buyer = self.create_buyer("buyer")
+
+    def stats(self):
+        totals = BrandStats.objects.filter(brand=self.brand).values(
+            "products", "orders", "income").first()
+        days = list(
+            # Days counted back to zero stay, rebuild() leaves them out
+            BrandDailyStats.objects.filter(brand=self.brand)
+            .exclude(orders=0, units=0, revenue=0, products=0)
+            .order_by("day")
+            .values_list("day", "orders", "units", "revenue", "products")
+        )
+        return totals, days
+
+    def assertMatchesRebuild(self):
+        """The running totals equal the ones recomputed from scratch."""
+        counted = self.stats()
+        BrandStats.rebuild(self.brand.id)
+        BrandDailyStats.rebuild(self.brand.id)
+        self.assertEqual(counted, self.stats())
+        return counted[0]
+
+    def pay(self, order, status):
+        order.payment_status = status
+        order.save()
+
+    def test_products_added_and_removed(self):
+        Product.objects.create(title="Second", brand=self.brand, slug="two")
+        self.assertEqual(self.assertMatchesRebuild()["products"], 2)
+        self.product.delete()
+        self.assertEqual(self.assertMatchesRebuild()["products"], 1)
+
+    def test_orders_in_and_out_of_paid(self):
+        order = create_order(self.buyer, self.brand, self.product)
+        for status, orders, income in (
+            ("paid", 1, 110),
+            ("paid", 1, 110),
+            ("cancelled", 0, 0),
+            ("paid", 1, 110),
+            ("processing", 0, 0),
+            ("pending", 0, 0),
+        ):
+            self.pay(order, status)
+            totals = self.assertMatchesRebuild()
+            self.assertEqual(
+                (totals["orders"], totals["income"]), (orders, income))
+
+    def test_coupon_applied_before_payment(self):
+        order = create_order(self.buyer, self.brand, self.product)
+        apply_coupon(order.oid, "TEN", self.buyer)
+        order.refresh_from_db()
+        self.pay(order, "paid")
+        totals = self.assertMatchesRebuild()
+        self.assertEqual(totals["income"], Decimal("100.00"))
+
+
+class WorkerIdTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(
+            ID_WORKER_IDS="4-5", ID_WORKER_LOCK_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_generators_claim_distinct_worker_ids(self):
+        first, second = SnowflakeGenerator(), SnowflakeGenerator()
+        first(), second()
+        self.assertEqual({first.worker_id, second.worker_id}, {4, 5})
+
+    def test_exhausted_range_refuses_ids(self):
+        generators = [SnowflakeGenerator(), SnowflakeGenerator()]
+        for generator in generators:
+            generator()
+        with self.assertRaises(ImproperlyConfigured):
+            SnowflakeGenerator()()
+
+    def test_check_requires_a_range(self):
+        with override_settings(ID_WORKER_IDS=None):
+            self.assertEqual(
+                [error.id for error in check_worker_ids(None)], ["store.E001"])
+        self.assertEqual(check_worker_ids(None), [])
+
+
+class CouponApplyTests(CouponMixin, APITestCase):
+    url = "/api/v1/coupon/apply/"
+
+    def setUp(self):
+        self.create_catalog()
+        self.buyer = self.create_buyer("buyer")
+        self.order = create_order(self.buyer, self.brand, self.product)
+
+    def apply(self, user, **data):
+        if user is not None:
+            self.client.force_authenticate(user)
+        data.setdefault("order_oid", self.order.oid)
+        data.setdefault("coupon_code", "TEN")
+        return self.client.post(self.url, data)
+
+    def test_requires_authentication(self):
+        response = self.apply(None)
+        self.assertEqual(response.status_code, 401)
+
+    def test_only_the_buyer_can_apply(self):
+        response = self.apply(self.create_buyer("stranger"))
+        self.assertEqual(response.status_code, 404)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.uses, 0)
+        self.assertFalse(self.coupon.used_by.exists())
+
+    def test_rejects_paid_orders(self):
+        CartOrder.objects.filter(pk=self.order.pk).update(
+            payment_status="paid")
+        response = self.apply(self.buyer)
+        self.assertEqual(response.status_code, 400)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.uses, 0)
+
+    def test_missing_fields_are_a_bad_request(self):
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post(self.url, {"order_oid": self.order.oid})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("coupon_code", response.json())
+
+    def test_discount_comes_off_the_sub_total(self):
+        response = self.apply(self.buyer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(str(response.json()["amount_saved"])), 10)
+        line = CartOrderProduct.objects.get(order=self.order)
+        self.assertEqual(line.sub_total, Decimal("90.00"))
+        self.assertEqual(line.total, Decimal("100.00"))
+        self.assertEqual(line.total - line.sub_total, line.shipping_amount)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.sub_total, Decimal("90.00"))
+        self.assertEqual(self.order.total, Decimal("100.00"))
+
+    def test_redeemed_once_per_user(self):
+        self.assertEqual(self.apply(self.buyer).status_code, 200)
+        other = create_order(self.buyer, self.brand, self.product)
+        response = self.apply(self.buyer, order_oid=other.oid)
+        self.assertEqual(response.status_code, 400)
+
+    def test_code_shared_by_brands_applies_to_the_order_brand(self):
+        brand = Brand.objects.create(name="Others", slug="others")
+        coupon = Coupon.objects.create(
+            brand=brand, coupon_code="TEN", discount=50)
+        product = Product.objects.create(
+            title="Other product", brand=brand, slug="other-product")
+        order = create_order(self.buyer, brand, product)
+        response = self.apply(self.buyer, order_oid=order.oid)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(str(response.json()["amount_saved"])), 50)
+        coupon.refresh_from_db()
+        self.coupon.refresh_from_db()
+        self.assertEqual((coupon.uses, self.coupon.uses), (1, 0))
+
+        unrelated = Product.objects.create(
+            title="Unrelated", slug="unrelated",
+            brand=Brand.objects.create(name="Third", slug="third"))
+        order = create_order(self.buyer, unrelated.brand, unrelated)
+        response = self.apply(self.buyer, order_oid=order.oid)
+        self.assertEqual(response.status_code, 400)
+
+    def test_queryset_updates_drop_the_cached_lookup(self):
+        self.assertEqual(lookup_coupons("TEN")[0]["discount"], 10)
+        Coupon.objects.filter(pk=self.coupon.pk).update(discount=20)
+        self.assertEqual(lookup_coupons("TEN")[0]["discount"], 20)
+        Coupon.objects.filter(pk=self.coupon.pk).update(active=False)
+        self.assertEqual(self.apply(self.buyer).status_code, 404)
+
+
+class CouponConcurrencyTests(CouponMixin, TransactionTestCase):
+    buyers = 8
+    max_uses = 3
+
+    def test_uses_never_exceed_max_uses(self):
+        self.create_catalog()
+        Coupon.objects.filter(pk=self.coupon.pk).update(
+            max_uses=self.max_uses)
+        orders = []
+        for index in range(self.buyers):
+            buyer = self.create_buyer(f"buyer{index}")
+            orders.append(
+                (buyer, create_order(buyer, self.brand, self.product)))
+        barrier = threading.Barrier(self.buyers)
+        outcomes = []
+
+        def redeem(buyer, order):
+            barrier.wait()
+            try:
+                # Retried as clients retry a 503
+                for _ in range(100):
+                    try:
+                        apply_coupon(order.oid, "TEN", buyer)
+                    except CouponBusy:
+                        time.sleep(0.01)
+                        continue
+                    except ValidationError:
+                        outcomes.append("unavailable")
+                    else:
+                        outcomes.append("applied")
+                    break
+                else:
+                    outcomes.append("busy")
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=redeem, args=pair) for pair in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), self.buyers)
+        self.coupon.refresh_from_db()
+        self.assertLessEqual(self.coupon.uses, self.max_uses)
+        self.assertEqual(self.coupon.uses, self.coupon.used_by.count())
+        self.assertEqual(self.coupon.uses, outcomes.count("applied"))
+        self.assertEqual(outcomes.count("applied"), self.max_uses)
+        discounted = CartOrder.objects.filter(amount_saved__gt=0).count()
+        self.assertEqual(discounted, outcomes.count("applied"))
+
+
+@override_settings(PAYMENT_WEBHOOK_SECRET="webhook-secret")
+class PaymentWebhookTests(APITestCase):
+    url = "/api/v1/payment/webhook/"
+    event = {
+        "id": "evt_1", "order_oid": "oid1", "status": "paid",
+        "created": 1700000000,
+    }
+
+    def post(self, event, signature=None):
+        body = json.dumps(event).encode()
+        if signature is None:
+            signature = sign(body, "webhook-secret")
+        return self.client.post(
+            self.url, body, content_type="application/json",
+            HTTP_X_RIZ_SIGNATURE=signature)
+
+    def test_signed_event_is_recorded(self):
+        response = self.post(self.event)
+        self.assertEqual(response.status_code, 200)
+        event = PaymentEvent.objects.get()
+        self.assertEqual(
+            (event.event_id, event.order_oid, event.payment_status),
+            ("evt_1", "oid1", "paid"))
+        self.assertEqual(event.created.timestamp(), 1700000000)
+        self.assertEqual(self.post(self.event).json()["message"],
+                         "Duplicate event")
+
+    def test_bad_signature_is_refused(self):
+        for signature in ("", sign(b"{}", "webhook-secret")):
+            response = self.post(self.event, signature)
+            self.assertEqual(response.status_code, 403)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_refused_without_a_secret(self):
+        with override_settings(PAYMENT_WEBHOOK_SECRET=None):
+            response = self.post(self.event, "")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_malformed_events_are_bad_requests(self):
+        malformed = [
+            {key: value for key, value in self.event.items() if key != "id"},
+            {**self.event, "status": "refunded-twice"},
+            {**self.event, "created": "yesterday"},
+            {**self.event, "created": 1e30},
+            ["not", "an", "object"],
+        ]
+        for event in malformed:
+            with self.subTest(event=event):
+                self.assertEqual(self.post(event).status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+
+@override_settings(
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_THROTTLE_RATES": {"cart": "2/minute"},
+        "NUM_PROXIES": 0,
+    },
+    THROTTLE_CACHE="default",
+)
+class ThrottlingTests(APITestCase):
+    url = "/api/v1/cart-view/"
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, address="10.0.0.1", **headers):
+        return self.client.get(self.url, REMOTE_ADDR=address, **headers)
+
+    def test_requests_over_the_rate_are_throttled(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get().status_code, 200)
+        response = self.get()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response["Retry-After"]), 30)
+        self.assertEqual(self.get("10.0.0.2").status_code, 200)
+
+    def test_forwarded_for_does_not_make_a_new_client(self):
+        codes = [
+            self.get(HTTP_X_FORWARDED_FOR=f"198.18.0.{index}").status_code
+            for index in range(4)
+        ]
+        self.assertEqual(codes, [200, 200, 429, 429])
+
+    def test_users_have_their_own_buckets(self):
+        self.get(), self.get()
+        self.client.force_authenticate(
+            User.objects.create(email="cart@example.com", username="cart"))
+        self.assertEqual(self.get().status_code, 200)
+
+    def test_local_buckets(self):
+        buckets = LocalBuckets(size=1)
+        self.assertEqual(buckets.take("a", 1, 1), 0)
+        self.assertGreater(buckets.take("a", 1, 1), 0)
+        # Dropped as the least recently used, so full again
+        self.assertEqual(buckets.take("b", 1, 1), 0)
+        self.assertEqual(buckets.take("a", 1, 1), 0)
+
+
+class DeferTests(TransactionTestCase):
+    def test_keys_are_collected_until_commit(self):
+        calls = []
+        with transaction.atomic():
+            defer(calls.append, 1)
+            defer(calls.append, 2)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [{1, 2}])
+
+    def test_rolled_back_keys_are_dropped(self):
+        calls = []
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                defer(calls.append, 1)
+                raise RuntimeError
+        with transaction.atomic():
+            defer(calls.append, 2)
+        self.assertEqual(calls, [{2}])
+
+    def test_runs_at_once_outside_a_transaction(self):
+        calls = []
+        defer(calls.append, 1)
+        self.assertEqual(calls, [{1}])
+
+
+@override_settings(IMAGE_VARIANTS={})
+class ReviewRatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name="Ratings", slug="ratings")
+        cls.products = [
+            Product.objects.create(
+                title=f"Rated {index}", brand=brand, slug=f"rated-{index}")
+            for index in range(2)
+        ]
+        cls.reviews = [
+            Review.objects.create(product=product, review="Fine", rating=3)
+            for product in cls.products
+            for _ in range(3)
+        ]
+        # The refresh deferred above never commits
+        Product.objects.update(rating=3)
+
+    def test_bulk_edits_refresh_each_product_once(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                for rating, review in zip((4, 5, 5, 1, 2, 2), self.reviews):
+                    review.rating = rating
+                    review.save()
+        self.assertEqual(len(callbacks), len(self.reviews))
+        # The averages, the products, and one update of both
+        with self.assertNumQueries(3):
+            for callback in callbacks:
+                callback()
+        for product in self.products:
+            product.refresh_from_db()
+            self.assertEqual(product.rating, int(product.product_rating()))
+        self.assertEqual([product.rating for product in self.products], [4, 1])
+
+    def test_unchanged_ratings_are_not_written(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                for review in self.reviews:
+                    review.save()
+        with self.assertNumQueries(2):
+            for callback in callbacks:
+                callback()
+
+
+class ChunkedUploadTests(APITestCase):
+    url = "/api/v1/uploads/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(
+            CHUNKED_UPLOAD_DIR=directory.name, CHUNKED_UPLOAD_MAX_OPEN=2)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create(
+            email="uploader@example.com", username="uploader")
+        self.client.force_authenticate(self.user)
+
+    def start(self, size=6):
+        response = self.client.post(
+            self.url, {"filename": "shoe.jpg", "size": size})
+        self.assertEqual(response.status_code, 201)
+        return response.json()["token"]
+
+    def put(self, token, chunk, offset):
+        return self.client.put(
+            f"{self.url}{token}/", chunk,
+            content_type="application/octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_requires_authentication(self):
+        token = self.start()
+        self.client.force_authenticate(None)
+        response = self.client.post(
+            self.url, {"filename": "shoe.jpg", "size": 6})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.put(token, b"abc", 0).status_code, 401)
+
+    def test_uploads_are_private(self):
+        token = self.start()
+        self.client.force_authenticate(
+            User.objects.create(email="other@example.com", username="other"))
+        self.assertEqual(self.client.get(f"{self.url}{token}/").status_code,
+                         404)
+        self.assertEqual(self.put(token, b"abc", 0).status_code, 404)
+
+    def test_open_uploads_are_capped(self):
+        self.start(), self.start()
+        response = self.client.post(
+            self.url, {"filename": "shoe.jpg", "size": 6})
+        self.assertEqual(response.status_code, 429)
+
+    def test_chunks_continue_the_upload(self):
+        token = self.start()
+        self.assertEqual(self.put(token, b"abc", 0).json()["received"], 3)
+        self.assertEqual(self.put(token, b"abc", 0).status_code, 409)
+        response = self.put(token, b"def", 3)
+        self.assertTrue(response.json()["complete"])
+        with open(upload_path(token), "rb") as file:
+            self.assertEqual(file.read(), b"abcdef")
+
+    def test_chunk_refused_while_another_is_written(self):
+        token = self.start()
+        with open(upload_path(token), "rb") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            response = self.put(token, b"abc", 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(f"{self.url}{token}/").json()[
+            "received"], 0)
+
+
+class CatalogImportTests(TestCase):
+    blob = f"cas/3f/a2/{'3fa2' * 16}.jpg"
+
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Catalog", slug="catalog")
+        MediaBlob.objects.create(name=self.blob, refs=1)
+
+    def catalog(self, records):
+        lines = (
+            record if isinstance(record, str) else json.dumps(record)
+            for record in records
+        )
+        stream = io.BytesIO("".join(f"{line}\n" for line in lines).encode())
+        return CatalogImport(self.brand.id, stream, "jsonl")
+
+    def run_import(self, records, batch_size=None):
+        catalog = self.catalog(records)
+        for _ in catalog.run(batch_size):
+            pass
+        return catalog.summary()
+
+    def test_images_must_be_uploads(self):
+        summary = self.run_import([
+            {"title": "Shoe", "image": self.blob, "gallery": [self.blob]},
+            {"title": "Boot", "gallery": [self.blob, "product/boot.jpg"]},
+        ])
+        self.assertEqual((summary["created"], summary["failed"]), (1, 1))
+        self.assertEqual(summary["errors"], [{"row": 2, "errors": {
+            "gallery[1][image]": ["Unknown image; upload the file first."]}}])
+        self.assertEqual(Product.objects.get().image.name, self.blob)
+        self.assertEqual(Picture.objects.get().image.name, self.blob)
+        # The upload's own reference and the two imported ones
+        self.assertEqual(MediaBlob.objects.get().refs, 3)
+
+    def test_resumes_after_the_last_committed_batch(self):
+        records = [{"title": f"Item {index}"} for index in range(5)]
+        adjust = BrandStats.adjust
+        calls = []
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            return adjust(*args, **kwargs)
+
+        with mock.patch.object(
+            BrandStats, "adjust", side_effect=fail_second_batch
+        ), self.assertRaises(RuntimeError):
+            self.run_import(records, batch_size=2)
+        self.assertEqual(
+            sorted(Product.objects.values_list("title", flat=True)),
+            ["Item 0", "Item 1"])
+
+        catalog = self.catalog(records)
+        self.assertEqual(catalog.resumed_from, 2)
+        for _ in catalog.run(2):
+            pass
+        self.assertEqual((catalog.position, catalog.created), (5, 3))
+        self.assertEqual(Product.objects.count(), 5)
+        # A finished file adds nothing
+        self.assertEqual(self.run_import(records)["created"], 0)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_slug_collisions(self):
+        taken = Product.objects.create(
+            title="Shoe", brand=self.brand, slug="shoe")
+        summary = self.run_import([
+            {"title": "Shoe"},
+            {"title": "Shoe"},
+            {"title": "Boot", "slug": "shoe"},
+            {"title": "Hat", "slug": "hat"},
+        ])
+        self.assertEqual((summary["created"], summary["failed"]), (3, 1))
+        self.assertEqual(summary["errors"], [{"row": 3, "errors": {
+            "slug": ["Product with this slug already exists."]}}])
+        generated = Product.objects.filter(title="Shoe").exclude(id=taken.id)
+        # Generated slugs that are taken get the product's pid
+        self.assertEqual(
+            sorted(product.slug for product in generated),
+            sorted(f"shoe-{product.pid}" for product in generated))
+        self.assertTrue(Product.objects.filter(slug="hat").exists())
+
+    def test_row_errors(self):
+        Category.objects.create(title="Shoes", slug="shoes")
+        summary = self.run_import([
+            "not json",
+            {"title": "Shoe", "colour": "red"},
+            {"description": "No title"},
+            {"title": "Hat", "category": "hats"},
+            {"title": "Boot", "price": "cheap", "sizes": [{"price": "1"}]},
+            {"title": "Shoe", "category": "shoes"},
+        ])
+        self.assertEqual(
+            (summary["rows"], summary["created"], summary["failed"]),
+            (6, 1, 5))
+        errors = {error["row"]: error["errors"] for error in summary["errors"]}
+        self.assertEqual(errors[1], {"record": ["Not valid JSON"]})
+        self.assertEqual(errors[2], {"record": ["Unknown fields: colour"]})
+        self.assertEqual(errors[3], {"title": ["This field is required."]})
+        self.assertEqual(errors[4], {"category": ["Unknown category"]})
+        self.assertEqual(
+            set(errors[5]), {"price", "sizes[0][name]"})
+        self.assertEqual(Product.objects.get().category.slug, "shoes")
+
+    def test_reported_errors_are_capped(self):
+        with mock.patch("store.catalog.MAX_REPORTED_ERRORS", 2):
+            summary = self.run_import([{"price": "1"}] * 3)
+        self.assertEqual(summary["failed"], 3)
+        self.assertEqual(
+            [error["row"] for error in summary["errors"]], [1, 2])
+
+
+def field_values(instance):
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    }
+
+
+class ArchiveTests(CouponMixin, APITestCase):
+    def setUp(self):
+        self.create_catalog()
+        self.buyer = self.create_buyer("archived")
+        self.cutoff = timezone.now() - timedelta(days=30)
+        old = self.cutoff - timedelta(days=1)
+        self.orders = []
+        for status in ("Completed", "Cancelled", "Completed"):
+            order = create_order(
+                self.buyer, self.brand, self.product, order_status=status,
+                payment_status="paid", date=old)
+            order.brand.add(self.brand)
+            self.orders.append(order)
+        # Still open, or too recent
+        self.open = create_order(
+            self.buyer, self.brand, self.product, date=old)
+        self.recent = create_order(
+            self.buyer, self.brand, self.product, order_status="Completed")
+
+    def test_archive_batch_moves_rows(self):
+        first, second = self.orders[:2]
+        orders = [field_values(order) for order in (first, second)]
+        lines = [
+            field_values(line)
+            for line in CartOrderProduct.objects.filter(
+                order__in=[first, second]).order_by("id")
+        ]
+
+        self.assertEqual(archive_batch(self.cutoff, batch_size=2), 2)
+
+        self.assertFalse(
+            CartOrder.objects.filter(id__in=[first.id, second.id]).exists())
+        self.assertFalse(CartOrderProduct.objects.filter(
+            order_id__in=[first.id, second.id]).exists())
+        self.assertEqual(
+            [field_values(order)
+             for order in ArchivedCartOrder.objects.order_by("id")],
+            orders)
+        self.assertEqual(
+            [field_values(line)
+             for line in ArchivedCartOrderProduct.objects.order_by("id")],
+            lines)
+        self.assertEqual(
+            list(ArchivedCartOrder.objects.get(id=first.id).brand.all()),
+            [self.brand])
+
+        self.assertEqual(archive_batch(self.cutoff, batch_size=2), 1)
+        self.assertEqual(archive_batch(self.cutoff, batch_size=2), 0)
+        self.assertEqual(
+            set(CartOrder.objects.values_list("id", flat=True)),
+            {self.open.id, self.recent.id})
+
+    def test_views_fall_back_to_archive(self):
+        order = self.orders[0]
+        archive_batch(self.cutoff, batch_size=10)
+        urls = (
+            f"/api/v1/checkout/{order.oid}/",
+            f"/api/v1/customer/orders/{self.buyer.id}/{order.oid}/",
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["oid"], order.oid)
+                self.assertEqual(response.data["order_status"], "Completed")
+                self.assertEqual(
+                    [item["product"]["id"]
+                     for item in response.data["get_order_items"]],
+                    [self.product.id])
+
+    def test_views_miss_unknown_orders(self):
+        archive_batch(self.cutoff, batch_size=10)
+        for url in (
+            "/api/v1/checkout/missing/",
+            f"/api/v1/customer/orders/{self.buyer.id}/missing/",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class BrandAnalyticsTests(CouponMixin, TestCase):
+    def setUp(self):
+        self.create_catalog()
+        regular, once = self.create_buyer("regular"), self.create_buyer("once")
+        for buyer, day, sub_total, kwargs in (
+            (regular, 2, "100.00", {"order_status": "Completed"}),
+            (regular, 5, "50.00", {}),
+            (once, 5, "30.00", {}),
+            (None, 9, "20.00", {}),
+            # Unpaid, and paid after the range
+            (once, 6, "70.00", {"payment_status": "pending"}),
+            (once, 11, "70.00", {}),
+        ):
+            kwargs.setdefault("payment_status", "paid")
+            order = create_order(
+                buyer, self.brand, self.product, sub_total,
+                date=timezone.make_aware(datetime(2024, 3, day, 12)),
+                **kwargs)
+            order.brand.add(self.brand)
+        # The completed order is read from the archive
+        self.assertEqual(archive_batch(timezone.now(), batch_size=10), 1)
+        self.start, self.end = date(2024, 3, 1), date(2024, 3, 10)
+
+    def test_brand_analytics(self):
+        analytics = brand_analytics(self.brand.id, self.start, self.end)
+
+        daily = {day["day"]: day for day in analytics["daily_revenue"]}
+        self.assertEqual(len(daily), 10)
+        self.assertEqual(
+            [day["revenue"] for day in analytics["daily_revenue"]],
+            [0.0, 110.0, 0.0, 0.0, 100.0, 0.0, 0.0, 0.0, 30.0, 0.0])
+        self.assertEqual(
+            (daily["2024-03-05"]["ma_7"], daily["2024-03-05"]["ma_28"]),
+            (42.0, 42.0))
+        self.assertEqual(
+            (daily["2024-03-10"]["ma_7"], daily["2024-03-10"]["ma_28"]),
+            (18.57, 24.0))
+
+        self.assertEqual(analytics["repeat_customers"], {
+            "customers": 2, "repeat_customers": 1, "repeat_rate": 0.5,
+            "repeat_order_share": 0.6667, "guest_orders": 1})
+
+        values = analytics["order_values"]
+        self.assertEqual((values["orders"], values["average"]), (4, 60.0))
+        self.assertEqual(values["percentiles"]["p50"], 50.0)
+        self.assertEqual(
+            sum(bucket["orders"] for bucket in values["histogram"]), 4)
+
+        self.assertEqual(analytics["cohorts"], [
+            {"cohort": "2024-03", "customers": 2, "retention": [1.0]}])
+
+    def test_empty_range(self):
+        analytics = brand_analytics(
+            self.brand.id, date(2023, 1, 1), date(2023, 1, 1))
+        self.assertEqual(analytics["daily_revenue"], [{
+            "day": "2023-01-01", "revenue": 0.0, "ma_7": 0.0, "ma_28": 0.0}])
+        self.assertEqual(analytics["order_values"]["orders"], 0)
+        self.assertEqual(analytics["cohorts"], [])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            "brand_analytics", brand=self.brand.id, start="2024-03-01",
+            end="2024-03-10", stdout=out)
+        self.assertEqual(
+            json.loads(out.getvalue()),
+            brand_analytics(self.brand.id, self.start, self.end))
+
+    def test_command_rejects_start_after_end(self):
+        with self.assertRaisesMessage(
+                CommandError, "--start must not be after --end"):
+            call_command(
+                "brand_analytics", brand=self.brand.id, start="2024-03-10",
+                end="2024-03-01")
+
+
+class CollectSalesTests(CouponMixin, TestCase):
+    def setUp(self):
+        self.create_catalog()
+        buyer = self.create_buyer("collected")
+        self.lines = []
+        for age in (timedelta(hours=1), timedelta(minutes=1),
+                    timedelta(hours=2)):
+            order = create_order(
+                buyer, self.brand, self.product, payment_status="paid")
+            line = order.cartorderproduct_set.get()
+            CartOrderProduct.objects.filter(pk=line.pk).update(
+                date=timezone.now() - age)
+            self.lines.append(line)
+
+    def collected(self):
+        return sum(collect_sales()), ProductSales.objects.aggregate(
+            units=models.Sum("units"))["units"]
+
+    def test_stays_behind_recent_lines(self):
+        # The second line may still have uncommitted neighbours: neither
+        # it nor the older line after it is collected yet
+        self.assertEqual(self.collected(), (1, 1))
+        self.assertEqual(
+            Watermark.objects.get(name=ProductSales.WATERMARK).position,
+            self.lines[0].pk)
+        with override_settings(RANKING_COMMIT_LAG=timedelta(0)):
+            self.assertEqual(self.collected(), (2, 3))
+
+
+class ReportingRouterTests(SimpleTestCase):
+    def test_only_order_tables_go_to_the_snapshot(self):
+        router = ReportingRouter()
+        self.assertIsNone(router.db_for_read(CartOrderProduct))
+        token = reporting_source.set({"alias": "reporting", "as_of": None})
+        try:
+            for model in (CartOrder, CartOrderProduct,
+                          ArchivedCartOrderProduct):
+                self.assertEqual(router.db_for_read(model), "reporting")
+            for model in (User, Brand, Product, PaymentEvent):
+                self.assertIsNone(router.db_for_read(model))
+        finally:
+            reporting_source.reset(token)
+
+
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def upload(self, color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 300), color).save(buffer, "PNG")
+        return SimpleUploadedFile("shoe.png", buffer.getvalue())
+
+    def variants(self, category):
+        # Serializing must not ask the storage whether copies exist
+        with mock.patch(
+            "store.images.variant_storage"
+        ) as storage, self.assertNumQueries(0):
+            storage.return_value.url.side_effect = lambda name: f"/{name}"
+            variants = CategorySerializer(category).data["image_variants"]
+        storage.return_value.exists.assert_not_called()
+        return variants
+
+    def test_urls_follow_the_mark_of_the_row(self):
+        category = Category.objects.create(
+            title="Shoes", slug="shoes", image=self.upload("red"))
+        self.assertIsNone(self.variants(category))
+
+        self.assertGreater(generate_variants(category.image.name), 0)
+        category.refresh_from_db()
+        variants = self.variants(category)
+        self.assertEqual(
+            variants["thumb"], f"/{category.image.name[:-4]}__thumb.png")
+
+        category.image = self.upload("blue")
+        category.save()
+        self.assertIsNone(self.variants(category))
+
+    def test_existing_copies_are_only_marked(self):
+        first = Category.objects.create(
+            title="Shoes", slug="shoes", image=self.upload("red"))
+        generate_variants(first.image.name)
+        second = Category.objects.create(
+            title="Boots", slug="boots", image=self.upload("red"))
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(generate_variants(second.image.name), 0)
+        second.refresh_from_db()
+        self.assertIsNotNone(self.variants(second))
+
+
+class ParseNestedTests(SimpleTestCase):
+    def assertErrors(self, data, errors):
+        query = QueryDict(mutable=True)
+        query.update({"title": "Shoe", **data})
+        with self.assertRaises(ValidationError) as raised:
+            parse_nested(query)
+        self.assertEqual(raised.exception.detail, errors)
+
+    def test_items_follow_their_index(self):
+        data = QueryDict(mutable=True)
+        data.update({
+            "sizes[10][name]": "L",
+            "sizes[2][name]": "M",
+            "sizes[2][price]": "2.00",
+            "sizes[0][name]": "S",
+            "gallery[3][id]": "7",
+        })
+        parsed = parse_nested(data)
+        self.assertEqual(parsed["sizes"], [
+            {"name": "S"}, {"name": "M", "price": "2.00"}, {"name": "L"}])
+        self.assertEqual(parsed["gallery"], [{"id": "7"}])
+        self.assertEqual(parsed["specifications"], [])
+        self.assertEqual(parsed["colors"], [])
+
+    def test_malformed_keys(self):
+        self.assertErrors(
+            {"sizes[x][name]": "S", "sizes[0][name": "M",
+             "colors[0]": "red", "sizes[-1][name]": "L"},
+            {"sizes": ["Malformed key sizes[x][name]",
+                       "Malformed key sizes[0][name",
+                       "Malformed key sizes[-1][name]"],
+             "colors": ["Malformed key colors[0]"]})
+
+    def test_unknown_collections_and_fields(self):
+        self.assertErrors(
+            {"variants[0][name]": "S", "sizes[0][name]": "S",
+             "sizes[0][colour]": "red"},
+            {"nested": ["Unknown collection variants[0][name]"],
+             "sizes": ["Unknown field sizes[0][colour]"]})
+
+    def test_required_fields(self):
+        self.assertErrors(
+            {"specifications[0][content]": "Leather",
+             "sizes[4][price]": "1.00",
+             "gallery[0][id]": "3", "gallery[1][upload]": "token",
+             "gallery[2][image]": ""},
+            {"specifications": ["specifications[0][title] is required"],
+             "sizes": ["sizes[4][name] is required"],
+             "gallery": ["gallery[2][image] is required"]})
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=directory.name, IMAGE_VARIANTS={})
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.storage = Picture._meta.get_field("image").storage
+
+    def save(self, content, name="product/shoe.jpg"):
+        return self.storage.save(name, ContentFile(content))
+
+    def test_same_content_is_stored_once(self):
+        first = self.save(b"shoe")
+        second = self.save(b"shoe", "product/copy.jpg")
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith("cas/"))
+        self.assertEqual(MediaBlob.objects.get(name=first).refs, 2)
+        self.assertNotEqual(self.save(b"boot"), first)
+
+        self.storage.delete(first)
+        self.assertEqual(MediaBlob.objects.get(name=first).refs, 1)
+        self.assertTrue(self.storage.exists(first))
+        self.storage.delete(first)
+        self.assertFalse(MediaBlob.objects.filter(name=first).exists())
+        self.assertFalse(self.storage.exists(first))
+
+    def test_collect_removes_old_unreferenced_blobs_only(self):
+        product = Product.objects.create(
+            title="Shoe", slug="shoe",
+            brand=Brand.objects.create(name="Media", slug="media"))
+        used = self.save(b"used")
+        Picture.objects.create(product=product, image=used)
+        old, recent = self.save(b"old"), self.save(b"recent")
+        hours_ago = timezone.now() - timedelta(hours=2)
+        # A count too high for the used blob and none for the others, as
+        # left by bulk deletes
+        MediaBlob.objects.filter(name=used).update(refs=5, created=hours_ago)
+        MediaBlob.objects.filter(name=old).update(refs=1, created=hours_ago)
+        MediaBlob.objects.filter(name=recent).update(refs=0)
+
+        stats = collect_blobs(self.storage, grace=timedelta(hours=1))
+        self.assertEqual((stats["deleted"], stats["recounted"]), (1, 2))
+        self.assertEqual(
+            dict(MediaBlob.objects.values_list("name", "refs")),
+            {used: 1, recent: 0})
+        self.assertFalse(self.storage.exists(old))
+        self.assertTrue(self.storage.exists(used))
+        self.assertTrue(self.storage.exists(recent))
+
+    def test_dry_run_changes_nothing(self):
+        old = self.save(b"old")
+        MediaBlob.objects.filter(name=old).update(
+            refs=0, created=timezone.now() - timedelta(days=1))
+        stats = collect_blobs(self.storage, dry_run=True)
+        self.assertEqual(stats["deleted"], 1)
+        self.assertTrue(MediaBlob.objects.filter(name=old).exists())
+        self.assertTrue(self.storage.exists(old))
@@ -0,0 +1,133 @@
+"""
+Token bucket rate limits per endpoint and client.
+
+A view opts in with a throttle_scope naming one of the rates of
+REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]. A rate of "5/hour" gives every
+client a bucket of 5 requests, refilled at 5 an hour: bursts up to the
+bucket size pass, after that one request every 12 minutes. Clients are
+the authenticated user, else the IP address: X-Forwarded-For is only
+read behind REST_FRAMEWORK["NUM_PROXIES"] proxies. Requests over the
+limit are answered 429, with a Retry-After header, by DRF's throttle
+check, before the view's handler runs.
+
+Buckets live in this process's memory, unless THROTTLE_CACHE names a
+cache of CACHES: with several worker processes or servers, point it at a
+shared cache (Redis, Memcached) so they all count against one bucket.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Buckets kept in memory; the least recently used are dropped first
+LOCAL_BUCKETS = 100_000
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    Return the bucket size and refill rate per second of a rate such as
+    "5/hour", or None for no rate.
+    """
+    if rate is None:
+        return None
+    requests, period = rate.split("/")
+    return int(requests), int(requests) / PERIODS[period[0]]
+
+
+def refill(bucket, capacity, per_second, now):
+    """
+    Take one request from a (tokens, updated) bucket. Returns the new
+    bucket, and the seconds until a request would pass or 0 when this one
+    does.
+    """
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + max(now - updated, 0) * per_second)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / per_second
+
+
+class LocalBuckets:
+    """
+    Buckets in this process's memory.
+    """
+
+    def __init__(self, size=LOCAL_BUCKETS):
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, per_second):
+        now = time.monotonic()
+        with self.lock:
+            bucket, wait = refill(
+                self.buckets.pop(key, None), capacity, per_second, now)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class CacheBuckets:
+    """
+    Buckets in a Django cache, shared by the processes using it. Reading
+    and writing a bucket are two calls, so concurrent requests of one
+    client can each take the same token: bursts may overshoot by the
+    number of workers.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, per_second):
+        bucket, wait = refill(
+            self.cache.get(key), capacity, per_second, time.time())
+        # Expires once it would be full again anyway
+        self.cache.set(key, bucket, int(capacity / per_second) + 1)
+        return wait
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    """
+    Return the process-wide buckets of THROTTLE_CACHE.
+    """
+    alias = getattr(settings, "THROTTLE_CACHE", None)
+    with _buckets_lock:
+        if alias not in _buckets:
+            _buckets[alias] = (
+                CacheBuckets(alias) if alias else LocalBuckets())
+    return _buckets[alias]
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Throttle of the views with a throttle_scope; others pass untouched.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope is None:
+            return True
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+        if rate is None:
+            return True
+        if request.user and request.user.is_authenticated:
+            client = f"user:{request.user.pk}"
+        else:
+            client = f"ip:{self.get_ident(request)}"
+        self.delay = get_buckets().take(f"throttle:{scope}:{client}", *rate)
+        return not self.delay
+
+    def wait(self):
+        return self.delay
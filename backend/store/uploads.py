@@ -0,0 +1,290 @@
+"""
+Resumable uploads sent in chunks.
+
+A product form carrying its gallery as multipart files is one large
+request: the worker spools every photo before the view runs, and a
+dropped connection loses all of it. Clients can send each file ahead of
+the form instead:
+
+    POST /uploads/           {"filename": "shoe.jpg", "size": 20971520}
+                             -> {"token": "...", "received": 0, ...}
+    PUT  /uploads/<token>/   raw bytes, Upload-Offset: 0
+    PUT  /uploads/<token>/   raw bytes, Upload-Offset: 8388608
+    ...
+    GET  /uploads/<token>/   -> how many bytes arrived, to resume from
+
+An upload belongs to the user who started it, who may have at most
+CHUNKED_UPLOAD_MAX_OPEN of them unfinished or unclaimed.
+
+Chunks are copied from the request stream to a file under
+CHUNKED_UPLOAD_DIR a block at a time, so a worker holds one block of an
+upload in memory whatever the chunk or file size. A chunk has to start
+where the previous one ended, and is refused while another chunk of the
+upload is being written; one cut short still counts the bytes that
+arrived.
+
+Product forms then send the token in place of the file: image_upload for
+the product image, gallery[<n>][upload] for a picture. claim_upload()
+hands the finished file to the storage like any upload, and the upload is
+removed once the form's transaction commits. purge_uploads() drops
+uploads nobody finished or used.
+"""
+
+import fcntl
+import mimetypes
+import os
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+from store.models import ChunkedUpload
+
+# Bytes read from the request and written to disk at a time
+BLOCK_SIZE = 64 * 1024
+
+
+class OffsetConflict(APIException):
+    """
+    A chunk that does not continue an upload where it stands.
+    """
+
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The chunk does not start where the upload stands."
+    default_code = "offset_conflict"
+
+
+class TooManyUploads(APIException):
+    """
+    A user starting an upload with CHUNKED_UPLOAD_MAX_OPEN still open.
+    """
+
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = "Finish or abandon your open uploads first."
+    default_code = "too_many_uploads"
+
+
+def upload_dir():
+    """Return the directory unfinished and unclaimed uploads are kept in."""
+    return str(getattr(
+        settings, "CHUNKED_UPLOAD_DIR", settings.BASE_DIR / "uploads"))
+
+
+def upload_path(token):
+    return os.path.join(upload_dir(), token)
+
+
+def upload_status(upload):
+    """Return what a client needs to know to continue an upload."""
+    return {
+        "token": upload.token,
+        "filename": upload.filename,
+        "size": upload.size,
+        "received": upload.received,
+        "complete": upload.complete,
+    }
+
+
+def start_upload(filename, size, user):
+    """
+    Create an empty upload of `size` bytes for `user`. Raises
+    ValidationError for a missing file name or a size that is not a
+    positive integer within CHUNKED_UPLOAD_MAX_SIZE, and TooManyUploads
+    when the user has CHUNKED_UPLOAD_MAX_OPEN uploads open.
+    """
+    errors = {}
+    filename = os.path.basename(str(filename or "")).strip()
+    if not filename:
+        errors["filename"] = "Give the name of the file"
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        size = 0
+    limit = getattr(settings, "CHUNKED_UPLOAD_MAX_SIZE", 100 * 2**20)
+    if not 0 < size <= limit:
+        errors["size"] = f"Give the file size in bytes, at most {limit}"
+    if errors:
+        raise ValidationError(errors)
+    # Concurrent requests may overshoot by one each
+    if ChunkedUpload.objects.filter(user_id=user.pk).count() >= getattr(
+        settings, "CHUNKED_UPLOAD_MAX_OPEN", 100
+    ):
+        raise TooManyUploads()
+
+    upload = ChunkedUpload(
+        token=secrets.token_urlsafe(32),
+        user_id=user.pk,
+        # Keep the extension of overlong names
+        filename=filename[-255:],
+        size=size,
+    )
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(upload_path(upload.token), "wb").close()
+    upload.save(force_insert=True)
+    return upload
+
+
+def get_upload(token, user):
+    """Return an upload of `user`, or raise NotFound."""
+    try:
+        return ChunkedUpload.objects.get(token=token, user_id=user.pk)
+    except ChunkedUpload.DoesNotExist:
+        raise NotFound("Upload does not exist")
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Append `length` bytes read from `stream` to an upload, starting at
+    byte `offset`. Returns the upload with its new received count.
+
+    Raises OffsetConflict when `offset` is not where the upload stands
+    (a chunk sent twice, or two clients sending the same upload) or
+    another chunk is being written, and ValidationError for a chunk
+    running past the file size or ending early. Bytes of a chunk that
+    ended early are kept.
+    """
+    try:
+        file = open(upload_path(upload.token), "r+b")
+    except FileNotFoundError:
+        raise NotFound("Upload does not exist")
+    with file:
+        # Held until the file is closed: the offset checked below stays
+        # the upload's until this chunk is written and counted
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise OffsetConflict(
+                "Another chunk is being written to the upload.")
+        received = ChunkedUpload.objects.filter(
+            token=upload.token).values_list("received", flat=True).first()
+        if received is None:
+            raise NotFound("Upload does not exist")
+        upload.received = received
+        if offset != received:
+            raise OffsetConflict(
+                f"The upload stands at byte {received}, not {offset}.")
+        if length is None or length <= 0:
+            raise ValidationError({"chunk": "Send the chunk with its length"})
+        if offset + length > upload.size:
+            raise ValidationError({"chunk": (
+                f"The chunk ends past the file size of {upload.size}")})
+
+        written = 0
+        file.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            file.write(block)
+            written += len(block)
+        # Drop what an earlier, rejected attempt left past this chunk
+        file.truncate()
+
+        received = offset + written
+        if not ChunkedUpload.objects.filter(
+            token=upload.token, received=offset
+        ).update(received=received, updated=timezone.now()):
+            raise NotFound("Upload does not exist")
+    upload.received = received
+    if written < length:
+        raise ValidationError({
+            "chunk": f"The chunk ended after {written} of {length} bytes; "
+            f"continue from byte {received}"})
+    return upload
+
+
+def discard_upload(token):
+    """Remove an upload and its file."""
+    ChunkedUpload.objects.filter(token=token).delete()
+    try:
+        os.remove(upload_path(token))
+    except FileNotFoundError:
+        pass
+
+
+def claim_upload(token, key):
+    """
+    Return a finished upload as an UploadedFile for a form field, and
+    remove the upload once the current transaction commits. `key` names
+    the form field in errors.
+    """
+    upload = ChunkedUpload.objects.filter(token=str(token)).first()
+    if upload is None:
+        raise ValidationError({key: f"Unknown upload {token}"})
+    if not upload.complete:
+        raise ValidationError({
+            key: f"Upload {token} has {upload.received} of "
+            f"{upload.size} bytes"})
+    try:
+        file = open(upload_path(upload.token), "rb")
+    except FileNotFoundError:
+        raise ValidationError({key: f"Unknown upload {token}"})
+
+    def release():
+        file.close()
+        discard_upload(upload.token)
+
+    transaction.on_commit(release)
+    return UploadedFile(
+        file,
+        name=upload.filename,
+        content_type=mimetypes.guess_type(upload.filename)[0],
+        size=upload.size,
+    )
+
+
+def claimed_files(serializer, data):
+    """
+    Return {field: file} for the `<field>_upload` tokens a form sends for
+    the writable file fields of `serializer`, validated by those fields.
+    """
+    files = {}
+    for name, field in serializer.fields.items():
+        key = f"{name}_upload"
+        token = data.get(key)
+        if field.read_only or not token or not isinstance(
+            field, serializers.FileField
+        ):
+            continue
+        try:
+            files[name] = field.run_validation(claim_upload(token, key))
+        except ValidationError as error:
+            detail = error.detail
+            raise ValidationError(
+                detail if isinstance(detail, dict) else {key: detail})
+    return files
+
+
+def purge_uploads(older_than=timedelta(hours=24)):
+    """
+    Remove uploads not written to or claimed for `older_than`, and files
+    left without an upload. Returns the number of files and bytes freed.
+    """
+    cutoff = timezone.now() - older_than
+    ChunkedUpload.objects.filter(updated__lt=cutoff).delete()
+    live = set(ChunkedUpload.objects.values_list("token", flat=True))
+
+    removed, freed = 0, 0
+    try:
+        entries = list(os.scandir(upload_dir()))
+    except FileNotFoundError:
+        return removed, freed
+    for entry in entries:
+        if entry.name in live or not entry.is_file():
+            continue
+        stat = entry.stat()
+        # A file is created just before its row
+        if stat.st_mtime > cutoff.timestamp():
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
@@ -4,8 +4,13 @@ from store.models import (
     Category,
     CartOrder,
     CartOrderProduct,
+    ArchivedCartOrder,
+    BrandOrder,
     Review,
     ProductFAQ,
+    Coupon,
+    PaymentEvent,
+    ProductRanking,
     Tax,
 )
 from store.serializer import (
@@ -13,16 +18,33 @@ from store.serializer import (
     ProductSerializer,
     CategorySerializer,
     CartOrderSerializer,
+    ArchivedCartOrderSerializer,
     ProductFAQSerializer,
     ReviewSerializer,
+    CouponApplySerializer,
+    PaymentWebhookSerializer,
+    ProductRankingSerializer,
+)
+from store.archive import get_order
+from store.coupons import apply_coupon
+from store.payments import get_dispatcher, record_event, verify_signature
+from store.uploads import (
+    discard_upload,
+    get_upload,
+    start_upload,
+    upload_status,
+    write_chunk,
 )
 from userauths.models import User
 
 from rest_framework import generics, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, ValidationError
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from django.conf import settings
+from django.db import transaction
 from decimal import Decimal
 
 
@@ -64,6 +86,60 @@ class ProductListView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
 
+class ProductRankingView(generics.ListAPIView):
+    """
+    List the best selling products, globally or for one brand or category.
+
+    Rankings are precomputed by the rank_products command.
+    """
+
+    serializer_class = ProductRankingSerializer
+    permission_classes = (AllowAny,)
+    scope = "global"
+
+    @swagger_auto_schema(
+        operation_summary="Retrieve best selling products",
+        operation_description="List the top products by units sold or "
+        "revenue over the last 7, 30 or 90 days",
+        manual_parameters=[
+            openapi.Parameter(
+                "window", openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                description="Days (default: 30)",
+            ),
+            openapi.Parameter(
+                "metric", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                enum=[metric for metric, _ in ProductRanking.METRICS],
+                description="Ranking metric (default: units)",
+            ),
+        ],
+        responses={200: ProductRankingSerializer(many=True)},
+        tags=["Products"],
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        window = self.request.query_params.get("window", "30")
+        if not window.isdigit() or int(window) not in settings.RANKING_WINDOWS:
+            raise ValidationError(
+                {"window": "Choose one of "
+                 + ", ".join(map(str, settings.RANKING_WINDOWS))})
+        metric = self.request.query_params.get("metric", "units")
+        if metric not in dict(ProductRanking.METRICS):
+            raise ValidationError({"metric": "Choose units or revenue"})
+
+        return (
+            ProductRanking.objects.filter(
+                scope=self.scope,
+                scope_id=self.kwargs.get("scope_id"),
+                window=int(window),
+                metric=metric,
+            )
+            .select_related("product")
+            .order_by("rank")
+        )
+
+
 class ProductDetailView(generics.RetrieveAPIView):
     """
     Gets the details of a product using the provided slug
@@ -105,6 +181,7 @@ class CartView(generics.ListCreateAPIView):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = (AllowAny,)
+    throttle_scope = "cart"
 
     @swagger_auto_schema(
         operation_summary="List all carts for all users(beta feature)",
@@ -387,59 +464,88 @@ class CreateOrderView(generics.CreateAPIView):
         else:
             user = None
         # grab all items in the cart
-        cart_items = Cart.objects.filter(cart_id=cart_id)
+        cart_items = Cart.objects.filter(cart_id=cart_id).select_related(
+            "product")
 
         total_shipping = Decimal(0.00)
         total_tax = Decimal(0.00)
         total_service_fee = Decimal(0.00)
         total_sub_total = Decimal(0.00)
-        total_initial_total = Decimal(0.00)
         total_total = Decimal(0.00)
 
-        order = CartOrder.objects.create(
-            buyer=user,
-            full_name=full_name,
-            email=email,
-            phone=phone,
-            address=address,
-            city=city,
-            state=state,
-            country=country,
-        )
-
-        for c in cart_items:
-            CartOrderProduct.objects.create(
-                order=order,
-                product=c.product,
-                brand=c.product.brand,
-                qty=c.qty,
-                color=c.color,
-                size=c.size,
-                price=c.price,
-                sub_total=c.sub_total,
-                shipping_amount=c.shipping_amount,
-                service_fee=c.service_fee,
-                tax_fee=c.tax_fee,
-                total=c.total,
-                initial_total=c.total,
+        with transaction.atomic():
+            order = CartOrder.objects.create(
+                buyer=user,
+                full_name=full_name,
+                email=email,
+                phone=phone,
+                address=address,
+                city=city,
+                state=state,
+                country=country,
             )
-            total_shipping += Decimal(c.shipping_amount)
-            total_tax += Decimal(c.tax_fee)
-            total_service_fee += Decimal(c.service_fee)
-            total_sub_total += Decimal(c.sub_total)
-            total_initial_total += Decimal(c.total)
-            total_total += Decimal(c.total)
-
-            order.brand.add(c.product.brand)
-
-        order.sub_total = total_sub_total
-        order.shipping_amount = total_shipping
-        order.tax_fee = total_tax
-        order.service_fee = total_service_fee
-        order.initial_total = total_initial_total
-        order.total = total_total
 
-        order.save()
+            # Build every line and one sub-order per brand, then insert
+            # each in a single query
+            order_items = []
+            brand_orders = {}
+            for c in cart_items:
+                order_items.append(
+                    CartOrderProduct(
+                        order=order,
+                        product=c.product,
+                        brand_id=c.product.brand_id,
+                        qty=c.qty,
+                        color=c.color,
+                        size=c.size,
+                        price=c.price,
+                        sub_total=c.sub_total,
+                        shipping_amount=c.shipping_amount,
+                        service_fee=c.service_fee,
+                        tax_fee=c.tax_fee,
+                        total=c.total,
+                        original_total=c.total,
+                    )
+                )
+                total_shipping += Decimal(c.shipping_amount)
+                total_tax += Decimal(c.tax_fee)
+                total_service_fee += Decimal(c.service_fee)
+                total_sub_total += Decimal(c.sub_total)
+                total_total += Decimal(c.total)
+
+                brand_order = brand_orders.get(c.product.brand_id)
+                if brand_order is None:
+                    brand_order = brand_orders[c.product.brand_id] = BrandOrder(
+                        brand_id=c.product.brand_id,
+                        order=order,
+                        oid=order.oid,
+                        date=order.date,
+                        sub_total=Decimal(0.00),
+                        shipping_amount=Decimal(0.00),
+                        tax_fee=Decimal(0.00),
+                        service_fee=Decimal(0.00),
+                        total=Decimal(0.00),
+                        units=0,
+                    )
+                brand_order.sub_total += Decimal(c.sub_total)
+                brand_order.shipping_amount += Decimal(c.shipping_amount)
+                brand_order.tax_fee += Decimal(c.tax_fee)
+                brand_order.service_fee += Decimal(c.service_fee)
+                brand_order.total += Decimal(c.total)
+                brand_order.units += int(c.qty)
+
+            CartOrderProduct.objects.bulk_create(order_items)
+            BrandOrder.objects.bulk_create(brand_orders.values())
+            order.brand.add(*brand_orders)
+
+            order.sub_total = total_sub_total
+            order.shipping_amount = total_shipping
+            order.tax_fee = total_tax
+            order.service_fee = total_service_fee
+            order.original_total = total_total
+            order.total = total_total
+
+            order.save()
 
         return Response(
             {"message": "Order has been Created Successfully", "order_oid": order.oid},
@@ -461,10 +567,151 @@ class CheckoutView(generics.RetrieveAPIView):
     def get_object(self):
         """
         Retrieve checkout details by order_oid.
+
+        Orders moved to the archive are still found.
         """
         order_oid = self.kwargs["order_oid"]
-        order = CartOrder.objects.get(oid=order_oid)
-        return order
+        try:
+            return get_order(oid=order_oid)
+        except ArchivedCartOrder.DoesNotExist:
+            raise NotFound("Order does not exist")
+
+    def retrieve(self, request, *args, **kwargs):
+        order = self.get_object()
+        if isinstance(order, ArchivedCartOrder):
+            serializer = ArchivedCartOrderSerializer(
+                order, context=self.get_serializer_context()
+            )
+        else:
+            serializer = self.get_serializer(order)
+        return Response(serializer.data)
+
+
+class CouponApplyView(generics.CreateAPIView):
+    """
+    Apply a coupon to an order.
+
+    The brand's discount is taken off every line of the order that
+    belongs to the coupon's brand. Only the buyer can apply a coupon, to
+    an order not paid yet, and each user can redeem a coupon once.
+    """
+
+    serializer_class = CouponApplySerializer
+    queryset = Coupon.objects.all()
+    permission_classes = (IsAuthenticated,)
+
+    @swagger_auto_schema(
+        operation_summary="Apply a coupon to an order",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                "order_oid": openapi.Schema(
+                    type=openapi.TYPE_STRING, description="Order ID"
+                ),
+                "coupon_code": openapi.Schema(
+                    type=openapi.TYPE_STRING, description="Coupon code"
+                ),
+            },
+            required=["order_oid", "coupon_code"],
+        ),
+        responses={
+            200: "OK - Coupon applied.",
+            400: "Bad Request - Coupon cannot be used on this order.",
+            401: "Unauthorized - Sign in to use a coupon.",
+            404: "Not Found - Order or coupon not found.",
+            503: "Service Unavailable - Coupon busy, try again.",
+        },
+        tags=["Coupons"],
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        order, saved = apply_coupon(
+            serializer.validated_data["order_oid"],
+            serializer.validated_data["coupon_code"],
+            request.user,
+        )
+
+        return Response(
+            {
+                "message": "Coupon has been applied",
+                "amount_saved": saved,
+                "total": order.total,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class PaymentWebhookView(generics.CreateAPIView):
+    """
+    Receive payment gateway events.
+
+    Events are stored and acknowledged straight away; status changes are
+    applied in the background, in order for each order. Redelivered
+    events (same id) are acknowledged without being stored again.
+    """
+
+    serializer_class = PaymentWebhookSerializer
+    queryset = PaymentEvent.objects.all()
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    @swagger_auto_schema(
+        operation_summary="Payment gateway webhook",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                "id": openapi.Schema(
+                    type=openapi.TYPE_STRING, description="Event ID"
+                ),
+                "order_oid": openapi.Schema(
+                    type=openapi.TYPE_STRING, description="Order ID"
+                ),
+                "status": openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description="New payment status"
+                ),
+                "created": openapi.Schema(
+                    type=openapi.TYPE_NUMBER,
+                    description="Event time (unix seconds)"
+                ),
+            },
+            required=["id", "order_oid", "status", "created"],
+        ),
+        responses={
+            200: "OK - Event recorded or already known.",
+            400: "Bad Request - Malformed event.",
+            403: "Forbidden - Invalid signature, or no webhook secret set.",
+        },
+        tags=["Payments"],
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        if not verify_signature(
+            request.body, request.headers.get("X-Riz-Signature")
+        ):
+            return Response(
+                {"message": "Invalid signature"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        event, created = record_event(serializer.validated_data, request.data)
+        if not created:
+            return Response(
+                {"message": "Duplicate event"}, status=status.HTTP_200_OK
+            )
+
+        transaction.on_commit(lambda: get_dispatcher().submit(event.order_oid))
+        return Response({"message": "Event received"}, status=status.HTTP_200_OK)
 
 
 class ReviewListView(generics.ListAPIView):
@@ -614,3 +861,108 @@ class ProductFAQDeleteView(generics.DestroyAPIView):
         return Response(
             {"message": "FAQ deleted successfully"}, status=status.HTTP_200_OK
         )
+
+
+class ChunkedUploadCreateView(generics.GenericAPIView):
+    """
+    Start a resumable upload.
+
+    The file is then sent in chunks to ChunkedUploadView, and product
+    forms refer to it by the returned token.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    throttle_scope = "uploads"
+
+    @swagger_auto_schema(
+        operation_summary="Start a chunked upload",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                "filename": openapi.Schema(
+                    type=openapi.TYPE_STRING, description="File name"
+                ),
+                "size": openapi.Schema(
+                    type=openapi.TYPE_INTEGER,
+                    description="File size in bytes"
+                ),
+            },
+            required=["filename", "size"],
+        ),
+        responses={
+            201: "Created - Upload token and progress.",
+            400: "Bad Request - Missing name or invalid size.",
+            401: "Unauthorized",
+            429: "Too Many Requests - Too many uploads open or started.",
+        },
+        tags=["Uploads"],
+    )
+    def post(self, request, *args, **kwargs):
+        upload = start_upload(
+            request.data.get("filename"), request.data.get("size"),
+            request.user)
+        return Response(upload_status(upload), status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadView(generics.GenericAPIView):
+    """
+    Send, check or abandon a chunked upload.
+
+    PUT appends the raw request body at the byte given in the
+    Upload-Offset header; GET tells where to resume from. Only the user
+    who started an upload sees it.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    throttle_scope = "uploads"
+
+    def _respond(self, upload):
+        response = Response(upload_status(upload))
+        response["Upload-Offset"] = str(upload.received)
+        return response
+
+    @swagger_auto_schema(
+        operation_summary="Progress of a chunked upload",
+        responses={200: "OK - Upload progress.", 404: "Not Found"},
+        tags=["Uploads"],
+    )
+    def get(self, request, token):
+        return self._respond(get_upload(token, request.user))
+
+    @swagger_auto_schema(
+        operation_summary="Send a chunk of an upload",
+        manual_parameters=[
+            openapi.Parameter(
+                "Upload-Offset", openapi.IN_HEADER, type=openapi.TYPE_INTEGER,
+                required=True, description="Byte the chunk starts at",
+            ),
+        ],
+        responses={
+            200: "OK - Upload progress.",
+            400: "Bad Request - Chunk too long or cut short.",
+            404: "Not Found",
+            409: "Conflict - The upload stands at another byte, or "
+            "another chunk is being written.",
+        },
+        tags=["Uploads"],
+    )
+    def put(self, request, token):
+        upload = get_upload(token, request.user)
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            raise ValidationError(
+                {"Upload-Offset": "Give the byte the chunk starts at"})
+        # Read the body as a stream; request.data would buffer it
+        write_chunk(upload, offset, request.stream, length)
+        return self._respond(upload)
+
+    @swagger_auto_schema(
+        operation_summary="Abandon a chunked upload",
+        responses={204: "No Content"},
+        tags=["Uploads"],
+    )
+    def delete(self, request, token):
+        discard_upload(get_upload(token, request.user).token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,155 @@
+"""
+JWT authentication that trusts the token's claims.
+
+simplejwt's JWTAuthentication loads the user row on every request with a
+token, although an access token signed by us already names the user and
+carries the claims MyTokenObtainPairSerializer.get_token() adds. For
+reads, TokenClaimsAuthentication authenticates the request from the
+token alone: request.user is a TokenClaimsUser answering id, pk and the
+CLAIM_FIELDS from the token, and loading the row the first time a view
+needs anything else. Other claims (brand_id) are in request.auth.
+
+Trusting the token means a user deactivated or renamed while holding an
+access token keeps it, and its claims, until it expires (minutes with
+ACCESS_TOKEN_LIFETIME). Requests that change data are not affected:
+their user is loaded and checked as active before the view runs, as
+are all requests while JWT_TRUST_CLAIMS_ON_READ is False.
+
+LoginBackend, the backend logins authenticate with, loads the user's
+brand with the user for the brand_id claim.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db import models
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# User fields served from the token's claims of the same name
+CLAIM_FIELDS = ("email", "full_name", "username")
+
+
+class TokenClaimsUser(SimpleLazyObject):
+    """
+    The user of a validated token. Passes for a User instance (isinstance,
+    foreign key assignment, equality) without loading it.
+    """
+
+    def __init__(self, token):
+        user_model = get_user_model()
+        user_id = token[api_settings.USER_ID_CLAIM]
+        # LazyObject sends other attribute writes to the wrapped user
+        self.__dict__["token"] = token
+        self.__dict__["user_id"] = user_id
+        self.__dict__["user_model"] = user_model
+
+        def load():
+            try:
+                user = user_model.objects.get(
+                    **{api_settings.USER_ID_FIELD: user_id})
+            except user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found",
+                                           code="user_not_found")
+            if not user.is_active:
+                raise AuthenticationFailed("User is inactive",
+                                           code="user_inactive")
+            return user
+
+        super().__init__(load)
+
+    @property
+    def __class__(self):
+        return self.__dict__["user_model"]
+
+    def __getattr__(self, name):
+        if self._wrapped is empty:
+            if name == "pk" or name == api_settings.USER_ID_FIELD:
+                return self.user_id
+            if name in CLAIM_FIELDS and name in self.token:
+                return self.token[name]
+            if name == "is_authenticated":
+                return True
+            if name == "is_anonymous":
+                return False
+            if name == "_meta":
+                return self.user_model._meta
+        return super().__getattr__(name)
+
+    def __eq__(self, other):
+        if self._wrapped is empty and isinstance(other, models.Model):
+            return (
+                other._meta.concrete_model is self.user_model._meta.concrete_model
+                and other.pk == self.user_id
+            )
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        # As Model.__hash__
+        return hash(self.user_id)
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        if self._wrapped is empty:
+            return f"<TokenClaimsUser: {self.user_id}>"
+        return super().__repr__()
+
+    def hydrate(self):
+        """Load the user row now, if it is not loaded yet."""
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+
+class TokenClaimsAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the user lookup on safe (read) requests.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is None:
+            return None
+        user, token = result
+        trusted = getattr(settings, "JWT_TRUST_CLAIMS_ON_READ", True)
+        if not trusted or request.method not in SAFE_METHODS:
+            user.hydrate()
+        return user, token
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(
+                "Token contained no recognizable user identification")
+        return TokenClaimsUser(validated_token)
+
+
+class LoginBackend(ModelBackend):
+    """
+    ModelBackend loading the user's brand with the user, for the brand_id
+    claim of the tokens issued at login.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user_model = get_user_model()
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = user_model._default_manager.select_related("vendor").get(
+                **{user_model.USERNAME_FIELD: username})
+        except user_model.DoesNotExist:
+            # As ModelBackend: hash once, so unknown emails take as long
+            user_model().set_password(password)
+        else:
+            if (user.check_password(password)
+                    and self.user_can_authenticate(user)):
+                return user
@@ -0,0 +1,271 @@
+"""
+Refresh token blacklist: pruning and a revocation filter.
+
+With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION every refresh
+blacklists the refresh token it was given, so the token_blacklist tables
+gain a row per refresh until prune_tokens() deletes the expired ones.
+
+Each refresh first asks whether its token is blacklisted, a lookup
+across both tables. TokenRefreshSerializer asks a Bloom filter of the
+blacklisted jtis first, and only queries the tables when the filter may
+contain the token. The build_blacklist_filter command builds the filter
+from the database and writes it to BLACKLIST_FILTER_PATH; the serving
+processes load the file when it changes, checking at most every
+BLACKLIST_FILTER_RELOAD seconds, and never build it themselves. Without
+a file the tables are queried as before.
+
+The filter can be stale: tokens blacklisted since it was built are not
+in it. That is safe because rotation blacklists the token right after:
+if that finds the token already blacklisted, the refresh is refused.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.utils import aware_utcnow
+
+logger = logging.getLogger(__name__)
+
+# Room left in a built filter for the tokens blacklisted until the next
+FILTER_HEADROOM = 1.5
+FILTER_MIN_CAPACITY = 10_000
+
+# Filter file: magic, bit count and hash count, then the bits
+FILTER_MAGIC = b"RIZBLOOM1"
+FILTER_HEADER = struct.Struct("<QI")
+
+
+class BloomFilter:
+    """
+    Set of strings answering "maybe present" or "certainly absent", in
+    about 10 bits per key for a 1% false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(
+            math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def dump(self, file):
+        file.write(FILTER_MAGIC)
+        file.write(FILTER_HEADER.pack(self.size, self.hashes))
+        file.write(self.bits)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Read a filter written by dump(). Raises ValueError for anything
+        else.
+        """
+        if file.read(len(FILTER_MAGIC)) != FILTER_MAGIC:
+            raise ValueError("Not a Bloom filter file")
+        header = file.read(FILTER_HEADER.size)
+        if len(header) != FILTER_HEADER.size:
+            raise ValueError("Truncated Bloom filter file")
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes = FILTER_HEADER.unpack(header)
+        bloom.bits = bytearray(file.read())
+        if not bloom.hashes or len(bloom.bits) != (bloom.size + 7) // 8:
+            raise ValueError("Truncated Bloom filter file")
+        return bloom
+
+
+def filter_path():
+    return str(getattr(
+        settings, "BLACKLIST_FILTER_PATH",
+        settings.BASE_DIR / "blacklist-filter.bin"))
+
+
+def build_filter():
+    """
+    Return a Bloom filter of the unexpired blacklisted jtis.
+    """
+    jtis = BlacklistedToken.objects.filter(
+        token__expires_at__gt=aware_utcnow()
+    ).values_list("token__jti", flat=True)
+    capacity = max(int(jtis.count() * FILTER_HEADROOM), FILTER_MIN_CAPACITY)
+    bloom = BloomFilter(
+        capacity, getattr(settings, "BLACKLIST_FILTER_ERROR_RATE", 0.01))
+    for jti in jtis.iterator(chunk_size=10_000):
+        bloom.add(jti)
+    return bloom
+
+
+def save_filter(bloom, path=None):
+    """
+    Write a filter to BLACKLIST_FILTER_PATH, replacing the file in one
+    step so that readers never see half of it.
+    """
+    path = path or filter_path()
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(
+        dir=directory, prefix=".blacklist-", delete=False
+    ) as file:
+        try:
+            bloom.dump(file)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    # Temporary files are private to their owner
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+class BlacklistFilter:
+    """
+    The filter of BLACKLIST_FILTER_PATH, loaded again when the file
+    changes. Tokens this process blacklists are added to it as they are.
+    """
+
+    def __init__(self):
+        self.bloom = None
+        # (inode, mtime, size) of the file last loaded or found invalid
+        self.loaded = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def ready(self):
+        """
+        Whether the filter can be asked, loading a new file first when
+        the last check is BLACKLIST_FILTER_RELOAD seconds old.
+        """
+        period = getattr(settings, "BLACKLIST_FILTER_RELOAD", 30)
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= period:
+            self.checked_at = now
+            self.load()
+        return self.bloom is not None
+
+    def might_contain(self, jti):
+        return jti in self.bloom
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def load(self):
+        """
+        Load the filter file if it changed since the last load. A file
+        that cannot be read is skipped until it changes again.
+        """
+        # Requests arriving meanwhile keep the current filter
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            path = filter_path()
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature == self.loaded:
+                return
+            self.loaded = signature
+            try:
+                with open(path, "rb") as file:
+                    self.bloom = BloomFilter.load(file)
+            except (OSError, ValueError):
+                logger.exception(
+                    "Loading the token blacklist filter %s failed", path)
+        finally:
+            self.lock.release()
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def rotation_blacklists():
+    return (
+        api_settings.ROTATE_REFRESH_TOKENS
+        and api_settings.BLACKLIST_AFTER_ROTATION
+    )
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    Refresh token checked against the blacklist filter. blacklist()
+    refuses a token that another request blacklisted first.
+    """
+
+    def check_blacklist(self):
+        # Without rotation nothing would catch a token missing from a
+        # stale filter
+        if rotation_blacklists() and blacklist_filter.ready():
+            if not blacklist_filter.might_contain(
+                    self.payload[api_settings.JTI_CLAIM]):
+                return
+        super().check_blacklist()
+
+    def blacklist(self):
+        blacklisted, created = super().blacklist()
+        if not created:
+            raise TokenError(_("Token is blacklisted"))
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return blacklisted, created
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+def prune_tokens(batch_size=1000, pause=0):
+    """
+    Delete the expired outstanding tokens, and their blacklist entries,
+    `batch_size` at a time in separate transactions, sleeping `pause`
+    seconds between batches. Returns the number of tokens deleted.
+    """
+    now = aware_utcnow()
+    deleted = 0
+    last = 0
+    while True:
+        # Walk the primary key: expires_at is not indexed
+        ids = list(
+            OutstandingToken.objects.filter(pk__gt=last, expires_at__lte=now)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        last = ids[-1]
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,25 @@
+"""
+Password hashers with their cost taken from the settings.
+
+A password hashed with other parameters than the configured ones is
+rehashed when its user next logs in (PasswordHasher.must_update), so
+changing PASSWORD_HASH_ITERATIONS moves every active user over without
+a migration.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 SHA256 hasher, with PASSWORD_HASH_ITERATIONS
+    iterations (None: Django's default).
+    """
+
+    @property
+    def iterations(self):
+        return (
+            getattr(settings, "PASSWORD_HASH_ITERATIONS", None)
+            or super().iterations
+        )
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from userauths.authentication import TokenClaimsAuthentication
+from userauths.models import User
+from userauths.serializer import MyTokenObtainPairSerializer
+
+PATHS = ("/api/v1/category/", "/api/v1/products/")
+
+
+class Command(BaseCommand):
+    """
+    Compare simplejwt's JWTAuthentication, which loads the user on every
+    request, with TokenClaimsAuthentication on authenticated reads:
+    queries per request and requests per second, --requests requests per
+    path. The sample user is deleted afterwards.
+    """
+
+    help = "Benchmark JWT authentication on read requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--path", action="append", dest="paths")
+
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args, **options):
+        paths = options["paths"] or PATHS
+        user = User.objects.create(
+            email=f"jwt-bench-{time.time_ns()}@example.com",
+            username=f"jwt-bench-{time.time_ns()}",
+        )
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        default = APIView.authentication_classes
+        try:
+            for path in paths:
+                self.stdout.write(f"-- {path} --")
+                for name, authentication in (
+                    ("JWTAuthentication", JWTAuthentication),
+                    ("TokenClaimsAuthentication", TokenClaimsAuthentication),
+                ):
+                    # Bound when the views were imported, not per request
+                    APIView.authentication_classes = [authentication]
+                    queries, rate = self.measure(
+                        client, path, options["requests"])
+                    self.stdout.write(
+                        f"{name:<27}{queries:>5} queries/request "
+                        f"{rate:>9,.0f} requests/s")
+        finally:
+            APIView.authentication_classes = default
+            user.delete()
+
+    def measure(self, client, path, requests):
+        queries = []
+        # request_started resets connection.queries, so count them here
+        with connection.execute_wrapper(
+            lambda execute, *args: queries.append(args[0]) or execute(*args)
+        ):
+            response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f"{path}: {response.status_code}")
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        elapsed = time.perf_counter() - started
+        return len(queries), requests / elapsed
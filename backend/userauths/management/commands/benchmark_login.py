@@ -0,0 +1,106 @@
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from brand.models import Brand
+from userauths.models import User
+from userauths.serializer import MyTokenObtainPairSerializer
+
+MODEL_BACKEND = ["django.contrib.auth.backends.ModelBackend"]
+LOGIN_BACKEND = ["userauths.authentication.LoginBackend"]
+PASSWORD = "Bench-login-42"
+
+
+@classmethod
+def legacy_get_token(cls, user):
+    # get_token() before the vendor fix: brand_id was always 0
+    token = super(MyTokenObtainPairSerializer, cls).get_token(user)
+    token["full_name"] = user.full_name
+    token["email"] = user.email
+    token["username"] = user.username
+    try:
+        token["brand_id"] = user.brand.id
+    except AttributeError:
+        token["brand_id"] = 0
+    return token
+
+
+class Command(BaseCommand):
+    """
+    Measure logins per second through MyTokenObtainPairView in this
+    process (one core), before and after the claims fix, and with
+    --iterations PBKDF2 iterations: the first login of every user then
+    rehashes their password, later ones run at the new cost.
+
+    Half of the --users sample users own a brand; each is logged in
+    --rounds times per pass. The sample users are deleted afterwards.
+    """
+
+    help = "Benchmark logins per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--rounds", type=int, default=2)
+        parser.add_argument("--iterations", type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        tag = time.time_ns()
+        encoded = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(email=f"login-{tag}-{index}@example.com",
+                 username=f"login-{tag}-{index}", password=encoded)
+            for index in range(options["users"])
+        )
+        users = list(User.objects.filter(email__startswith=f"login-{tag}-"))
+        for user in users[::2]:
+            Brand.objects.create(user=user, name=user.username,
+                                 slug=user.username)
+        brands = dict(Brand.objects.filter(
+            user__in=users).values_list("user_id", "id"))
+        self.stdout.write(f"{os.cpu_count()} CPUs, one process")
+        original = MyTokenObtainPairSerializer.get_token
+        try:
+            MyTokenObtainPairSerializer.get_token = legacy_get_token
+            with override_settings(AUTHENTICATION_BACKENDS=MODEL_BACKEND):
+                self.logins("before", users, brands, options, legacy=True)
+            MyTokenObtainPairSerializer.get_token = original
+            with override_settings(AUTHENTICATION_BACKENDS=LOGIN_BACKEND):
+                self.logins("after", users, brands, options)
+                with override_settings(
+                        PASSWORD_HASH_ITERATIONS=options["iterations"]):
+                    label = f"{options['iterations']:,} iter"
+                    self.logins(f"{label}, rehash", users, brands,
+                                {**options, "rounds": 1})
+                    self.logins(label, users, brands, options)
+        finally:
+            MyTokenObtainPairSerializer.get_token = original
+            User.objects.filter(email__startswith=f"login-{tag}-").delete()
+
+    def logins(self, name, users, brands, options, legacy=False):
+        client = Client()
+        executed = []
+        count = 0
+        started = time.perf_counter()
+        with connection.execute_wrapper(
+            lambda execute, *args: executed.append(args[0]) or execute(*args)
+        ):
+            for _ in range(options["rounds"]):
+                for user in users:
+                    response = client.post("/api/v1/user/token/", {
+                        "email": user.email, "password": PASSWORD})
+                    if response.status_code != 200:
+                        raise CommandError(f"{name}: {response.status_code}")
+                    claims = AccessToken(response.json()["access"])
+                    expected = 0 if legacy else brands.get(user.pk, 0)
+                    if claims["brand_id"] != expected:
+                        raise CommandError(f"{name}: wrong brand_id")
+                    count += 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name:<24}{count / elapsed:>8.1f} logins/s "
+            f"{len(executed) / count:>5.1f} queries/login")
@@ -0,0 +1,151 @@
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework_simplejwt import serializers
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from userauths.blacklist import (
+    TokenRefreshSerializer,
+    blacklist_filter,
+    build_filter,
+    prune_tokens,
+    save_filter,
+)
+from userauths.models import User
+
+PREFIX = "bench-"
+
+
+class Command(BaseCommand):
+    """
+    Measure token refresh latency with a large blacklist, with simplejwt's
+    serializer (a blacklist query per refresh) and with
+    TokenRefreshSerializer (the Bloom filter first), then time pruning.
+
+    --rows blacklisted tokens are inserted first, unexpired but for
+    --expired of them, with a short placeholder instead of the encoded
+    token. Rows from an earlier --keep run are reused. Each serializer
+    then refreshes a chain of --refreshes tokens, as a client would. The
+    filter is built and written as build_blacklist_filter does, and
+    loaded as the serving processes do.
+    """
+
+    help = "Benchmark refresh token rotation against a large blacklist"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000_000)
+        parser.add_argument("--expired", type=int, default=100_000)
+        parser.add_argument("--refreshes", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument(
+            "--keep", action="store_true",
+            help="Keep the inserted rows for another run")
+
+    def handle(self, *args, **options):
+        self.populate(options)
+        user = User.objects.create(
+            email=f"refresh-{time.time_ns()}@example.com",
+            username=f"refresh-{time.time_ns()}",
+        )
+        try:
+            started = time.perf_counter()
+            bloom = build_filter()
+            save_filter(bloom)
+            built = time.perf_counter() - started
+            started = time.perf_counter()
+            blacklist_filter.load()
+            self.stdout.write(
+                f"filter build {built:,.1f} s, load "
+                f"{(time.perf_counter() - started) * 1000:,.1f} ms, "
+                f"{len(bloom.bits) / 2**20:,.1f} MiB, {bloom.hashes} hashes")
+            for name, serializer in (
+                ("simplejwt", serializers.TokenRefreshSerializer),
+                ("filtered", TokenRefreshSerializer),
+            ):
+                self.refreshes(name, serializer, user, options["refreshes"])
+            self.false_positives()
+            started = time.perf_counter()
+            deleted = prune_tokens(batch_size=1000)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"prune_tokens {deleted:,} expired tokens in {elapsed:,.1f} s")
+        finally:
+            user.delete()
+            if not options["keep"]:
+                with transaction.atomic():
+                    BlacklistedToken.objects.filter(
+                        token__jti__startswith=PREFIX).delete()
+                    OutstandingToken.objects.filter(
+                        jti__startswith=PREFIX).delete()
+
+    def populate(self, options):
+        existing = OutstandingToken.objects.filter(
+            jti__startswith=PREFIX).count()
+        missing = options["rows"] - existing
+        started = time.perf_counter()
+        now = aware_utcnow()
+        expires = now + timedelta(days=25)
+        expired = now - timedelta(days=1)
+        for start in range(0, max(missing, 0), options["batch_size"]):
+            size = min(options["batch_size"], missing - start)
+            with transaction.atomic():
+                tokens = OutstandingToken.objects.bulk_create(
+                    OutstandingToken(
+                        jti=f"{PREFIX}{uuid.uuid4().hex}",
+                        token="placeholder",
+                        created_at=now,
+                        expires_at=(
+                            expired if existing + start + index
+                            < options["expired"] else expires
+                        ),
+                    )
+                    for index in range(size)
+                )
+                if tokens[0].pk is None:
+                    raise CommandError("The database returned no primary keys")
+                BlacklistedToken.objects.bulk_create(
+                    BlacklistedToken(token=token) for token in tokens)
+        if missing > 0:
+            self.stdout.write(
+                f"inserted {missing:,} blacklisted tokens in "
+                f"{time.perf_counter() - started:,.0f} s")
+        self.stdout.write(
+            f"{BlacklistedToken.objects.count():,} blacklisted tokens")
+
+    def refreshes(self, name, serializer_class, user, count):
+        token = str(BaseRefreshToken.for_user(user))
+        timings = []
+        queries = 0
+        for _ in range(count):
+            executed = []
+            started = time.perf_counter()
+            with connection.execute_wrapper(
+                lambda execute, *args: executed.append(args[0]) or execute(*args)
+            ):
+                serializer = serializer_class(data={"refresh": token})
+                serializer.is_valid(raise_exception=True)
+            timings.append(time.perf_counter() - started)
+            queries += len(executed)
+            token = serializer.validated_data["refresh"]
+        timings.sort()
+        self.stdout.write(
+            f"{name:<10} p50 {statistics.median(timings) * 1000:6.2f} ms  "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1000:6.2f} ms  "
+            f"{queries / count:.1f} queries/refresh")
+
+    def false_positives(self, samples=100_000):
+        hits = sum(
+            blacklist_filter.might_contain(uuid.uuid4().hex)
+            for _ in range(samples)
+        )
+        self.stdout.write(
+            f"filter false positives {hits / samples:.2%} of {samples:,}")
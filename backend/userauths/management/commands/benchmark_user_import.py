@@ -0,0 +1,122 @@
+import json
+import os
+import secrets
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from userauths.models import Profile, User
+from userauths.provisioning import PasswordHasher, UserImport, hash_workers
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+class Command(BaseCommand):
+    """
+    Compare creating users one at a time, as registration does, with the
+    bulk import, and measure password hashing throughput.
+
+    With --hasher fast the imports use the MD5 hasher, to measure the
+    writes on their own: the default PBKDF2 hasher costs about a third of
+    a second per password and CPU, so its throughput is measured
+    separately, on --hash-sample passwords, in this process and in a pool
+    of --workers processes. The sample users are deleted afterwards.
+    """
+
+    help = "Benchmark bulk user imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--legacy-users", type=int, default=2_000)
+        parser.add_argument("--hash-sample", type=int, default=40)
+        parser.add_argument("--workers", type=int)
+        parser.add_argument("--hasher", choices=("configured", "fast"),
+                            default="fast")
+
+    def handle(self, *args, **options):
+        options["workers"] = options["workers"] or hash_workers()
+        self.hashing(options)
+        hashers = (
+            FAST_HASHERS if options["hasher"] == "fast"
+            else settings.PASSWORD_HASHERS
+        )
+        tag = f"bench{time.time_ns()}"
+        try:
+            with override_settings(PASSWORD_HASHERS=hashers):
+                self.legacy(tag, options)
+                self.bulk(tag, options)
+        finally:
+            User.objects.filter(email__endswith=f"@{tag}.example.com").delete()
+
+    def hashing(self, options):
+        passwords = [
+            secrets.token_urlsafe(12) for _ in range(options["hash_sample"])]
+        self.stdout.write(f"-- hashing ({settings.PASSWORD_HASHERS[0]}) --")
+        started = time.perf_counter()
+        for password in passwords:
+            make_password(password)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"in process  {len(passwords) / elapsed:>8,.1f} hashes/s")
+        with PasswordHasher(options["workers"]) as hasher:
+            started = time.perf_counter()
+            hasher.submit(passwords)()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{hasher.workers} processes {len(passwords) / elapsed:>6,.1f} "
+                f"hashes/s (on {os.cpu_count()} CPUs)")
+
+    def records(self, tag, start, count):
+        for index in range(start, start + count):
+            yield {
+                "email": f"user{index}@{tag}.example.com",
+                "username": f"{tag}-{index}",
+                "full_name": f"Imported User {index}",
+                "phone": f"+1555{index:07d}",
+                "password": secrets.token_urlsafe(12),
+            }
+
+    def legacy(self, tag, options):
+        count = options["legacy_users"]
+        started = time.perf_counter()
+        for record in self.records(tag, 0, count):
+            # RegisterSerializer.create()
+            user = User.objects.create(
+                full_name=record["full_name"],
+                email=record["email"],
+                phone=record["phone"],
+            )
+            user.set_password(record["password"])
+            user.save()
+        elapsed = time.perf_counter() - started
+        self.stdout.write("-- one at a time --")
+        self.stdout.write(
+            f"{count:,} users in {elapsed:,.1f} s ({count / elapsed:,.0f}/s)")
+
+    def bulk(self, tag, options):
+        start = options["legacy_users"]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as file:
+            for record in self.records(tag, start, options["users"]):
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            with open(file.name, "rb") as stream:
+                users = UserImport(stream, "jsonl", options["workers"])
+                started = time.perf_counter()
+                for _ in users.run():
+                    pass
+                elapsed = time.perf_counter() - started
+
+        profiles = Profile.objects.filter(
+            user__email__endswith=f"@{tag}.example.com").count()
+        if users.created != options["users"] or users.failed:
+            raise CommandError(f"Import failed: {users.summary()}")
+        if profiles != options["users"] + start:
+            raise CommandError(f"{profiles:,} profiles for the users")
+        self.stdout.write("-- bulk import --")
+        self.stdout.write(
+            f"{users.created:,} users in {elapsed:,.1f} s "
+            f"({users.created / elapsed:,.0f}/s)")
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from userauths.blacklist import build_filter, filter_path, save_filter
+
+
+class Command(BaseCommand):
+    """
+    Build the Bloom filter of the blacklisted refresh tokens and write it
+    to BLACKLIST_FILTER_PATH, where the serving processes pick it up.
+    Meant to run every few minutes (e.g. from cron): tokens blacklisted
+    since the last build are found by a query instead.
+    """
+
+    help = "Build the token blacklist filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", help="Write here (default: BLACKLIST_FILTER_PATH)")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        bloom = build_filter()
+        path = options["path"] or filter_path()
+        save_filter(bloom, path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote a {len(bloom.bits) / 2**20:,.1f} MiB filter to {path} "
+            f"in {time.perf_counter() - started:,.1f} s"))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from userauths.provisioning import FORMATS, UserImport, hash_workers
+
+
+class Command(BaseCommand):
+    """
+    Create users from a CSV or JSON Lines file. Running it again on the
+    same file creates only the users that are still missing.
+    """
+
+    help = "Import users from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--file-type", choices=FORMATS,
+                            help="Default: from the file extension")
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--workers", type=int,
+            help="Password hashing processes (default: "
+            "USER_IMPORT_HASH_WORKERS, or one per CPU)")
+
+    def handle(self, *args, **options):
+        file_type = options["file_type"] or os.path.splitext(
+            options["path"])[1].lstrip(".").lower()
+        if file_type not in FORMATS:
+            raise CommandError(f"Pass --file-type ({', '.join(FORMATS)})")
+
+        with open(options["path"], "rb") as stream:
+            users = UserImport(
+                stream, file_type, options["workers"] or hash_workers())
+            started = time.perf_counter()
+            for _ in users.run(options["batch_size"]):
+                self.stdout.write(
+                    f"row {users.position:,}: {users.created:,} created, "
+                    f"{users.existing:,} existing, {users.failed:,} failed")
+            elapsed = time.perf_counter() - started
+
+        for error in users.errors:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {users.created:,} users from {users.position:,} rows "
+            f"in {elapsed:.1f} s "
+            f"({users.position / max(elapsed, 1e-9):,.0f} rows/s)"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from userauths.blacklist import prune_tokens
+
+
+class Command(BaseCommand):
+    """
+    Delete expired refresh tokens and their blacklist entries in small
+    transactions, unlike flushexpiredtokens which deletes them all in
+    one. Meant to run periodically (e.g. from cron).
+    """
+
+    help = "Delete expired outstanding and blacklisted tokens"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause", type=float, default=0,
+            help="Seconds to wait between batches")
+
+    def handle(self, *args, **options):
+        deleted = prune_tokens(options["batch_size"], options["pause"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted:,} expired tokens"))
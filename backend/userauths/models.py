@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from shortuuid.django_fields import ShortUUIDField
 from django.db.models.signals import post_save
+from store.deferred import chunked, defer
 
 
 # Create my custom user model.
@@ -53,6 +54,8 @@ class Profile(models.Model):
         upload_to="image", default="default/default-user.jpg",
         null=True, blank=True
     )
+    image_variants_of = models.CharField(
+        max_length=100, blank=True, editable=False)
     full_name = models.CharField(max_length=100, null=True, blank=True)
     bio = models.TextField(null=True, blank=True)
     gender = models.CharField(max_length=100, null=True, blank=True)
@@ -110,8 +113,27 @@ def save_user_profile(sender, instance, **kwargs):
         sender: The model class that sends the signal(User model in this case)
         instance: The user instance that was saved
         **kwargs: Additional keyword arguments sent with the signal
+
+    The profiles of users saved in a transaction are synced once, when
+    it commits.
+    """
+    defer(sync_profiles, instance.pk)
+
+
+def sync_profiles(user_ids):
+    """
+    Fill in the full name of the given users' profiles that have none,
+    as Profile.save() would, in one query per chunk of users.
     """
-    instance.profile.save()
+    for ids in chunked(user_ids):
+        Profile.objects.filter(user_id__in=ids).filter(
+            models.Q(full_name__isnull=True) | models.Q(full_name="")
+        ).update(
+            full_name=models.Subquery(
+                User.objects.filter(pk=models.OuterRef("user_id"))
+                .values("full_name")[:1]
+            )
+        )
 
 
 # Connects the signal handlers to the User model's post_save
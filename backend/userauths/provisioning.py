@@ -0,0 +1,310 @@
+"""
+Bulk user provisioning.
+
+Creating a user one at a time costs a password hash and three writes:
+the user, the Profile inserted by create_user_profile and the profile
+update from save_user_profile. Onboarding a whole organisation sends one
+CSV or JSON Lines file instead, one user per record with the fields of
+USER_FIELDS; only "email" is required, and username and full name
+default to the part of the email before the "@", as in User.save().
+
+Records are read as a stream and handled USER_IMPORT_BATCH_SIZE at a
+time:
+
+- every record is validated like a registration, password validators
+  included, and checked against the emails and usernames already taken
+- the batch's passwords are hashed, hashing being CPU bound, in a pool
+  of worker processes while the previous batch is written; only the
+  import_users command starts a pool (of USER_IMPORT_HASH_WORKERS), an
+  import sent to the API hashes in the request's process
+- users and their profiles are inserted with one bulk_create each, in
+  one transaction, bypassing the per-row signals
+
+Users whose email is already registered are counted as existing, so
+importing the same file again after an interruption only creates the
+users that are missing.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, transaction
+
+from store.catalog import FORMATS, MAX_REPORTED_ERRORS, read_records
+from userauths.models import Profile, User
+
+USER_FIELDS = ("email", "username", "full_name", "phone", "password")
+
+# Passwords hashed per task sent to a worker process
+HASH_CHUNK_SIZE = 50
+
+
+def clean_user(record):
+    """
+    Validate a raw record. Returns the user's field values, with the
+    password still in clear, or raises ValidationError with a dict of
+    messages by field.
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise ValidationError({"record": ["Not valid JSON"]})
+        if not isinstance(record, dict):
+            raise ValidationError({"record": ["Expected an object"]})
+
+    errors = {}
+    unknown = set(record) - set(USER_FIELDS)
+    if unknown:
+        errors["record"] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+    if not record.get("email"):
+        errors["email"] = ["This field is required."]
+
+    values = {}
+    for name in USER_FIELDS[:-1]:
+        if name not in record:
+            continue
+        try:
+            values[name] = User._meta.get_field(name).clean(
+                str(record[name]), None)
+        except ValidationError as error:
+            errors[name] = error.messages
+    if errors:
+        raise ValidationError(errors)
+
+    local_part = values["email"].split("@")[0]
+    values.setdefault("username", local_part)
+    if not values.get("full_name"):
+        values["full_name"] = local_part
+
+    password = record.get("password")
+    if password:
+        try:
+            validate_password(str(password), User(**values))
+        except ValidationError as error:
+            raise ValidationError({"password": error.messages})
+    values["password"] = str(password) if password else None
+    return values
+
+
+def hash_workers():
+    """
+    Return the size of the hashing pool of command line imports.
+    """
+    return getattr(
+        settings, "USER_IMPORT_HASH_WORKERS", None) or os.cpu_count() or 1
+
+
+def hash_passwords(passwords):
+    """
+    Hash clear passwords with the default hasher; None gives an unusable
+    password.
+    """
+    return [make_password(password) for password in passwords]
+
+
+class PasswordHasher:
+    """
+    Hashes batches of passwords in worker processes, or in this process
+    with fewer than two workers. submit() returns a callable that waits
+    for the batch's hashes.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.executor = None
+        if self.workers > 1:
+            # Forked workers must not share the parent's connections
+            connections.close_all()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=django.setup)
+
+    def submit(self, passwords):
+        if self.executor is None:
+            hashes = hash_passwords(passwords)
+            return lambda: hashes
+        futures = [
+            self.executor.submit(
+                hash_passwords, passwords[start:start + HASH_CHUNK_SIZE])
+            for start in range(0, len(passwords), HASH_CHUNK_SIZE)
+        ]
+        return lambda: [
+            hashed for future in futures for hashed in future.result()
+        ]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _taken(rows):
+    """
+    Return the emails and usernames of `rows` that are already in use.
+    """
+    emails = set(
+        User.objects.filter(
+            email__in=[values["email"] for _, values in rows]
+        ).values_list("email", flat=True)
+    )
+    usernames = set(
+        User.objects.filter(
+            username__in=[values["username"] for _, values in rows]
+        ).values_list("username", flat=True)
+    )
+    return emails, usernames
+
+
+def write_batch(rows, hashes):
+    """
+    Insert a batch of validated (number, values) rows with their password
+    hashes, and a profile for every user, in one transaction. Returns
+    the users created.
+    """
+    users = [
+        User(**{**values, "password": hashed})
+        for (_, values), hashed in zip(rows, hashes)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        missing = [user for user in users if user.pk is None]
+        if missing:
+            ids = dict(
+                User.objects.filter(
+                    email__in=[user.email for user in missing]
+                ).values_list("email", "id")
+            )
+            for user in missing:
+                user.pk = ids[user.email]
+        # What create_user_profile and save_user_profile would store
+        Profile.objects.bulk_create(
+            [Profile(user=user, full_name=user.full_name) for user in users]
+        )
+    return users
+
+
+class UserImport:
+    """
+    Import of one user file. Iterate run() to import the file batch by
+    batch; the attributes hold the running totals. Passwords are hashed
+    in this process unless `workers` asks for a pool of processes.
+    """
+
+    def __init__(self, stream, file_type, workers=1):
+        if file_type not in FORMATS:
+            raise ValueError(f"Unknown file type {file_type}")
+        self.stream = stream
+        self.file_type = file_type
+        self.workers = workers
+        self.position = 0
+        self.created = 0
+        self.existing = 0
+        self.failed = 0
+        self.errors = []
+        # Emails and usernames of earlier batches, not all written yet
+        self.emails = set()
+        self.usernames = set()
+
+    def _record_errors(self, errors):
+        self.failed += len(errors)
+        room = MAX_REPORTED_ERRORS - len(self.errors)
+        self.errors += [
+            {"row": number, "errors": messages}
+            for number, messages in errors[:max(room, 0)]
+        ]
+
+    def _prepare(self, batch):
+        """
+        Validate a batch and drop the rows whose email or username is
+        taken. Returns the rows left and the errors.
+        """
+        rows, errors = [], []
+        for number, record in batch:
+            try:
+                rows.append((number, clean_user(record)))
+            except ValidationError as error:
+                errors.append((number, error.message_dict))
+
+        emails, usernames = _taken(rows)
+        kept = []
+        for number, values in rows:
+            if values["email"] in emails:
+                self.existing += 1
+            elif values["email"] in self.emails:
+                errors.append((number, {"email": [
+                    "Email already given in an earlier row."]}))
+            elif (values["username"] in usernames
+                  or values["username"] in self.usernames):
+                errors.append((number, {"username": [
+                    "User with this username already exists."]}))
+            else:
+                self.emails.add(values["email"])
+                self.usernames.add(values["username"])
+                kept.append((number, values))
+        return kept, sorted(errors, key=lambda error: error[0])
+
+    def _write(self, position, rows, hashes, errors):
+        hashes = hashes()
+        try:
+            created = write_batch(rows, hashes)
+        except IntegrityError:
+            # Someone registered one of the batch's users meanwhile
+            emails, usernames = _taken(rows)
+            kept = []
+            for (number, values), hashed in zip(rows, hashes):
+                if values["email"] in emails:
+                    self.existing += 1
+                elif values["username"] in usernames:
+                    errors.append((number, {"username": [
+                        "User with this username already exists."]}))
+                else:
+                    kept.append(((number, values), hashed))
+            created = write_batch(
+                [row for row, _ in kept], [hashed for _, hashed in kept])
+            errors.sort(key=lambda error: error[0])
+        self.position = position
+        self.created += len(created)
+        self._record_errors(errors)
+
+    def run(self, batch_size=None):
+        """
+        Import the file. Yields after every batch written.
+        """
+        batch_size = batch_size or getattr(
+            settings, "USER_IMPORT_BATCH_SIZE", 1000)
+        records = enumerate(read_records(self.stream, self.file_type), 1)
+        with PasswordHasher(self.workers) as hasher:
+            pending = None
+            while batch := list(islice(records, batch_size)):
+                rows, errors = self._prepare(batch)
+                hashes = hasher.submit(
+                    [values.pop("password") for _, values in rows])
+                # The workers hash this batch while the last one is written
+                if pending:
+                    self._write(*pending)
+                    yield self
+                pending = (batch[-1][0], rows, hashes, errors)
+            if pending:
+                self._write(*pending)
+                yield self
+
+    def summary(self):
+        return {
+            "rows": self.position,
+            "created": self.created,
+            "existing": self.existing,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
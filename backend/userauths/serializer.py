@@ -2,6 +2,7 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import serializers
 from userauths.models import User, Profile
+from store.images import ImageVariantsField
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -26,7 +27,7 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         - username
 
         It inculdes user's brand_id if it is assciated with a brand,else
-        brand id is set to 0
+        brand id is set to 0. LoginBackend loads the brand with the user.
         Reaturns the enhanced token with additional information
         """
         token = super().get_token(user)
@@ -34,10 +35,9 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         token["full_name"] = user.full_name
         token["email"] = user.email
         token["username"] = user.username
-        try:
-            token["brand_id"] = user.brand.id
-        except AttributeError:
-            token["brand_id"] = 0
+        # The reverse one-to-one raises (an AttributeError) without a brand
+        brand = getattr(user, "vendor", None)
+        token["brand_id"] = brand.id if brand else 0
 
         return token
 
@@ -105,6 +105,8 @@ class ProfileSerializer(serializers.ModelSerializer):
     Serializer for the Profile model
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         """
         Meta class specifying the model and field for serialization
@@ -1,3 +1,214 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from brand.models import Brand
+from userauths.authentication import TokenClaimsAuthentication
+from userauths.blacklist import (
+    BlacklistFilter,
+    BloomFilter,
+    RefreshToken,
+    TokenRefreshSerializer,
+    save_filter,
+)
+from userauths.models import Profile, User
+from userauths.serializer import MyTokenObtainPairSerializer
+
+
+class ProfileSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="profile@example.com", username="profile")
+        # A profile left without a name, for the sync to fill in
+        Profile.objects.filter(user=self.user).update(full_name="")
+
+    def test_user_saved_twice_syncs_the_profile_once(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                self.user.full_name = "Pro File"
+                self.user.save()
+                self.user.set_password("Profile-pass-42")
+                self.user.save()
+        self.assertEqual(len(callbacks), 2)
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(
+            Profile.objects.get(user=self.user).full_name, "Pro File")
+
+
+class TokenClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="claims@example.com", username="claims")
+        self.token = MyTokenObtainPairSerializer.get_token(
+            self.user).access_token
+
+    def authenticate(self, method):
+        request = getattr(APIRequestFactory(), method)(
+            "/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        user, _ = TokenClaimsAuthentication().authenticate(Request(request))
+        return user
+
+    def test_reads_trust_the_claims(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertNumQueries(0):
+            user = self.authenticate("get")
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.email, "claims@example.com")
+
+    def test_writes_load_the_user(self):
+        for method in ("post", "put", "patch", "delete"):
+            with self.assertNumQueries(1):
+                user = self.authenticate(method)
+            self.assertTrue(user.is_active)
+
+    def test_writes_refuse_inactive_users(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaisesMessage(AuthenticationFailed, "inactive"):
+            self.authenticate("post")
+
+    def test_writes_refuse_deleted_users(self):
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, "not found"):
+            self.authenticate("put")
+
+    @override_settings(JWT_TRUST_CLAIMS_ON_READ=False)
+    def test_untrusted_reads_load_the_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate("get")
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class LoginTests(APITestCase):
+    url = "/api/v1/user/token/"
+    password = "Login-pass-42"
+
+    def create_user(self, name):
+        user = User.objects.create(email=f"{name}@example.com", username=name)
+        user.set_password(self.password)
+        user.save()
+        return user
+
+    def login(self, user):
+        response = self.client.post(
+            self.url, {"email": user.email, "password": self.password})
+        self.assertEqual(response.status_code, 200, response.content)
+        return AccessToken(response.json()["access"])
+
+    def test_brand_id_claim(self):
+        vendor = self.create_user("vendor")
+        brand = Brand.objects.create(name="Vendor", slug="vendor", user=vendor)
+        self.assertEqual(self.login(vendor)["brand_id"], brand.id)
+        self.assertEqual(self.login(self.create_user("buyer"))["brand_id"], 0)
+
+    def test_hash_upgraded_after_login(self):
+        user = self.create_user("upgrade")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.login(user)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertTrue(user.check_password(self.password))
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class UserImportTests(APITestCase):
+    url = "/api/v1/user/import/"
+
+    def test_api_imports_hash_in_process(self):
+        self.client.force_authenticate(User.objects.create(
+            email="admin@example.com", username="admin", is_staff=True))
+        records = "".join(
+            json.dumps({"email": f"new{index}@example.com",
+                        "password": "Imported-pass-42"}) + "\n"
+            for index in range(3)
+        )
+        with mock.patch(
+            "userauths.provisioning.ProcessPoolExecutor"
+        ) as pool, mock.patch(
+            "userauths.provisioning.connections.close_all"
+        ) as close_all:
+            response = self.client.post(self.url, {
+                "file": SimpleUploadedFile("users.jsonl", records.encode())})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 3)
+        pool.assert_not_called()
+        close_all.assert_not_called()
+        self.assertTrue(User.objects.get(
+            email="new1@example.com").check_password("Imported-pass-42"))
+
+
+class FilterFileMixin:
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "filter.bin")
+        self.settings_override = override_settings(
+            BLACKLIST_FILTER_PATH=self.path, BLACKLIST_FILTER_RELOAD=0)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def save(self, *jtis):
+        bloom = BloomFilter(100)
+        for jti in jtis:
+            bloom.add(jti)
+        save_filter(bloom)
+
+
+class BlacklistFilterTests(FilterFileMixin, SimpleTestCase):
+    def test_not_ready_without_a_file(self):
+        self.assertFalse(BlacklistFilter().ready())
+
+    def test_loads_the_file_when_it_changes(self):
+        blacklist = BlacklistFilter()
+        self.save("first")
+        self.assertTrue(blacklist.ready())
+        self.assertTrue(blacklist.might_contain("first"))
+        self.save("second")
+        blacklist.ready()
+        self.assertTrue(blacklist.might_contain("second"))
+        self.assertFalse(blacklist.might_contain("first"))
+
+    def test_unreadable_file_is_not_retried(self):
+        blacklist = BlacklistFilter()
+        with open(self.path, "wb") as file:
+            file.write(b"garbage")
+        with self.assertLogs("userauths.blacklist", "ERROR"):
+            self.assertFalse(blacklist.ready())
+        with self.assertNoLogs("userauths.blacklist", "ERROR"):
+            self.assertFalse(blacklist.ready())
+        self.save("jti")
+        self.assertTrue(blacklist.ready())
+
+
+class TokenRefreshTests(FilterFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(
+            email="refresh@example.com", username="refresh")
+
+    def refresh(self, token):
+        serializer = TokenRefreshSerializer(data={"refresh": str(token)})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data["refresh"]
+
+    def test_rotated_token_is_refused_past_a_stale_filter(self):
+        token = RefreshToken.for_user(self.user)
+        self.save()
+        # Blacklisting the token, without asking first whether it is
+        with self.assertNumQueries(5):
+            self.refresh(token)
+        with self.assertRaises(TokenError):
+            self.refresh(token)
@@ -1,12 +1,13 @@
 from django.shortcuts import render
 from rest_framework import generics
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 
 from userauths.models import User, Profile
+from userauths.provisioning import FORMATS, UserImport
 from userauths.serializer import (
     MyTokenObtainPairSerializer,
     ProfileSerializer,
@@ -75,12 +76,16 @@ class RegisterView(generics.CreateAPIView):
     - Permission class is set to allow unrestricted acess to the registeration
     endpoint(can be acessed by both authenticated and unauthenticated users)
 
+    - throttle_scope limits registrations per client (see
+    DEFAULT_THROTTLE_RATES)
+
     - Serializer class is set to the custom RegisterSerializer class to be
     able to validate and handle registration data
     """
 
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
+    throttle_scope = "register"
     serializer_class = RegisterSerializer
 
     @swagger_auto_schema(
@@ -124,6 +129,57 @@ class RegisterView(generics.CreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
+class UserImportView(generics.GenericAPIView):
+    """
+    API view for provisioning many users at once from a file
+
+    - Only staff users may import users
+    - Passwords are hashed in the request's process, users and profiles
+    are inserted in batches (see userauths/provisioning.py); the
+    import_users command hashes large files in a pool of processes
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    @swagger_auto_schema(
+        operation_summary="Import Users",
+        operation_description="Create the users of a CSV or JSON Lines "
+        "file, one user per record with email and optionally username, "
+        "full_name, phone and password. Users whose email is registered "
+        "already are skipped.",
+        manual_parameters=[
+            openapi.Parameter(
+                "file", openapi.IN_FORM, type=openapi.TYPE_FILE,
+                required=True, description="User file, one user per record",
+            ),
+            openapi.Parameter(
+                "file_type", openapi.IN_FORM, type=openapi.TYPE_STRING,
+                enum=list(FORMATS),
+                description="File format (default: from the file name)",
+            ),
+        ],
+        responses={
+            200: "OK - Users created, with per-row errors.",
+            400: "Bad Request - Missing file.",
+            403: "Forbidden - Not a staff user.",
+        },
+    )
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "Upload a CSV or JSON Lines file"})
+        file_type = request.data.get(
+            "file_type", upload.name.rsplit(".", 1)[-1].lower())
+        if file_type not in FORMATS:
+            raise ValidationError(
+                {"file_type": f"Choose one of {', '.join(FORMATS)}"})
+
+        users = UserImport(upload.file, file_type)
+        for _ in users.run():
+            pass
+        return Response(users.summary())
+
+
 def generate_otp():
     """
     Generates a unique 8-character OTP
@@ -145,6 +201,7 @@ class PasswordResetAPI(generics.RetrieveAPIView):
     """
 
     permission_classes = (AllowAny,)
+    throttle_scope = "password-reset"
     serializer_class = UserSerializer
 
     def get_object(self):
@@ -178,10 +235,12 @@ class PasswordChangeApi(generics.CreateAPIView):
     API view for changing the user's password
 
     - permission_classes is set to allow unrestricted access(for password change)   # nopep8
+    - throttle_scope limits the attempts per client
     - serializer_class is set to custom UserSerializer class
     """
 
     permission_classes = (AllowAny,)
+    throttle_scope = "password-change"
     serializer_class = UserSerializer
 
     def create(self, request, *args, **kwargs):